@@ -0,0 +1,461 @@
+"""Microbenchmarks of every DAO method against a synthetic dataset.
+
+Results are written as JSON, so runs on different branches can be compared with --compare.
+The target database is wiped, so never point this at production data.
+
+Usage:
+    python -m benchmarks.dao_bench --users 1000 --doujin 50000 --reservations 100000 --doujin-skew 1.2 \
+        --output main.json
+    python -m benchmarks.dao_bench --users 1000 --doujin 50000 --reservations 100000 --doujin-skew 1.2 \
+        --output branch.json --compare main.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, namedtuple
+from collections.abc import Callable
+from datetime import datetime
+from pathlib import Path
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPOSITORY_ROOT))
+
+from benchmarks.dataset import Dataset, generate_dataset, seed_database
+
+# prepare returns the argument tuples of each iteration, which run is timed with
+Benchmark = namedtuple("Benchmark", ["name", "prepare", "run"])
+
+
+def define_benchmarks(dao, dataset: Dataset, rng: random.Random, iterations: int):
+    """Define the benchmark of each DAO method.
+
+    Parameters
+    ----------
+    dao : DAO
+        DAO connected to the seeded database
+    dataset : Dataset
+        Dataset the database was seeded with
+    rng : random.Random
+        Random number generator used to pick arguments
+    iterations : int
+        Number of iterations of each benchmark, the retrieve_all_* benchmarks run 50 times less
+
+    Returns
+    -------
+    list[Benchmark]
+        Benchmarks, in the order they should be ran
+
+    """
+    users, doujins = dataset.users, dataset.doujins
+    reservations_per_user = Counter(
+        reservation["user_id"] for reservation in dataset.reservations
+    )
+    reservations_per_doujin = Counter(
+        reservation["doujin_id"] for reservation in dataset.reservations
+    )
+    heaviest_user = max(users, key=lambda user: reservations_per_user[user["_id"]])
+    most_reserved_doujin = max(
+        doujins, key=lambda doujin: reservations_per_doujin[doujin["_id"]]
+    )
+    reserved_pairs = {
+        (reservation["user_id"], reservation["doujin_id"])
+        for reservation in dataset.reservations
+    }
+
+    def unreserved_pairs():
+        pairs = []
+        while len(pairs) < iterations:
+            user, doujin = rng.choice(users), rng.choice(doujins)
+            if (user["_id"], doujin["_id"]) not in reserved_pairs:
+                reserved_pairs.add((user["_id"], doujin["_id"]))
+                pairs.append(
+                    (
+                        dao.get_user_by_discord_id(
+                            user["discord_id"], user["guild_id"]
+                        ),
+                        dao.get_doujin_by_id_with_reservation_data(
+                            doujin["_id"], user["guild_id"]
+                        ),
+                    )
+                )
+        return pairs
+
+    # Reservations added by the add_reservation benchmark are removed by the remove_reservation benchmark
+    added_reservations = []
+
+    def prepare_search(query):
+        # Seeded doujin don't have their search terms yet
+        dao.index_search_ngrams()
+        return [
+            (query(rng.randrange(len(doujins))), rng.choice(guild_ids))
+            for _ in range(iterations)
+        ]
+
+    def prepare_add_reservation():
+        added_reservations.extend(unreserved_pairs())
+        return added_reservations
+
+    def prepare_remove_reservation():
+        return [
+            (
+                dao.get_user_by_id_with_reservation_data(user._id),
+                dao.get_doujin_by_id_with_reservation_data(doujin._id, user.guild_id),
+            )
+            for user, doujin in added_reservations
+        ]
+
+    def sample(documents, key, count=iterations):
+        return [(rng.choice(documents)[key],) for _ in range(count)]
+
+    def sample_in_guild(documents, key, count=iterations):
+        return [
+            (rng.choice(documents)[key], rng.choice(users)["guild_id"])
+            for _ in range(count)
+        ]
+
+    def sample_users(count=iterations):
+        return [
+            (user["discord_id"], user["guild_id"])
+            for user in (rng.choice(users) for _ in range(count))
+        ]
+
+    guild_ids = sorted({user["guild_id"] for user in users})
+    largest_guild_id = Counter(user["guild_id"] for user in users).most_common(1)[0][0]
+
+    return [
+        Benchmark(
+            "get_user_by_discord_id",
+            sample_users,
+            dao.get_user_by_discord_id,
+        ),
+        Benchmark(
+            "get_user_by_discord_id[heaviest_user]",
+            lambda: (
+                [(heaviest_user["discord_id"], heaviest_user["guild_id"])] * iterations
+            ),
+            dao.get_user_by_discord_id,
+        ),
+        Benchmark(
+            "get_user_by_id",
+            lambda: sample(users, "_id"),
+            dao.get_user_by_id,
+        ),
+        Benchmark(
+            "get_user_by_id_with_reservation_data",
+            lambda: sample(users, "_id"),
+            dao.get_user_by_id_with_reservation_data,
+        ),
+        Benchmark(
+            "get_doujin_by_url",
+            lambda: sample_in_guild(doujins, "url"),
+            dao.get_doujin_by_url,
+        ),
+        Benchmark(
+            "get_doujin_by_id",
+            lambda: sample(doujins, "_id"),
+            dao.get_doujin_by_id,
+        ),
+        Benchmark(
+            "get_doujin_by_id_with_reservation_data",
+            lambda: sample_in_guild(doujins, "_id"),
+            dao.get_doujin_by_id_with_reservation_data,
+        ),
+        Benchmark(
+            "get_doujin_by_id_with_reservation_data[most_reserved]",
+            lambda: [(most_reserved_doujin["_id"], largest_guild_id)] * iterations,
+            dao.get_doujin_by_id_with_reservation_data,
+        ),
+        Benchmark(
+            "get_doujins_by_ids_with_reservation_data[5]",
+            lambda: [
+                (
+                    [doujin["_id"] for doujin in rng.sample(doujins, 5)],
+                    rng.choice(guild_ids),
+                )
+                for _ in range(iterations)
+            ],
+            dao.get_doujins_by_ids_with_reservation_data,
+        ),
+        Benchmark(
+            "search_doujin[selective]",
+            lambda: prepare_search(str),
+            dao.search_doujin,
+        ),
+        Benchmark(
+            "search_doujin[common]",
+            lambda: prepare_search(lambda index: "タイトル"),
+            dao.search_doujin,
+        ),
+        Benchmark(
+            "add_reservation",
+            prepare_add_reservation,
+            dao.add_reservation,
+        ),
+        Benchmark(
+            "remove_reservation",
+            prepare_remove_reservation,
+            dao.remove_reservation,
+        ),
+        Benchmark(
+            "add_user",
+            lambda: [
+                (10**18 + index, f"bench{index}", rng.choice(guild_ids))
+                for index in range(iterations)
+            ],
+            dao.add_user,
+        ),
+        Benchmark(
+            "add_doujin",
+            lambda: [
+                (
+                    f"https://melonbooks.co.jp/detail/detail.php?product_id=bench{index}",
+                    f"Bench {index}",
+                    1000,
+                    "Bench Circle",
+                    ["Bench Author"],
+                    ["オリジナル"],
+                    ["コミックマーケット105"],
+                    False,
+                    "https://cdn.example.com/bench.jpg",
+                )
+                for index in range(iterations)
+            ],
+            dao.add_doujin,
+        ),
+        Benchmark(
+            "retrieve_user_totals",
+            lambda: [(largest_guild_id,)] * max(1, iterations // 50),
+            dao.retrieve_user_totals,
+        ),
+        Benchmark(
+            "retrieve_top_doujin",
+            lambda: [(largest_guild_id,)] * iterations,
+            dao.retrieve_top_doujin,
+        ),
+        Benchmark(
+            "retrieve_top_groups[circle]",
+            lambda: [(largest_guild_id, "circle_name")] * max(1, iterations // 10),
+            dao.retrieve_top_groups,
+        ),
+        Benchmark(
+            "retrieve_all_users",
+            lambda: [(largest_guild_id,)] * max(1, iterations // 50),
+            dao.retrieve_all_users,
+        ),
+        Benchmark(
+            "retrieve_all_doujin",
+            lambda: [(largest_guild_id,)] * max(1, iterations // 50),
+            dao.retrieve_all_doujin,
+        ),
+    ]
+
+
+def measure(run: Callable, arguments: list[tuple]) -> dict:
+    """Time every call of a DAO method, counting the MongoDB operations it makes.
+
+    Parameters
+    ----------
+    run : Callable
+        DAO method
+    arguments : list[tuple]
+        Arguments of each call
+
+    Returns
+    -------
+    dict
+        Timing statistics, in milliseconds, MongoDB operations and bytes received per call
+
+    """
+    from src.query_log import CommandQueryLog, current_query_log
+
+    timings = []
+    mongo_ops = []
+    reply_bytes = []
+    for argument in arguments:
+        query_log = CommandQueryLog("benchmark")
+        token = current_query_log.set(query_log)
+        start = time.perf_counter()
+        try:
+            run(*argument)
+        finally:
+            timings.append((time.perf_counter() - start) * 1000)
+            current_query_log.reset(token)
+        mongo_ops.append(query_log.round_trips)
+        reply_bytes.append(query_log.reply_bytes)
+
+    timings.sort()
+    return {
+        "iterations": len(timings),
+        "min_ms": timings[0],
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": timings[len(timings) // 2],
+        "p95_ms": timings[min(len(timings) - 1, int(len(timings) * 0.95))],
+        "mongo_ops": statistics.fmean(mongo_ops),
+        "reply_bytes": statistics.fmean(reply_bytes),
+    }
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> bool:
+    """Print how the results compare to a baseline.
+
+    Parameters
+    ----------
+    results : dict
+        Results of this run
+    baseline : dict
+        Results of a previous run
+    threshold : float
+        Relative increase of the median latency considered a regression
+
+    Returns
+    -------
+    bool
+        Whether or not any benchmark regressed.
+
+    """
+    regressed = False
+    print(
+        f"{'benchmark':<55} {'base p50':>10} {'p50':>10} {'change':>8} {'base bytes':>12} {'bytes':>12}"
+    )
+    for name, stats in results["results"].items():
+        base_stats = baseline["results"].get(name)
+        if base_stats is None:
+            print(f"{name:<55} {'-':>10} {stats['p50_ms']:>10.3f} {'new':>8}")
+            continue
+
+        bytes_columns = (
+            f" {base_stats.get('reply_bytes', 0):>12.0f} {stats['reply_bytes']:>12.0f}"
+        )
+
+        change = (stats["p50_ms"] - base_stats["p50_ms"]) / base_stats["p50_ms"]
+        flag = ""
+        if change > threshold:
+            regressed = True
+            flag = " REGRESSION"
+        print(
+            f"{name:<55} {base_stats['p50_ms']:>10.3f} {stats['p50_ms']:>10.3f} {change:>+8.1%}{bytes_columns}{flag}"
+        )
+
+    return regressed
+
+
+def git_commit() -> str | None:
+    """Retrieve the commit the benchmarks are ran on.
+
+    Returns
+    -------
+    str | None
+        Commit hash, or None if it couldn't be determined.
+
+    """
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=REPOSITORY_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    """Run the benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="comiket_bench")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--doujin", type=int, default=50000)
+    parser.add_argument("--reservations", type=int, default=100000)
+    parser.add_argument("--user-skew", type=float, default=1.1)
+    parser.add_argument("--doujin-skew", type=float, default=1.2)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--output", type=Path, help="Write the results to this file")
+    parser.add_argument("--compare", type=Path, help="Results of a previous run")
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.environ["MONGO_DB_NAME"] = args.database
+
+    from pymongo import MongoClient, monitoring
+
+    from src.currency import Currency
+    from src.dao import DAO
+    from src.query_log import ReplySizeListener
+
+    # Must be registered before the DAO creates its client
+    monitoring.register(ReplySizeListener())
+
+    dataset = generate_dataset(
+        args.users,
+        args.doujin,
+        args.reservations,
+        seed=args.seed,
+        user_skew=args.user_skew,
+        doujin_skew=args.doujin_skew,
+        num_guilds=args.guilds,
+    )
+    seed_database(MongoClient(args.mongo_url).get_database(args.database), dataset)
+
+    # Avoid calling the currency API during the benchmarks
+    currency = Currency("bench", log_file=os.devnull)
+    currency.current_rate = 0.0067
+    currency.last_update = datetime.now()
+    dao = DAO(args.mongo_url, currency)
+    dao.create_indexes()
+
+    rng = random.Random(args.seed)
+    results = {
+        "metadata": {
+            "git_commit": git_commit(),
+            "python": platform.python_version(),
+            "datetime": datetime.now().isoformat(),
+            "dataset": {
+                "users": args.users,
+                "doujin": args.doujin,
+                "reservations": len(dataset.reservations),
+                "user_skew": args.user_skew,
+                "doujin_skew": args.doujin_skew,
+                "guilds": args.guilds,
+                "seed": args.seed,
+            },
+        },
+        "results": {},
+    }
+    for benchmark in define_benchmarks(dao, dataset, rng, args.iterations):
+        if args.only and args.only not in benchmark.name:
+            continue
+
+        arguments = benchmark.prepare()
+        if not arguments:
+            continue
+
+        stats = measure(benchmark.run, arguments)
+        results["results"][benchmark.name] = stats
+        print(
+            f"{benchmark.name:<55} p50 {stats['p50_ms']:>9.3f} ms  p95 {stats['p95_ms']:>9.3f} ms  "
+            f"mongo ops {stats['mongo_ops']:>7.1f}  reply {stats['reply_bytes'] / 1024:>9.1f} KiB"
+        )
+
+    if args.output is not None:
+        args.output.write_text(json.dumps(results, indent=2))
+
+    if args.compare is not None:
+        baseline = json.loads(args.compare.read_text())
+        if compare(results, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
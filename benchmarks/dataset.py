@@ -0,0 +1,242 @@
+"""Synthetic dataset generator matching the schema of the users, doujins, reservations and doujin_stats collections.
+
+The target database is wiped, so never point this at production data.
+
+Usage:
+    python -m benchmarks.dataset --mongo-url mongodb://localhost:27017 --users 1000 --doujin 50000 \
+        --reservations 100000 --user-skew 1.1 --doujin-skew 1.2 --guilds 10
+"""
+
+import argparse
+import random
+from collections import Counter, namedtuple
+from datetime import UTC, datetime, timedelta
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+from pymongo.database import Database
+
+Dataset = namedtuple("Dataset", ["users", "doujins", "reservations", "doujin_stats"])
+
+GENRES = ["オリジナル", "東方Project", "艦隊これくしょん", "ブルーアーカイブ", "原神"]
+EVENTS = ["コミックマーケット104", "コミックマーケット105", "例大祭21"]
+FIXTURE_URL = "https://melonbooks.co.jp/detail/detail.php?product_id={product_id}"
+FIRST_GUILD_ID = 10**18
+
+
+def zipf_weights(count: int, exponent: float) -> list[float]:
+    """Compute cumulative Zipf weights, so that item i is chosen proportionally to 1 / (i + 1) ** exponent.
+
+    Parameters
+    ----------
+    count : int
+        Number of items
+    exponent : float
+        Skew of the distribution, 0 is uniform
+
+    Returns
+    -------
+    list[float]
+        Cumulative weights, usable with random.choices
+
+    """
+    cumulative_weights = []
+    total = 0.0
+    for index in range(count):
+        total += 1 / (index + 1) ** exponent
+        cumulative_weights.append(total)
+
+    return cumulative_weights
+
+
+def generate_dataset(
+    num_users: int,
+    num_doujin: int,
+    num_reservations: int,
+    seed: int = 0,
+    base_url: str = FIXTURE_URL,
+    user_skew: float = 0,
+    doujin_skew: float = 0,
+    num_guilds: int = 1,
+) -> Dataset:
+    """Generate user, doujin and reservation documents.
+
+    Parameters
+    ----------
+    num_users : int
+        Number of users to generate
+    num_doujin : int
+        Number of doujin to generate
+    num_reservations : int
+        Number of reservations to generate, capped at num_users * num_doujin
+    seed : int
+        Seed of the random number generator, the same seed always generates the same dataset
+    base_url : str
+        Format string of doujin URLs, with a product_id field
+    user_skew : float
+        Zipf exponent of how reservations are spread across users, 0 is uniform.
+        Higher values concentrate reservations on a few heavy users.
+    doujin_skew : float
+        Zipf exponent of how reservations are spread across doujin, 0 is uniform.
+        Higher values concentrate reservations on a few popular doujin.
+    num_guilds : int
+        Number of Discord servers users are spread across, round robin from FIRST_GUILD_ID.
+
+    Returns
+    -------
+    Dataset
+        User, doujin, reservation and reservation count documents, ready to be inserted.
+
+    """
+    rng = random.Random(seed)
+    now = datetime.now(UTC)
+
+    doujins = []
+    for index in range(num_doujin):
+        price_in_yen = rng.randrange(500, 5000, 100)
+        doujins.append(
+            {
+                "_id": ObjectId(rng.randbytes(12)),
+                "title": f"Doujin {index} {'タイトル' * rng.randint(1, 4)}",
+                "price_in_yen": price_in_yen,
+                "price_in_usd": price_in_yen * 0.0067,
+                "image_preview_url": f"https://cdn.example.com/{index}.jpg",
+                "url": base_url.format(product_id=index),
+                "is_r18": rng.random() < 0.3,
+                "circle_name": f"Circle {index % max(1, num_doujin // 5)}",
+                "author_names": [f"Author {rng.randrange(num_doujin)}"],
+                "genres": rng.sample(GENRES, rng.randint(1, 2)),
+                "events": rng.sample(EVENTS, 1),
+                "last_updated": now,
+            }
+        )
+
+    users = [
+        {
+            "_id": ObjectId(rng.randbytes(12)),
+            "guild_id": FIRST_GUILD_ID + index % num_guilds,
+            "discord_id": 10**17 + index,
+            "name": f"user{index}",
+            "reservation_count": 0,
+            "total_yen": 0,
+            "total_usd": 0.0,
+            "last_updated": now,
+        }
+        for index in range(num_users)
+    ]
+
+    user_weights = zipf_weights(num_users, user_skew)
+    doujin_weights = zipf_weights(num_doujin, doujin_skew)
+    user_indices = range(num_users)
+    doujin_indices = range(num_doujin)
+
+    # Heavily skewed distributions keep drawing the same pairs, so give up eventually
+    num_reservations = min(num_reservations, num_users * num_doujin)
+    remaining_attempts = num_reservations * 20
+    reserved = set()
+    reservations = []
+    while len(reserved) < num_reservations and remaining_attempts > 0:
+        remaining_attempts -= 1
+        user_index = rng.choices(user_indices, cum_weights=user_weights)[0]
+        doujin_index = rng.choices(doujin_indices, cum_weights=doujin_weights)[0]
+        if (user_index, doujin_index) in reserved:
+            continue
+
+        reserved.add((user_index, doujin_index))
+        user, doujin = users[user_index], doujins[doujin_index]
+        user["reservation_count"] += 1
+        user["total_yen"] += doujin["price_in_yen"]
+        user["total_usd"] += doujin["price_in_usd"]
+        reservations.append(
+            {
+                "_id": ObjectId(rng.randbytes(12)),
+                "guild_id": user["guild_id"],
+                "user_id": user["_id"],
+                "doujin_id": doujin["_id"],
+                "datetime_added": now - timedelta(seconds=rng.randrange(86400 * 30)),
+            }
+        )
+
+    doujin_by_id = {doujin["_id"]: doujin for doujin in doujins}
+    reservation_counts = Counter(
+        (reservation["guild_id"], reservation["doujin_id"])
+        for reservation in reservations
+    )
+    doujin_stats = [
+        {
+            "guild_id": guild_id,
+            "doujin_id": doujin_id,
+            "reservation_count": reservation_count,
+            **{
+                field: doujin_by_id[doujin_id][field]
+                for field in ("title", "url", "circle_name", "events", "price_in_yen")
+            },
+        }
+        for (guild_id, doujin_id), reservation_count in reservation_counts.items()
+    ]
+
+    return Dataset(
+        users=users,
+        doujins=doujins,
+        reservations=reservations,
+        doujin_stats=doujin_stats,
+    )
+
+
+def seed_database(db: Database, dataset: Dataset, batch_size: int = 1000) -> None:
+    """Replace the contents of the users, doujins, reservations and doujin_stats collections with a dataset.
+
+    Parameters
+    ----------
+    db : Database
+        Database to seed
+    dataset : Dataset
+        Dataset to insert
+    batch_size : int
+        Number of documents to insert per request
+
+    """
+    for collection_name, documents in (
+        ("users", dataset.users),
+        ("doujins", dataset.doujins),
+        ("reservations", dataset.reservations),
+        ("doujin_stats", dataset.doujin_stats),
+    ):
+        collection = db.get_collection(collection_name)
+        collection.delete_many({})
+        for start in range(0, len(documents), batch_size):
+            collection.insert_many(documents[start : start + batch_size], ordered=False)
+
+
+def main():
+    """Seed a database from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="comiket_bench")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--doujin", type=int, default=50000)
+    parser.add_argument("--reservations", type=int, default=100000)
+    parser.add_argument("--user-skew", type=float, default=0)
+    parser.add_argument("--doujin-skew", type=float, default=0)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    dataset = generate_dataset(
+        args.users,
+        args.doujin,
+        args.reservations,
+        seed=args.seed,
+        user_skew=args.user_skew,
+        doujin_skew=args.doujin_skew,
+        num_guilds=args.guilds,
+    )
+    seed_database(MongoClient(args.mongo_url).get_database(args.database), dataset)
+
+    print(
+        f"Seeded {len(dataset.users)} users, {len(dataset.doujins)} doujin and {len(dataset.reservations)} reservations"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Local HTTP server serving Melonbooks-like product pages, so the scraper can be exercised offline."""
+
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_PATH = "/melonbooks"
+PRODUCT_PATH = f"{BASE_PATH}/detail/detail.php"
+LISTING_PATH = f"{BASE_PATH}/search/search.php"
+# Number of products per listing page
+LISTING_PAGE_SIZE = 30
+
+PRODUCT_PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>{title}</title></head>
+<body>
+<div class="item-img"><img src="//cdn.example.com/{product_id}.jpg"></div>
+<h1 class="page-header">{title}</h1>
+<span class="yen">¥{price:,}</span>
+<div class="table-wrapper">
+<table>
+<tr>
+<th>サークル名</th>
+<td><a href="#">Fixture Circle {circle}\xa0(作品数:10)</a></td>
+</tr>
+<tr>
+<th>作家名</th>
+<td><a href="#">Author {circle}</a>, <a href="#">Guest {product_id}</a></td>
+</tr>
+<tr>
+<th>ジャンル</th>
+<td><a href="#">オリジナル</a></td>
+</tr>
+<tr>
+<th>イベント</th>
+<td><a href="#">コミックマーケット105</a></td>
+</tr>
+<tr>
+<th>作品種別</th>
+<td>{rating}</td>
+</tr>
+</table>
+</div>
+</body>
+</html>
+"""
+
+
+LISTING_PAGE = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Search</title></head>
+<body>
+<ul class="product-list">
+{products}
+</ul>
+</body>
+</html>
+"""
+
+LISTING_PRODUCT = """<li class="product">
+<a href="{path}?product_id={product_id}&amp;adult_view=1"><img src="//cdn.example.com/{product_id}.jpg"></a>
+<a href="{path}?product_id={product_id}">Fixture Doujin {product_id}</a>
+</li>"""
+
+
+class FixtureRequestHandler(BaseHTTPRequestHandler):
+    """Serves a deterministic product page for every product id, and listing pages of the server's catalogue.
+
+    Every product of the catalogue belongs to the event コミックマーケット105, and product N to Fixture Circle N % 97.
+    """
+
+    def do_GET(self):
+        """Respond to a GET request."""
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == LISTING_PATH:
+            self.send_listing(query)
+            return
+
+        product_ids = query.get("product_id")
+        if url.path != PRODUCT_PATH or not product_ids or not product_ids[0].isdigit():
+            self.send_error(404)
+            return
+
+        product_id = int(product_ids[0])
+        self.send_html(
+            PRODUCT_PAGE.format(
+                product_id=product_id,
+                title=f"Fixture Doujin {product_id}",
+                price=500 + (product_id % 40) * 100,
+                circle=product_id % 97,
+                rating="18禁" if product_id % 3 == 0 else "全年齢",
+            )
+        )
+
+    def send_listing(self, query: dict[str, list[str]]):
+        """Respond with a page of the products of an event or circle, past the last page the page is empty."""
+        text_type = query.get("text_type", [""])[0]
+        name = query.get("name", [""])[0]
+        page = int(query.get("pageno", ["1"])[0])
+
+        catalogue = self.server.catalogue
+        if text_type == "circle":
+            catalogue = [
+                product_id
+                for product_id in catalogue
+                if f"Fixture Circle {product_id % 97}" == name
+            ]
+        elif text_type != "event" or name != "コミックマーケット105":
+            catalogue = []
+
+        start = (page - 1) * LISTING_PAGE_SIZE
+        products = "\n".join(
+            LISTING_PRODUCT.format(path=PRODUCT_PATH, product_id=product_id)
+            for product_id in catalogue[start : start + LISTING_PAGE_SIZE]
+        )
+        self.send_html(LISTING_PAGE.format(products=products))
+
+    def send_html(self, page: str):
+        """Respond with an HTML page."""
+        body = page.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        """Silence per-request logging."""
+
+
+def start_fixture_server(
+    host: str = "127.0.0.1", port: int = 0, catalogue: range = range(1000)
+) -> ThreadingHTTPServer:
+    """Start the fixture server in a background thread.
+
+    Parameters
+    ----------
+    host : str
+        Host to listen on
+    port : int
+        Port to listen on, 0 picks a free port
+    catalogue : range
+        Product ids listed by the listing pages
+
+    Returns
+    -------
+    ThreadingHTTPServer
+        The running server, call shutdown() to stop it.
+
+    """
+    server = ThreadingHTTPServer((host, port), FixtureRequestHandler)
+    server.catalogue = catalogue
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
+
+
+def base_url(server: ThreadingHTTPServer) -> str:
+    """Retrieve the URL the fixture server serves Melonbooks pages under, to use as the crawler's base URL.
+
+    Parameters
+    ----------
+    server : ThreadingHTTPServer
+        Running fixture server
+
+    Returns
+    -------
+    str
+        Base URL
+
+    """
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}{BASE_PATH}"
+
+
+def product_url(server: ThreadingHTTPServer, product_id: int) -> str:
+    """Retrieve the URL of a product page served by the fixture server.
+
+    Parameters
+    ----------
+    server : ThreadingHTTPServer
+        Running fixture server
+    product_id : int
+        Melonbooks product id
+
+    Returns
+    -------
+    str
+        URL of the product page
+
+    """
+    return f"{base_url(server)}/detail/detail.php?product_id={product_id}"
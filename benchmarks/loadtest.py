@@ -0,0 +1,491 @@
+"""End-to-end load test of the bot commands.
+
+Drives the command callbacks of src.bot with fake Discord contexts, against a MongoDB database seeded with
+synthetic data and a local server serving Melonbooks fixture pages.
+
+The target database is wiped, so never point this at production data.
+
+Usage:
+    python -m benchmarks.loadtest --mongo-url mongodb://localhost:27017 --users 500 --reservations 20000 \
+        --mix add=4,rm=1,ls=3,show=2,export=0.1 --commands 2000 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+
+REPOSITORY_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPOSITORY_ROOT))
+
+from benchmarks.dataset import generate_dataset, seed_database
+from benchmarks.fixture_server import (
+    base_url,
+    product_url,
+    start_fixture_server,
+)
+
+
+class FakeAuthor:
+    """Stand-in for discord.Member, with the attributes the commands use."""
+
+    def __init__(self, discord_id: int, name: str):
+        """Initialize a fake author.
+
+        Parameters
+        ----------
+        discord_id : int
+            Discord Id
+        name : str
+            Display name
+
+        """
+        self.id = discord_id
+        self.global_name = name
+        self.display_name = name
+
+
+class FakeGuild:
+    """Stand-in for discord.Guild, with the attributes the commands use."""
+
+    def __init__(self, guild_id: int):
+        """Initialize a fake guild.
+
+        Parameters
+        ----------
+        guild_id : int
+            Discord server Id
+
+        """
+        self.id = guild_id
+
+
+class FakeChannel:
+    """Stand-in for discord.TextChannel, with the attributes the commands use."""
+
+    def __init__(self, channel_id: int):
+        """Initialize a fake channel.
+
+        Parameters
+        ----------
+        channel_id : int
+            Channel Id
+
+        """
+        self.id = channel_id
+
+
+class FakeMessage:
+    """Stand-in for discord.Message, with the attributes the commands use."""
+
+    def __init__(self, message_id: int):
+        """Initialize a fake message.
+
+        Parameters
+        ----------
+        message_id : int
+            Message Id
+
+        """
+        self.id = message_id
+
+
+class FakeContext:
+    """Stand-in for commands.Context, that records replies instead of sending them.
+
+    Attributes
+    ----------
+    author : Author of the command
+    guild : Server the command was sent in
+    channel : Channel the command was sent in
+    sent : Number of messages sent
+    reply_latency : Simulated latency of a Discord API call, in seconds
+
+    """
+
+    def __init__(self, author: FakeAuthor, guild: FakeGuild, reply_latency: float = 0):
+        """Initialize a fake context.
+
+        Parameters
+        ----------
+        author : FakeAuthor
+            Author of the command
+        guild : FakeGuild
+            Server the command was sent in
+        reply_latency : float
+            Simulated latency of a Discord API call, in seconds
+
+        """
+        self.author = author
+        self.guild = guild
+        self.channel = FakeChannel(guild.id)
+        self.sent = 0
+        self.reply_latency = reply_latency
+
+    async def send(self, *args, **kwargs):
+        """Pretend to send a message."""
+        self.sent += 1
+        await asyncio.sleep(self.reply_latency)
+        return FakeMessage(self.sent)
+
+    async def reply(self, *args, **kwargs):
+        """Pretend to reply to the command message."""
+        return await self.send(*args, **kwargs)
+
+    async def defer(self, *args, **kwargs):
+        """Pretend to acknowledge a slash command, which costs a Discord API call."""
+        await asyncio.sleep(self.reply_latency)
+
+
+def parse_mix(mix: str) -> dict[str, float]:
+    """Parse a command mix such as "add=4,ls=1".
+
+    Parameters
+    ----------
+    mix : str
+        Comma separated list of command=weight
+
+    Returns
+    -------
+    dict[str, float]
+        Weight of each command
+
+    """
+    weights = {}
+    for entry in mix.split(","):
+        name, weight = entry.split("=")
+        weights[name.strip()] = float(weight)
+
+    return weights
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    """Compute a percentile using the nearest rank method.
+
+    Parameters
+    ----------
+    values : list[float]
+        Sorted values
+    fraction : float
+        Percentile, between 0 and 1
+
+    Returns
+    -------
+    float
+        The percentile
+
+    """
+    if not values:
+        return 0
+
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+async def run_load_test(args: argparse.Namespace) -> dict:
+    """Seed the database, replay the command mix and summarize the results.
+
+    Parameters
+    ----------
+    args : argparse.Namespace
+        Command line arguments
+
+    Returns
+    -------
+    dict
+        Summary of the load test
+
+    """
+    from pymongo import MongoClient, monitoring
+
+    from src.query_log import CommandQueryLog, ReplySizeListener, current_query_log
+
+    # Must be registered before the bot creates the DAO's client
+    monitoring.register(ReplySizeListener())
+
+    from src import bot as comiket_bot
+
+    await comiket_bot.bot.create_components()
+
+    # Avoid calling the currency API during the load test
+    comiket_bot.bot.currency.current_rate = 0.0067
+    comiket_bot.bot.currency.last_update = datetime.now()
+
+    dataset = generate_dataset(
+        args.users,
+        args.doujin,
+        args.reservations,
+        seed=args.seed,
+        num_guilds=args.guilds,
+    )
+    seed_database(MongoClient(args.mongo_url).get_database(args.database), dataset)
+    comiket_bot.bot.create_indexes()
+
+    # Scrape jobs are processed in the background, record every update of the acknowledgements
+    scrape_replies = []
+
+    async def edit_scrape_reply(request, content, embeds):
+        await asyncio.sleep(args.reply_latency)
+        scrape_replies.append(content)
+
+    comiket_bot.edit_scrape_reply = edit_scrape_reply
+
+    # Number of finished jobs whose acknowledgements are being updated
+    handling_jobs = 0
+    on_finished = comiket_bot.bot.scrape_workers.on_finished
+
+    async def record_finished(job, doujin):
+        nonlocal handling_jobs
+        handling_jobs += 1
+        try:
+            await on_finished(job, doujin)
+        finally:
+            handling_jobs -= 1
+
+    comiket_bot.bot.scrape_workers.on_finished = record_finished
+
+    # URLs submitted to the scrape queue, whose acknowledgement is updated once they are scraped
+    submitted_urls = []
+    submit = comiket_bot.bot.scrape_queue.submit
+
+    def record_submit(url, request=None):
+        submitted_urls.append(url)
+        return submit(url, request)
+
+    comiket_bot.bot.scrape_queue.submit = record_submit
+    comiket_bot.bot.scrape_workers.start()
+
+    # The catalogue covers every new URL the command mix can add
+    fixture_server = start_fixture_server(
+        catalogue=range(
+            len(dataset.doujins),
+            len(dataset.doujins) + args.commands * args.max_arguments,
+        )
+    )
+    crawl_summary = None
+    if args.precrawl:
+        from src.crawler import CatalogueCrawler
+
+        crawler = CatalogueCrawler(
+            comiket_bot.bot.dao,
+            comiket_bot.bot.doujin_scraper,
+            base_url=base_url(fixture_server),
+            request_interval=0,
+            max_pages=10**6,
+        )
+        crawl_start = time.perf_counter()
+        progress = await crawler.crawl("event", "コミックマーケット105")
+        crawl_summary = {
+            "elapsed_s": time.perf_counter() - crawl_start,
+            "pages": progress.pages,
+            "added": progress.added,
+            "failed": len(progress.failures),
+        }
+    rng = random.Random(args.seed)
+    doujin_ids = [str(doujin["_id"]) for doujin in dataset.doujins]
+    authors = [
+        (FakeAuthor(user["discord_id"], user["name"]), FakeGuild(user["guild_id"]))
+        for user in dataset.users
+    ]
+    next_product_id = len(dataset.doujins)
+
+    def plan_arguments(command: str) -> tuple[tuple, dict]:
+        nonlocal next_product_id
+        if command in ("show", "rm"):
+            picked = rng.sample(doujin_ids, rng.randint(1, args.max_arguments))
+            return (), {"doujin_ids": " ".join(picked)}
+
+        if command == "add":
+            arguments = []
+            for _ in range(rng.randint(1, args.max_arguments)):
+                if rng.random() < args.new_url_ratio:
+                    arguments.append(product_url(fixture_server, next_product_id))
+                    next_product_id += 1
+                else:
+                    arguments.append(rng.choice(doujin_ids))
+            return (), {"doujins": " ".join(arguments)}
+
+        if command == "ls":
+            return (None,), {}
+
+        return (), {}
+
+    weights = parse_mix(args.mix)
+    plan = rng.choices(list(weights), weights=list(weights.values()), k=args.commands)
+    pending = iter(plan)
+
+    latencies = defaultdict(list)
+    round_trips = defaultdict(list)
+    reply_bytes = defaultdict(list)
+    errors = defaultdict(int)
+
+    async def worker():
+        for command_name in pending:
+            command = comiket_bot.bot.get_command(command_name)
+            if command is None:
+                raise ValueError(f"Unknown command {command_name}")
+
+            ctx = FakeContext(*rng.choice(authors), args.reply_latency)
+            arguments, keyword_arguments = plan_arguments(command_name)
+            query_log = CommandQueryLog(command_name)
+            token = current_query_log.set(query_log)
+            start = time.perf_counter()
+            try:
+                await command.callback(ctx, *arguments, **keyword_arguments)
+            except Exception:
+                errors[command_name] += 1
+            finally:
+                latencies[command_name].append(time.perf_counter() - start)
+                round_trips[command_name].append(query_log.round_trips)
+                reply_bytes[command_name].append(query_log.reply_bytes)
+                current_query_log.reset(token)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(args.concurrency)])
+    elapsed = time.perf_counter() - start
+
+    # Wait for the scrape queue to drain, and the acknowledgements of the finished jobs to be updated
+    jobs = comiket_bot.bot.scrape_queue.jobs
+    deadline = time.perf_counter() + args.drain_timeout
+    while (
+        handling_jobs
+        or jobs.count_documents(
+            {"url": {"$in": submitted_urls}, "status": {"$in": ["pending", "running"]}}
+        )
+    ) and time.perf_counter() < deadline:
+        comiket_bot.bot.scrape_workers.wake()
+        await asyncio.sleep(0.1)
+    drained = time.perf_counter() - start
+    await comiket_bot.bot.scrape_workers.stop()
+    fixture_server.shutdown()
+
+    summary = {
+        "elapsed_s": elapsed,
+        "commands": len(plan),
+        "throughput_per_s": len(plan) / elapsed if elapsed else 0,
+        "precrawl": crawl_summary,
+        "scrape_jobs": {
+            "done": jobs.count_documents({"status": "done"}),
+            "failed": jobs.count_documents({"status": "failed"}),
+            "replies_updated": len(scrape_replies),
+            "drained_s": drained,
+        },
+        "per_command": {},
+    }
+    for command_name, values in latencies.items():
+        values = sorted(values)
+        summary["per_command"][command_name] = {
+            "count": len(values),
+            "errors": errors[command_name],
+            "p50_ms": percentile(values, 0.5) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+            "max_ms": values[-1] * 1000,
+            "mean_mongo_ops": statistics.fmean(round_trips[command_name]),
+            "mean_reply_bytes": statistics.fmean(reply_bytes[command_name]),
+        }
+
+    return summary
+
+
+def print_summary(summary: dict) -> None:
+    """Print a human readable summary of the load test.
+
+    Parameters
+    ----------
+    summary : dict
+        Summary returned by run_load_test
+
+    """
+    print(
+        f"{summary['commands']} commands in {summary['elapsed_s']:.2f}s "
+        f"({summary['throughput_per_s']:.1f} commands/s)"
+    )
+    if summary["precrawl"] is not None:
+        precrawl = summary["precrawl"]
+        print(
+            f"Pre-crawled {precrawl['added']} doujin from {precrawl['pages']} listing pages "
+            f"in {precrawl['elapsed_s']:.2f}s ({precrawl['failed']} failed)"
+        )
+    scrape_jobs = summary["scrape_jobs"]
+    print(
+        f"{scrape_jobs['done']} scrape jobs done, {scrape_jobs['failed']} failed, "
+        f"{scrape_jobs['replies_updated']} replies updated, queue drained after {scrape_jobs['drained_s']:.2f}s"
+    )
+    print(
+        f"{'command':<8} {'count':>6} {'errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+        f"{'p99 ms':>9} {'max ms':>9} {'mongo ops':>10} {'reply KiB':>10}"
+    )
+    for command_name, stats in sorted(summary["per_command"].items()):
+        print(
+            f"{command_name:<8} {stats['count']:>6} {stats['errors']:>6} "
+            f"{stats['p50_ms']:>9.1f} {stats['p95_ms']:>9.1f} {stats['p99_ms']:>9.1f} "
+            f"{stats['max_ms']:>9.1f} {stats['mean_mongo_ops']:>10.1f} "
+            f"{stats['mean_reply_bytes'] / 1024:>10.1f}"
+        )
+
+
+def main():
+    """Run the load test from the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mongo-url", default="mongodb://localhost:27017")
+    parser.add_argument("--database", default="comiket_loadtest")
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--doujin", type=int, default=5000)
+    parser.add_argument("--reservations", type=int, default=20000)
+    parser.add_argument("--guilds", type=int, default=1)
+    parser.add_argument("--mix", default="add=4,rm=1,ls=3,show=2,export=0.1")
+    parser.add_argument("--commands", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--max-arguments", type=int, default=3)
+    parser.add_argument(
+        "--new-url-ratio",
+        type=float,
+        default=0.2,
+        help="Fraction of !add arguments that are URLs not yet in the database",
+    )
+    parser.add_argument(
+        "--reply-latency",
+        type=float,
+        default=0.05,
+        help="Simulated latency of each Discord API call, in seconds",
+    )
+    parser.add_argument(
+        "--drain-timeout",
+        type=float,
+        default=120,
+        help="Number of seconds to wait for the scrape queue to drain after the last command",
+    )
+    parser.add_argument(
+        "--precrawl",
+        action="store_true",
+        help="Crawl the fixture event catalogue first, so that new URLs are already in the database",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="Also write the summary to this file")
+    args = parser.parse_args()
+
+    # The bot reads its configuration when its components are created
+    os.environ["DATABASE_URL"] = args.mongo_url
+    os.environ["MONGO_DB_NAME"] = args.database
+    os.environ.setdefault("CURRENCY_API_KEY", "loadtest")
+
+    # Log files and CSV exports are written to the working directory
+    json_path = args.json.resolve() if args.json else None
+    os.chdir(tempfile.mkdtemp(prefix="comiket_loadtest_"))
+
+    summary = asyncio.run(run_load_test(args))
+    print_summary(summary)
+    if json_path is not None:
+        json_path.write_text(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
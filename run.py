@@ -1,12 +1,95 @@
 """Entry point for the python file to create the bot."""
 
+import multiprocessing
 import os
+import sys
+import time
 
-from src.bot import bot
+from src.sharding import format_shard_ids, parse_shard_ids, split_shards
 
-# Load environment variables
 
-DISCORD_TOKEN = os.getenv("TOKEN")
-assert DISCORD_TOKEN is not None
+def run_bot(shard_ids: str | None = None, metrics_port: int | None = None) -> None:
+    """Import and run the bot until it is closed.
 
-bot.run(DISCORD_TOKEN)
+    Parameters
+    ----------
+    shard_ids : str | None
+        Shards ran by this process, e.g. "0-3,8". If None, SHARD_IDS is left as is.
+    metrics_port : int | None
+        Port of the metrics server of this process. If None, METRICS_PORT is left as is.
+
+    """
+    # src.bot reads its sharding configuration on import
+    if shard_ids is not None:
+        os.environ["SHARD_IDS"] = shard_ids
+    if metrics_port is not None:
+        os.environ["METRICS_PORT"] = str(metrics_port)
+
+    import_started_at = time.perf_counter()
+    from src.bot import bot, setup_logging
+
+    bot.startup_timings["import"] = time.perf_counter() - import_started_at
+
+    # Load environment variables
+
+    DISCORD_TOKEN = os.getenv("TOKEN")
+    assert DISCORD_TOKEN is not None
+
+    setup_logging()
+    bot.run(DISCORD_TOKEN)
+
+
+def run_shard_processes(processes: int) -> int:
+    """Split the shards across processes, and run the bot in each of them until they all exit.
+
+    Processes are spawned rather than forked, so that each creates its own MongoDB client and caches.
+    When metrics are enabled, process i serves them on METRICS_PORT + i.
+
+    Parameters
+    ----------
+    processes : int
+        Number of processes to run
+
+    Returns
+    -------
+    int
+        0 if every process exited successfully, 1 otherwise.
+
+    """
+    shard_count = os.getenv("SHARD_COUNT")
+    if shard_count is None or not shard_count.isdigit():
+        raise Exception("SHARD_PROCESSES requires SHARD_COUNT to be a number")
+
+    shard_ids = os.getenv("SHARD_IDS")
+    if shard_ids:
+        shard_ids = parse_shard_ids(shard_ids)
+    else:
+        shard_ids = list(range(int(shard_count)))
+
+    metrics_port = os.getenv("METRICS_PORT")
+    context = multiprocessing.get_context("spawn")
+    children = [
+        context.Process(
+            target=run_bot,
+            args=(
+                format_shard_ids(group),
+                int(metrics_port) + index if metrics_port is not None else None,
+            ),
+            name=f"shards-{format_shard_ids(group)}",
+        )
+        for index, group in enumerate(split_shards(shard_ids, processes))
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+    return 0 if all(child.exitcode == 0 for child in children) else 1
+
+
+if __name__ == "__main__":
+    shard_processes = int(os.getenv("SHARD_PROCESSES", "1"))
+    if shard_processes > 1:
+        sys.exit(run_shard_processes(shard_processes))
+
+    run_bot()
@@ -0,0 +1,358 @@
+"""In-memory prefix indexes serving slash command autocomplete without querying MongoDB on every keystroke."""
+
+import asyncio
+import bisect
+import logging
+import time
+from datetime import timedelta
+
+from bson.objectid import ObjectId
+from discord import app_commands
+
+from src.dao import DAO
+
+logger = logging.getLogger(__name__)
+
+# Discord limits
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+# Number of seconds between two lookups of the doujin added by any process
+TITLE_REFRESH_INTERVAL = 60
+# Number of seconds of doujin Ids read again by each lookup, as Ids made by processes whose clocks differ don't
+# increase in the order the doujin are inserted
+TITLE_REFRESH_LOOKBACK = 300
+# Number of seconds between two rebuilds of the whole index, which picks up rescraped titles and merged doujin
+TITLE_REBUILD_INTERVAL = 3600
+# Number of seconds the reservations of a user are served from memory
+RESERVATION_TTL = 60
+# Number of users whose reservations are kept before expired ones are dropped
+MAX_CACHED_USERS = 1000
+
+
+class PrefixIndex:
+    """Sorted list of keys, searched by prefix with a binary search.
+
+    Every word of a label is a key, so "Blue Archive Anthology" is found by "blue", "archive" or "anthology".
+    Values are keys too, so that a partially pasted Id completes.
+
+    Attributes
+    ----------
+    keys : Sorted (key, value) pairs, keys are the value and the lowercase suffixes of its label starting at a word
+    labels : Label of each value
+
+    """
+
+    def __init__(self, entries: list[tuple[str, str]] | None = None):
+        """Build an index.
+
+        Parameters
+        ----------
+        entries : list[tuple[str, str]] | None
+            (value, label) pairs to index
+
+        """
+        self.labels: dict[str, str] = {}
+        self.keys: list[tuple[str, str]] = []
+        self.add_many(entries or [])
+
+    def __len__(self) -> int:
+        """Number of values indexed."""
+        return len(self.labels)
+
+    def add_many(self, entries: list[tuple[str, str]]) -> None:
+        """Index values, skipping those already indexed.
+
+        The keys are replaced by a new sorted list rather than sorted in place, so that searches from other threads
+        never see a partially updated index.
+
+        Parameters
+        ----------
+        entries : list[tuple[str, str]]
+            (value, label) pairs to index, e.g. doujin Ids and titles
+
+        """
+        new_keys = []
+        for value, label in entries:
+            if value not in self.labels:
+                self.labels[value] = label
+                new_keys.extend((key, value) for key in self._keys(value, label))
+
+        if new_keys:
+            self.keys = sorted(self.keys + new_keys)
+
+    def search(self, prefix: str, limit: int = MAX_CHOICES) -> list[str]:
+        """Find the values one of whose words starts with a prefix.
+
+        Parameters
+        ----------
+        prefix : str
+            Prefix, case insensitive. An empty prefix matches every value.
+        limit : int
+            Maximum number of values returned
+
+        Returns
+        -------
+        list[str]
+            Distinct values, in the order of their matching key.
+
+        """
+        prefix = prefix.strip().lower()
+        keys = self.keys
+        values = {}
+        index = bisect.bisect_left(keys, (prefix,))
+        while len(values) < limit and index < len(keys):
+            key, value = keys[index]
+            if not key.startswith(prefix):
+                break
+            values[value] = None
+            index += 1
+
+        return list(values)[:limit]
+
+    @staticmethod
+    def _keys(value: str, label: str) -> list[str]:
+        label = label.lower()
+        return [value, label] + [
+            label[index + 1 :]
+            for index, character in enumerate(label)
+            if character.isspace()
+            and index + 1 < len(label)
+            and not label[index + 1].isspace()
+        ]
+
+
+class AutocompleteIndex:
+    """Doujin titles, and the reservations of the users who recently asked for suggestions.
+
+    Titles are loaded once, then the doujin added by any process are indexed every TITLE_REFRESH_INTERVAL seconds,
+    reading only the doujin whose Id was made less than TITLE_REFRESH_LOOKBACK seconds before the greatest Id indexed.
+    The index is rebuilt from every doujin every TITLE_REBUILD_INTERVAL seconds, so that changed titles are
+    re-indexed and removed doujin are dropped.
+
+    Attributes
+    ----------
+    dao : Database access object
+    titles : Index of every doujin, by title and circle
+    last_doujin_id : Greatest doujin Id indexed
+    rebuilt_at : When the index was last rebuilt from every doujin (from time.monotonic), None before it is loaded
+    reservations : Index of the reservations of each (guild, user), and when it expires (from time.monotonic)
+    refresh_task : Task indexing new doujin
+
+    """
+
+    def __init__(self, dao: DAO):
+        """Initialize empty indexes.
+
+        Parameters
+        ----------
+        dao : DAO
+            Database access object
+
+        """
+        self.dao = dao
+        self.titles = PrefixIndex()
+        self.last_doujin_id: ObjectId | None = None
+        self.rebuilt_at: float | None = None
+        self.reservations: dict[tuple[int, int], tuple[PrefixIndex, float]] = {}
+        self.refresh_task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Load the titles in the background, and keep indexing the doujin added afterwards."""
+        self.refresh_task = asyncio.create_task(self._refresh_periodically())
+
+    def refresh(self, rebuild: bool = False) -> int:
+        """Index the doujin added since the last refresh.
+
+        Parameters
+        ----------
+        rebuild : bool
+            Whether or not to replace the index with a new index of every doujin
+
+        Returns
+        -------
+        int
+            Number of doujin read.
+
+        """
+        after_id = None
+        if not rebuild and self.last_doujin_id is not None:
+            after_id = ObjectId.from_datetime(
+                self.last_doujin_id.generation_time
+                - timedelta(seconds=TITLE_REFRESH_LOOKBACK)
+            )
+
+        titles = self.dao.retrieve_doujin_titles(after_id)
+        entries = [
+            (
+                str(doujin["_id"]),
+                doujin_label(doujin["title"], doujin.get("circle_name")),
+            )
+            for doujin in titles
+        ]
+        if rebuild:
+            # Searches keep using the previous index until the new one is complete
+            self.titles = PrefixIndex(entries)
+            self.rebuilt_at = time.monotonic()
+        else:
+            self.titles.add_many(entries)
+
+        if titles:
+            self.last_doujin_id = max(
+                self.last_doujin_id or titles[-1]["_id"], titles[-1]["_id"]
+            )
+
+        return len(titles)
+
+    def forget_reservations(self, guild_id: int, discord_id: int) -> None:
+        """Drop the reservations of a user, after they changed.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        discord_id : int
+            Discord Id of the user
+
+        """
+        self.reservations.pop((guild_id, discord_id), None)
+
+    async def suggest_reserved(
+        self, guild_id: int, discord_id: int, current: str
+    ) -> list[app_commands.Choice[str]]:
+        """Suggest doujin reserved by a user.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        discord_id : int
+            Discord Id of the user
+        current : str
+            What the user typed so far, Ids already picked followed by a prefix
+
+        Returns
+        -------
+        list[app_commands.Choice[str]]
+            Suggestions, whose value is the picked Ids followed by the suggested Id.
+
+        """
+        index = await self._reservations(guild_id, discord_id)
+        return _choices(index, current)
+
+    async def suggest_doujin(
+        self, guild_id: int, discord_id: int, current: str
+    ) -> list[app_commands.Choice[str]]:
+        """Suggest doujin, those reserved by the user first.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        discord_id : int
+            Discord Id of the user
+        current : str
+            What the user typed so far, Ids already picked followed by a prefix
+
+        Returns
+        -------
+        list[app_commands.Choice[str]]
+            Suggestions, whose value is the picked Ids followed by the suggested Id.
+
+        """
+        reserved = await self.suggest_reserved(guild_id, discord_id, current)
+        suggested = {choice.value for choice in reserved}
+        return (
+            reserved
+            + [
+                choice
+                for choice in _choices(self.titles, current)
+                if choice.value not in suggested
+            ][: MAX_CHOICES - len(reserved)]
+        )
+
+    async def _reservations(self, guild_id: int, discord_id: int) -> PrefixIndex:
+        index, expires_at = self.reservations.get((guild_id, discord_id), (None, 0))
+        if index is not None and expires_at > time.monotonic():
+            return index
+
+        user = await asyncio.to_thread(
+            self.dao.get_user_by_discord_id, discord_id, guild_id
+        )
+        index = PrefixIndex(
+            [
+                (
+                    str(reservation.doujin._id),
+                    doujin_label(
+                        reservation.doujin.title, reservation.doujin.circle_name
+                    ),
+                )
+                for reservation in (user.reservations if user else [])
+            ]
+        )
+        now = time.monotonic()
+        if len(self.reservations) >= MAX_CACHED_USERS:
+            self.reservations = {
+                user: cached
+                for user, cached in self.reservations.items()
+                if cached[1] > now
+            }
+        self.reservations[(guild_id, discord_id)] = (index, now + RESERVATION_TTL)
+
+        return index
+
+    async def _refresh_periodically(self) -> None:
+        while True:
+            rebuild = (
+                self.rebuilt_at is None
+                or time.monotonic() - self.rebuilt_at >= TITLE_REBUILD_INTERVAL
+            )
+            try:
+                indexed = await asyncio.to_thread(self.refresh, rebuild)
+                if rebuild:
+                    logger.info("Indexed %d doujin titles for autocomplete", indexed)
+            except Exception:
+                logger.exception("Failed to index doujin titles for autocomplete")
+            await asyncio.sleep(TITLE_REFRESH_INTERVAL)
+
+
+def doujin_label(title: str, circle_name: str | None) -> str:
+    """Label of a doujin in suggestions.
+
+    Parameters
+    ----------
+    title : str
+        Title of the doujin
+    circle_name : str | None
+        Circle of the doujin
+
+    Returns
+    -------
+    str
+        Title and circle
+    """
+    return f"{title} - {circle_name}" if circle_name else title
+
+
+def _choices(index: PrefixIndex, current: str) -> list[app_commands.Choice[str]]:
+    # Ids picked earlier stay in front, so multiple doujin can be picked one after the other
+    words = current.split()
+    picked = []
+    while words and ObjectId.is_valid(words[0]):
+        picked.append(words.pop(0))
+
+    choices = []
+    for value in index.search(" ".join(words)):
+        if value in picked:
+            continue
+
+        choice_value = " ".join(picked + [value])
+        if len(choice_value) > MAX_CHOICE_LENGTH:
+            break
+        choices.append(
+            app_commands.Choice(
+                name=index.labels[value][:MAX_CHOICE_LENGTH], value=choice_value
+            )
+        )
+
+    return choices
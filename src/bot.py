@@ -1,45 +1,702 @@
 """Contains the Discord Bot."""
 
+import asyncio
+import json
 import logging
 import os
+import time
+from collections.abc import Awaitable
+from typing import Literal, TypeVar
 
 import discord
 from bson.objectid import ObjectId
+from discord import app_commands
 from discord.ext import commands
 
+from src.autocomplete import AutocompleteIndex
+from src.cache import Cache, cache_from_env
+from src.crawler import CatalogueCrawler
 from src.currency import Currency
 from src.dao import DAO
-from src.scrape import DoujinScraper
-from src.utils import export_doujin_data, generate_doujin_embed, list_doujins
+from src.doujin_with_reservation import DoujinWithReservationData
+from src.importer import ImportProgress, import_reservations, parse_import_file
+from src.journal import JournalFlusher
+from src.metrics import (
+    COMMAND_LATENCY,
+    COMMAND_ROUND_TRIPS,
+    STARTUP_PHASE_DURATION,
+    monitor_event_loop_lag,
+    start_metrics_server,
+)
+from src.query_log import CommandQueryLog, current_query_log
+from src.scrape import DoujinScraper, canonicalize_url
+from src.scrape_queue import JOB_DONE, JOB_FAILED, ScrapeQueue, ScrapeWorkerPool
+from src.sharding import shard_options_from_env
+from src.user_with_reservation import UserWithReservationData
+from src.utils import (
+    MAX_EMBEDS_PER_MESSAGE,
+    export_doujin_data,
+    fit_message_content,
+    generate_doujin_embed,
+    list_doujins,
+    list_manifest,
+    list_search_results,
+    list_top,
+    reply_with_doujin_embeds,
+)
+
+T = TypeVar("T")
+
+logger = logging.getLogger(__name__)
+
+# Serializes the edits of the messages acknowledging URLs submitted to the scrape queue, see update_scrape_reply
+scrape_reply_lock = asyncio.Lock()
+
+# Commands exceeding either budget are logged along with the queries they made
+SLOW_COMMAND_MAX_ROUND_TRIPS = int(os.getenv("SLOW_COMMAND_MAX_ROUND_TRIPS", "20"))
+SLOW_COMMAND_MAX_MS = float(os.getenv("SLOW_COMMAND_MAX_MS", "1000"))
+
+# Server that users and reservations created before data was scoped by server belong to
+DEFAULT_GUILD_ID = os.getenv("DEFAULT_GUILD_ID")
+
+# Number of scrape workers per process, which bounds the number of concurrent requests to Melonbooks
+SCRAPE_WORKERS = int(os.getenv("SCRAPE_WORKERS", "2"))
+
+# Serve reads from an in-memory replica of the database, kept in sync by a change stream (needs a replica set)
+LIVE_REPLICA = os.getenv("LIVE_REPLICA", "0") == "1"
+
+# Acknowledge reservation writes once they are in a local journal, and write them to MongoDB in the background
+RESERVATION_JOURNAL = os.getenv("RESERVATION_JOURNAL", "0") == "1"
+
+# Minimum number of seconds between edits of the progress message of !import, to stay clear of rate limits
+IMPORT_PROGRESS_INTERVAL = 2
+
+# Metrics (disabled unless a port is provided)
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = os.getenv("METRICS_PORT")
 
-# Logger
-handler = logging.FileHandler(filename="discord.log", encoding="utf-8", mode="w")
-discord.utils.setup_logging(handler=handler, root=False)
+# Prefix commands (e.g. !add) need the privileged message_content intent, without it the bot only receives the
+# content of messages mentioning it, so the slash commands and mention prefix (e.g. @bot add) still work
+PREFIX_COMMANDS = os.getenv("PREFIX_COMMANDS", "0") == "1"
 
-# Requires message_content intent to work
 intents = discord.Intents.default()
-intents.message_content = True
+intents.message_content = PREFIX_COMMANDS
 
-# Currency setup
-CURRENCY_API_KEY = os.getenv("CURRENCY_API_KEY")
-assert CURRENCY_API_KEY is not None
-currency = Currency(CURRENCY_API_KEY)
+# Run as an auto-sharded bot if SHARD_COUNT is set, see src.sharding
+SHARD_OPTIONS = shard_options_from_env()
+BotBase = commands.AutoShardedBot if SHARD_OPTIONS is not None else commands.Bot
 
-# Melonbook Scraper
-doujin_scraper = DoujinScraper()
 
-# Database setup
-database_url = os.getenv("DATABASE_URL")
-assert database_url is not None
-dao = DAO(database_url, currency)
+def log_file_name(name: str, extension: str = "log") -> str:
+    """Name a log file, so that processes running different shards don't overwrite each other's logs.
 
-bot = commands.Bot(command_prefix="!", intents=intents, log_handler=handler)
+    Parameters
+    ----------
+    name : str
+        Name of the log, without extension
+    extension : str
+        Extension of the log
 
+    Returns
+    -------
+    str
+        File name of the log.
 
-@bot.command(
+    """
+    shard_ids = os.getenv("SHARD_IDS")
+    if shard_ids:
+        return f"{name}-shards-{shard_ids}.{extension}"
+
+    return f"{name}.{extension}"
+
+
+def setup_logging(log_file: str | None = None) -> None:
+    """Write the logs of discord.py and of the bot to a file.
+
+    Parameters
+    ----------
+    log_file : str | None
+        File to write the logs to, it is truncated first.
+        If None, discord.log suffixed by the shards ran by this process.
+
+    """
+    if log_file is None:
+        log_file = log_file_name("discord")
+
+    handler = logging.FileHandler(filename=log_file, encoding="utf-8", mode="w")
+    discord.utils.setup_logging(handler=handler, root=False)
+    logger.addHandler(handler)
+
+
+class ComiketBot(BotBase):
+    """Discord bot whose components are created when it starts, rather than when this module is imported.
+
+    Components are never shared between processes, so every process running a subset of the shards gets its own
+    MongoDB client and caches.
+
+    Attributes
+    ----------
+    cache : Cache shared by the components, None until the components are created
+    currency : Currency conversion API wrapper, None until the components are created
+    doujin_scraper : Melonbooks scraper, None until the components are created
+    dao : Database access object, None until the components are created
+    scrape_queue : Queue of URLs to scrape, None until the components are created
+    scrape_workers : Workers processing the scrape queue, None until the components are created
+    autocomplete : Indexes serving slash command autocomplete, None until the components are created
+    journal_flusher : Flusher writing the reservation journal to MongoDB, None unless RESERVATION_JOURNAL is set
+    startup_timings : Duration of each startup phase, in seconds
+
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the bot, without creating any of its components.
+
+        Parameters
+        ----------
+        *args
+            See commands.Bot
+        **kwargs
+            See commands.Bot
+
+        """
+        super().__init__(*args, **kwargs)
+        self.cache: Cache | None = None
+        self.currency: Currency | None = None
+        self.doujin_scraper: DoujinScraper | None = None
+        self.dao: DAO | None = None
+        self.scrape_queue: ScrapeQueue | None = None
+        self.scrape_workers: ScrapeWorkerPool | None = None
+        self.autocomplete: AutocompleteIndex | None = None
+        self.journal_flusher: JournalFlusher | None = None
+        self.startup_timings: dict[str, float] = {}
+        self._phase_started_at = time.perf_counter()
+
+    async def login(self, token: str) -> None:
+        """Log in to Discord, then run setup_hook.
+
+        Parameters
+        ----------
+        token : str
+            Discord bot token
+
+        """
+        self._phase_started_at = time.perf_counter()
+        await super().login(token)
+
+    async def setup_hook(self) -> None:
+        """Create and connect the components, then start background services, before connecting to the gateway."""
+        self._end_phase("login")
+
+        await self.create_components()
+        await asyncio.gather(
+            self._timed("connect.mongo", asyncio.to_thread(self.create_indexes)),
+            self._timed("connect.currency", asyncio.to_thread(self._warm_up_currency)),
+        )
+        if self.runs_first_shard:
+            # Must happen before any command creates a user in the default server
+            await assign_legacy_guild()
+            # Must happen before any command looks a doujin up by its canonical URL
+            await merge_duplicate_doujin()
+            self.loop.create_task(migrate_embedded_reservations())
+            self.loop.create_task(index_search_ngrams())
+        if self.dao.replica is not None:
+            self.dao.replica.start()
+        if self.journal_flusher is not None:
+            self.journal_flusher.start()
+        self.scrape_workers.start()
+        self.autocomplete.start()
+
+        if METRICS_PORT is not None:
+            await start_metrics_server(METRICS_HOST, int(METRICS_PORT), self.dao.ping)
+            self.loop.create_task(monitor_event_loop_lag())
+
+        self._end_phase("connect")
+
+    @property
+    def runs_first_shard(self) -> bool:
+        """Whether or not this process runs shard 0, the only process to run one-off maintenance tasks.
+
+        Returns
+        -------
+        bool
+            True unless only other shards are ran by this process.
+
+        """
+        shard_ids = getattr(self, "shard_ids", None)
+        return shard_ids is None or 0 in shard_ids
+
+    def create_indexes(self) -> None:
+        """Create the indexes used by the DAO and the scrape queue, if they don't exist yet."""
+        self.dao.create_indexes()
+        self.scrape_queue.create_indexes()
+
+    async def create_components(self) -> None:
+        """Create the cache, currency wrapper, scraper, DAO and scrape queue from the environment.
+
+        The scraper and DAO are independent of each other, so they are created concurrently.
+        """
+        currency_api_key = os.getenv("CURRENCY_API_KEY")
+        if currency_api_key is None:
+            raise Exception("CURRENCY_API_KEY must be set")
+
+        database_url = os.getenv("DATABASE_URL")
+        if database_url is None:
+            raise Exception("DATABASE_URL must be set")
+
+        self.cache = await self._timed(
+            "create.cache", asyncio.to_thread(cache_from_env)
+        )
+        self.currency = Currency(
+            currency_api_key, log_file=log_file_name("currency"), cache=self.cache
+        )
+        self.doujin_scraper, self.dao = await asyncio.gather(
+            self._timed("create.scraper", asyncio.to_thread(DoujinScraper, self.cache)),
+            self._timed(
+                "create.dao",
+                asyncio.to_thread(DAO, database_url, self.currency, self.cache),
+            ),
+        )
+        if LIVE_REPLICA:
+            self.dao.create_replica()
+        if RESERVATION_JOURNAL:
+            journal = self.dao.create_journal(log_file_name("reservations", "journal"))
+            self.journal_flusher = JournalFlusher(journal, self.dao.replay_reservations)
+        self.scrape_queue = ScrapeQueue(self.dao.db)
+        self.scrape_workers = ScrapeWorkerPool(
+            self.scrape_queue,
+            self.doujin_scraper,
+            self.dao,
+            on_scrape_job_finished,
+            workers=SCRAPE_WORKERS,
+        )
+        self.autocomplete = AutocompleteIndex(self.dao)
+
+    async def close(self) -> None:
+        """Stop the scrape workers, write the reservation journal to MongoDB, if possible, then disconnect from Discord.
+
+        The scrape workers are stopped first, as they may add reservations to the journal.
+        """
+        if self.scrape_workers is not None:
+            await self.scrape_workers.stop()
+        if self.journal_flusher is not None:
+            await self.journal_flusher.stop()
+        await super().close()
+
+    async def on_ready(self) -> None:
+        """Report how long each startup phase took, the first time the bot is ready."""
+        if "gateway" in self.startup_timings:
+            return
+
+        self._end_phase("gateway")
+        for phase, duration in self.startup_timings.items():
+            STARTUP_PHASE_DURATION.labels(phase=phase).set(duration)
+
+        logger.warning(
+            "Startup timings: %s",
+            ", ".join(
+                f"{phase} {duration:.3f}s"
+                for phase, duration in self.startup_timings.items()
+            ),
+        )
+
+    def _warm_up_currency(self) -> None:
+        # A failure here only means the rate is fetched by the first command that needs it
+        try:
+            self.currency.get_rate()
+        except Exception:
+            logger.exception("Failed to retrieve the currency exchange rate on startup")
+
+    async def _timed(self, phase: str, awaitable: Awaitable[T]) -> T:
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.startup_timings[phase] = time.perf_counter() - start
+
+    def _end_phase(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.startup_timings[phase] = now - self._phase_started_at
+        self._phase_started_at = now
+
+
+bot = ComiketBot(
+    command_prefix=(
+        commands.when_mentioned_or("!") if PREFIX_COMMANDS else commands.when_mentioned
+    ),
+    intents=intents,
+    **(SHARD_OPTIONS or {}),
+)
+
+
+async def assign_legacy_guild():
+    """Assign the users and reservations created before data was scoped by server to DEFAULT_GUILD_ID.
+
+    Without DEFAULT_GUILD_ID, that data stays hidden from every server.
+    """
+    try:
+        if DEFAULT_GUILD_ID is not None:
+            assigned = await asyncio.to_thread(
+                bot.dao.assign_legacy_guild, int(DEFAULT_GUILD_ID)
+            )
+            if assigned:
+                logger.warning(
+                    "Assigned %d users and reservations to server %s",
+                    assigned,
+                    DEFAULT_GUILD_ID,
+                )
+        elif await asyncio.to_thread(bot.dao.has_users_without_guild):
+            logger.warning(
+                "Some users don't belong to any server, set DEFAULT_GUILD_ID to assign them to one"
+            )
+    except Exception:
+        logger.exception("Failed to assign legacy data to a server")
+
+
+async def migrate_embedded_reservations():
+    """Move reservations still stored in the legacy embedded arrays into the reservations collection.
+
+    The reservation totals of every user, and the reservation counts of every doujin, are then rebuilt if they may
+    be missing or stale.
+    """
+    try:
+        migrated = await asyncio.to_thread(bot.dao.migrate_embedded_reservations)
+        if migrated:
+            logger.warning("Migrated %d embedded reservations", migrated)
+            # Migrated reservations don't belong to any server yet
+            await assign_legacy_guild()
+
+        if migrated or await asyncio.to_thread(bot.dao.has_users_without_totals):
+            updated = await asyncio.to_thread(bot.dao.rebuild_user_totals)
+            logger.warning("Rebuilt the reservation totals of %d users", updated)
+
+        if migrated or await asyncio.to_thread(bot.dao.has_reservations_without_stats):
+            updated = await asyncio.to_thread(bot.dao.rebuild_doujin_stats)
+            logger.warning("Rebuilt the reservation counts of %d doujin", updated)
+    except Exception:
+        logger.exception("Failed to migrate embedded reservations")
+
+
+async def merge_duplicate_doujin():
+    """Canonicalize the URL of every doujin, merging doujin whose URLs only differed by their scheme, host or query."""
+    try:
+        merged = await asyncio.to_thread(bot.dao.merge_duplicate_doujin)
+        if merged:
+            logger.warning("Canonicalized or merged %d doujin", merged)
+    except Exception:
+        logger.exception("Failed to canonicalize the URL of doujin")
+
+
+async def index_search_ngrams():
+    """Make the doujin added before !search existed searchable by the Japanese substrings of their titles."""
+    try:
+        updated = await asyncio.to_thread(bot.dao.index_search_ngrams)
+        if updated:
+            logger.warning("Computed the search terms of %d doujin", updated)
+    except Exception:
+        logger.exception("Failed to compute the search terms of doujin")
+
+
+@bot.event
+async def on_command_error(ctx: commands.Context, error: commands.CommandError):
+    """Reply with the usage of a command ran with missing or invalid arguments, and log every other error.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord.py command context.
+    error : commands.CommandError
+        Error raised while parsing the arguments or running the command
+
+    """
+    if isinstance(error, commands.UserInputError) and ctx.command is not None:
+        await ctx.send(
+            f"Error: {error}\nUsage: `{ctx.clean_prefix}{ctx.command.qualified_name} {ctx.command.signature}`"
+        )
+        return
+
+    await commands.Bot.on_command_error(bot, ctx, error)
+
+
+@bot.before_invoke
+async def before_invoke(ctx: commands.Context):
+    """Record when a command started executing.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord.py command context.
+
+    """
+    ctx.started_at = time.perf_counter()
+    if ctx.command is not None:
+        ctx.query_log_token = current_query_log.set(
+            CommandQueryLog(ctx.command.qualified_name)
+        )
+
+
+@bot.after_invoke
+async def after_invoke(ctx: commands.Context):
+    """Record the latency and database usage of a command once it has finished executing.
+
+    Commands that exceed the round trip or latency budget are logged along with every query they made.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord.py command context.
+
+    """
+    if ctx.command is not None and hasattr(ctx, "started_at"):
+        COMMAND_LATENCY.labels(
+            command=ctx.command.qualified_name,
+            status="error" if ctx.command_failed else "success",
+        ).observe(time.perf_counter() - ctx.started_at)
+
+    query_log = current_query_log.get()
+    if query_log is None:
+        return
+
+    current_query_log.reset(ctx.query_log_token)
+    COMMAND_ROUND_TRIPS.labels(command=query_log.command).observe(query_log.round_trips)
+    if (
+        query_log.round_trips > SLOW_COMMAND_MAX_ROUND_TRIPS
+        or query_log.elapsed_ms > SLOW_COMMAND_MAX_MS
+    ):
+        logger.warning("Slow command: %s", json.dumps(query_log.to_record()))
+
+
+def resolve_doujin_ids(
+    args: list[str], guild_id: int
+) -> dict[str, DoujinWithReservationData]:
+    """Resolve doujin IDs passed as command arguments, using a single batched lookup.
+
+    Parameters
+    ----------
+    args : list[str]
+        Doujin IDs, as passed to the command.
+    guild_id : int
+        Id of the Discord server whose reservations are retrieved.
+
+    Returns
+    -------
+    dict[str, DoujinWithReservationData]
+        Doujin with reservation data, keyed by the argument that referred to them.
+
+    """
+    invalid_ids = [arg for arg in args if not ObjectId.is_valid(arg)]
+    if invalid_ids:
+        raise Exception(f"Invalid doujin id(s): {', '.join(invalid_ids)}")
+
+    doujin_ids = [ObjectId(arg) for arg in args]
+    doujins = bot.dao.get_doujins_by_ids_with_reservation_data(doujin_ids, guild_id)
+
+    missing_ids = [arg for arg, doujin in zip(args, doujins) if doujin is None]
+    if missing_ids:
+        raise Exception(f"Unable to find doujin with id(s): {', '.join(missing_ids)}")
+
+    return {arg: doujin for arg, doujin in zip(args, doujins) if doujin is not None}
+
+
+def get_or_add_user(
+    discord_id: int, name: str, guild_id: int
+) -> UserWithReservationData:
+    """Retrieve a user, creating it on its first interaction.
+
+    Parameters
+    ----------
+    discord_id : int
+        Discord Id
+    name : str
+        Name of the user, only used if the user is created
+    guild_id : int
+        Id of the Discord server
+
+    Returns
+    -------
+    UserWithReservationData
+        The user, with its reservations in the server.
+
+    """
+    user = bot.dao.get_user_by_discord_id(discord_id, guild_id)
+    # Creates user on first interaction
+    if not user:
+        user = bot.dao.add_user(discord_id, name, guild_id)
+
+    return user
+
+
+def reserve_doujin(
+    user: UserWithReservationData, doujin: DoujinWithReservationData
+) -> str:
+    """Reserve a doujin for a user, unless it is already reserved.
+
+    Parameters
+    ----------
+    user : UserWithReservationData
+        User making the reservation
+    doujin : DoujinWithReservationData
+        Doujin to reserve
+
+    Returns
+    -------
+    str
+        Status message to reply with.
+
+    """
+    if user.has_reserved(doujin._id):
+        # Already reserved, print message
+        return f"<@{user.discord_id}> has already reserved {doujin.title}"
+
+    # Add reservation
+    bot.dao.add_reservation(user, doujin)
+    bot.autocomplete.forget_reservations(user.guild_id, user.discord_id)
+    return f"Added reserveration {doujin.title} for <@{user.discord_id}>"
+
+
+async def on_scrape_job_finished(
+    job: dict, doujin: DoujinWithReservationData | None
+) -> None:
+    """Reserve a scraped doujin for everyone who submitted its URL, and update the messages acknowledging them.
+
+    Parameters
+    ----------
+    job : dict
+        Scrape job that won't be retried
+    doujin : DoujinWithReservationData | None
+        Doujin added from the scraped page, None if the job failed
+
+    """
+    for request in job.get("requests", []):
+        try:
+            if doujin is not None:
+                await asyncio.to_thread(reserve_scraped_doujin, request, doujin._id)
+            # Requests made before a message acknowledged multiple URLs only hold the URL of their job
+            await update_scrape_reply(request, request.get("urls", [job["url"]]))
+        except Exception:
+            logger.exception("Failed to handle a request for %s", job["url"])
+
+
+def reserve_scraped_doujin(request: dict, doujin_id: ObjectId) -> None:
+    """Reserve a scraped doujin for the user who submitted its URL.
+
+    Parameters
+    ----------
+    request : dict
+        Request recorded when the URL was submitted to the scrape queue
+    doujin_id : ObjectId
+        Id of the doujin added from the scraped page
+
+    """
+    doujin = bot.dao.get_doujin_by_id_with_reservation_data(
+        doujin_id, request["guild_id"]
+    )
+    user = get_or_add_user(request["discord_id"], request["name"], request["guild_id"])
+    reserve_doujin(user, doujin)
+
+
+def render_scrape_reply(
+    request: dict, urls: list[str]
+) -> tuple[str, list[discord.Embed]]:
+    """Generate the message acknowledging URLs submitted to the scrape queue, from the status of their jobs.
+
+    The message is generated from the database rather than from the job that just finished, so that it is the same
+    whichever process or worker updates it.
+
+    Parameters
+    ----------
+    request : dict
+        Request recorded when the URLs were submitted to the scrape queue
+    urls : list[str]
+        URLs acknowledged by the message
+
+    Returns
+    -------
+    tuple[str, list[discord.Embed]]
+        Content of the message, and the embeds of the reserved doujin.
+
+    """
+    jobs = bot.scrape_queue.get_jobs(urls)
+    doujin_ids = [
+        job["doujin_id"] for job in jobs.values() if job["status"] == JOB_DONE
+    ]
+    doujins = {
+        doujin._id: doujin
+        for doujin in bot.dao.get_doujins_by_ids_with_reservation_data(
+            doujin_ids, request["guild_id"]
+        )
+        if doujin is not None
+    }
+    user = bot.dao.get_user_by_discord_id(request["discord_id"], request["guild_id"])
+
+    lines = []
+    embeds = []
+    finished = 0
+    for url in urls:
+        job = jobs.get(url, {})
+        doujin = doujins.get(job.get("doujin_id"))
+        if job.get("status") == JOB_FAILED:
+            lines.append(f"Error: unable to add {url}: {job.get('error')}")
+            finished += 1
+        elif doujin is not None and user is not None and user.has_reserved(doujin._id):
+            lines.append(
+                f"Added reserveration {doujin.title} for <@{request['discord_id']}>"
+            )
+            finished += 1
+            if len(embeds) < MAX_EMBEDS_PER_MESSAGE:
+                embeds.append(generate_doujin_embed(doujin))
+        else:
+            lines.append(f"Fetching {url}")
+
+    header = f"Fetched {finished}/{len(urls)} doujin for <@{request['discord_id']}>"
+    return fit_message_content([header, *lines]), embeds
+
+
+async def update_scrape_reply(request: dict, urls: list[str]) -> None:
+    """Update the message acknowledging URLs submitted to the scrape queue with the status of each of them.
+
+    Parameters
+    ----------
+    request : dict
+        Request recorded when the URLs were submitted to the scrape queue
+    urls : list[str]
+        URLs acknowledged by the message
+
+    """
+    # Edits made by this process are serialized, so that an edit never overwrites a newer one
+    async with scrape_reply_lock:
+        content, embeds = await asyncio.to_thread(render_scrape_reply, request, urls)
+        await edit_scrape_reply(request, content, embeds)
+
+
+async def edit_scrape_reply(
+    request: dict, content: str, embeds: list[discord.Embed]
+) -> None:
+    """Update the message acknowledging URLs submitted to the scrape queue.
+
+    The message is edited through its channel id, so any shard process can update it.
+
+    Parameters
+    ----------
+    request : dict
+        Request recorded when the URLs were submitted to the scrape queue
+    content : str
+        New content of the message
+    embeds : list[discord.Embed]
+        New embeds of the message
+
+    """
+    message = bot.get_partial_messageable(request["channel_id"]).get_partial_message(
+        request["message_id"]
+    )
+    await message.edit(content=content, embeds=embeds)
+
+
+@bot.hybrid_command(
     brief="Add reservations to doujin to the database.  Doujin can be referred to by ID or URL"
 )
-async def add(ctx: commands.Context, *args: str):
+@commands.guild_only()
+@app_commands.describe(doujins="Melonbooks URLs or doujin IDs, separated by spaces")
+async def add(ctx: commands.Context, *, doujins: str):
     """Command to add a (multiple) doujin(s) reservation for a user.
 
     Arguments can be Melonbooks or Doujin IDs
@@ -48,138 +705,216 @@ async def add(ctx: commands.Context, *args: str):
     ----------
     ctx : commands.Context
         Discord.py command context.
-    args : tuple(str)
-        Melonbook URL or IDS to create a reservation(s) for.
+    doujins : str
+        Melonbook URL or IDS to create a reservation(s) for, separated by spaces.
 
     """
-    to_add = []
-    for arg in args:
-        # parse URL
-        try:
+    args = doujins.split()
+    name = ctx.author.global_name if ctx.author.global_name else ctx.author.display_name
+
+    def reserve() -> tuple[list[str], list[DoujinWithReservationData], list[str]]:
+        doujin_by_id = resolve_doujin_ids(
+            [arg for arg in args if "melonbooks" not in arg], ctx.guild.id
+        )
+
+        to_add = []
+        to_scrape = []
+        for arg in args:
+            # parse URL
             if "melonbooks" in arg:
                 # Get doujin data if this is the first time
-                doujin = dao.get_doujin_by_url(arg)
+                url = canonicalize_url(arg)
+                doujin = bot.dao.get_doujin_by_url(url, ctx.guild.id)
                 if not doujin:
-                    (
-                        title,
-                        price_in_yen,
-                        circle_name,
-                        author_names,
-                        genres,
-                        events,
-                        is_r18,
-                        image_preview_url,
-                    ) = doujin_scraper.scrape_url(arg)
-                    doujin = dao.add_doujin(
-                        arg,
-                        title,
-                        price_in_yen,
-                        circle_name,
-                        author_names,
-                        genres,
-                        events,
-                        is_r18,
-                        image_preview_url,
-                    )
+                    # Scraped in the background, see on_scrape_job_finished
+                    if url not in to_scrape:
+                        to_scrape.append(url)
+                    continue
 
             else:
-                doujin_id = ObjectId(arg)
-                doujin = dao.get_doujin_by_id_with_reservation_data(doujin_id)
-                if doujin is None:
-                    raise Exception(f"Unable to find doujin with id {doujin_id}")
+                doujin = doujin_by_id[arg]
 
-        except Exception as e:
-            await ctx.send(f"Error: {e}")
-            raise e
+            to_add.append(doujin)
 
-        to_add.append(doujin)
+        user = get_or_add_user(ctx.author.id, name, ctx.guild.id)
+        return [reserve_doujin(user, doujin) for doujin in to_add], to_add, to_scrape
 
+    # Looking up and reserving may take longer than the 3 seconds Discord gives to respond to a slash command
+    await ctx.defer()
     try:
-        discord_id = ctx.author.id
-        user = dao.get_user_by_discord_id(discord_id)
-        # Creates user on first interaction
-        if not user:
-            # Add reservation
-            name = (
-                ctx.author.global_name
-                if ctx.author.global_name
-                else ctx.author.display_name
+        messages, to_add, to_scrape = await asyncio.to_thread(reserve)
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await reply_with_doujin_embeds(ctx, messages, to_add)
+
+    if not to_scrape:
+        return
+
+    # A single message acknowledges every URL, it is updated as they are scraped
+    try:
+        reply = await ctx.reply(
+            fit_message_content(
+                [
+                    (
+                        f"Fetching {len(to_scrape)} doujin for <@{ctx.author.id}>, "
+                        "this message will be updated as they are added"
+                    ),
+                    *to_scrape,
+                ]
             )
+        )
+        request = {
+            "guild_id": ctx.guild.id,
+            "channel_id": ctx.channel.id,
+            "message_id": reply.id,
+            "discord_id": ctx.author.id,
+            "name": name,
+            "urls": to_scrape,
+        }
 
-            user = dao.add_user(discord_id, name)
+        def submit() -> list[dict]:
+            jobs = [bot.scrape_queue.submit(url, request) for url in to_scrape]
+            for job in jobs:
+                if job["status"] == JOB_DONE:
+                    # Added since it was looked up
+                    reserve_scraped_doujin(request, job["doujin_id"])
+            return jobs
 
+        jobs = await asyncio.to_thread(submit)
+        bot.scrape_workers.wake()
+        if any(job["status"] == JOB_DONE for job in jobs):
+            await update_scrape_reply(request, to_scrape)
     except Exception as e:
         await ctx.send(f"Error: {e}")
         raise e
 
-    for doujin in to_add:
-        if user.has_reserved(doujin._id):
-            # Already reserved, print message
-            message = f"<@{ctx.author.id}> has already reserved {doujin.title}"
-        else:
-            # Add reservation
-            dao.add_reservation(user, doujin)
-            message = f"Added reserveration {doujin.title} for <@{ctx.author.id}>"
 
-        await generate_doujin_embed(ctx, message, doujin)
+@bot.hybrid_command(
+    name="import",
+    brief="Add reservations to every doujin listed in an attached text or CSV file of URLs or IDs",
+)
+@commands.guild_only()
+@app_commands.describe(file="Text or CSV file of Melonbooks URLs or doujin IDs")
+async def import_(ctx: commands.Context, file: discord.Attachment | None = None):
+    """Command to add reservations to every doujin listed in an attached file.
 
+    The progress is reported by editing a single reply.
 
-@bot.command(
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord.py command context.
+    file : discord.Attachment | None
+        Text or CSV file of Melonbooks URLs or IDs, the first attachment of the message for prefix commands
+
+    """
+    await ctx.defer()
+    try:
+        if file is None:
+            raise Exception("Attach a text or CSV file of Melonbooks URLs or IDs")
+
+        tokens = parse_import_file(await file.read())
+        if not tokens:
+            raise Exception("No Melonbooks URL or ID found in the attached file")
+
+        name = (
+            ctx.author.global_name
+            if ctx.author.global_name
+            else ctx.author.display_name
+        )
+        user = await asyncio.to_thread(
+            get_or_add_user, ctx.author.id, name, ctx.guild.id
+        )
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    reply = await ctx.reply(f"Importing {len(tokens)} doujin for <@{ctx.author.id}>")
+    last_edit = time.monotonic()
+
+    async def on_progress(progress: ImportProgress):
+        nonlocal last_edit
+        if time.monotonic() - last_edit >= IMPORT_PROGRESS_INTERVAL:
+            last_edit = time.monotonic()
+            await reply.edit(content=progress.summary())
+
+    try:
+        progress = await import_reservations(
+            bot.dao, bot.doujin_scraper, user, tokens, on_progress
+        )
+    except Exception as e:
+        await reply.edit(content=f"Error: {e}")
+        raise e
+    finally:
+        bot.autocomplete.forget_reservations(ctx.guild.id, ctx.author.id)
+
+    await reply.edit(content=progress.summary())
+
+
+@bot.hybrid_command(
     brief="Remove reservations to doujin to the database.  Doujin must be referred to using their ID."
 )
-async def rm(ctx: commands.Context, *args: str):
+@commands.guild_only()
+@app_commands.describe(doujin_ids="IDs of the doujin, separated by spaces")
+async def rm(ctx: commands.Context, *, doujin_ids: str):
     """Command to remove a doujin reservation for a user.
 
     Parameters
     ----------
     ctx : commands.Context
         Discord.py command context.
-    args : tuple(str)
-        IDs to remove a reservation(s) for.
+    doujin_ids : str
+        IDs to remove a reservation(s) for, separated by spaces.
 
     """
-    # TODO: Force updates to doujin/user metadata after a interval of time
-    to_add = []
-    for arg in args:
-        try:
-            doujin = dao.get_doujin_by_id_with_reservation_data(ObjectId(arg))
-            if doujin is None:
-                raise Exception(f"Unable to find doujin with url: {arg}")
-            to_add.append(doujin)
-        except Exception as e:
-            await ctx.send(f"Error: {e}")
-            raise e
+    args = doujin_ids.split()
+    discord_id = ctx.author.id
 
-    try:
-        discord_id = ctx.author.id
-        user = dao.get_user_by_discord_id(discord_id)
+    def remove() -> list[str]:
+        # TODO: Force updates to doujin/user metadata after a interval of time
+        doujin_by_id = resolve_doujin_ids(list(args), ctx.guild.id)
+        to_remove = [doujin_by_id[arg] for arg in args]
+
+        user = bot.dao.get_user_by_discord_id(discord_id, ctx.guild.id)
         # Creates user on first interaction
         if not user:
             raise Exception(
                 "Cannot remove doujin from user that doesn't exist in the database."
             )
 
-    except Exception as e:
-        await ctx.send(f"Error: {e}")
-        raise e
-
-    try:
-        for doujin in to_add:
+        messages = []
+        for doujin in to_remove:
             if not user.has_reserved(doujin._id):
                 # Already reserved, print message
-                message = f"<@{ctx.author.id}> has not reserved {doujin.title}, cannot remove."
+                messages.append(
+                    f"<@{discord_id}> has not reserved {doujin.title}, cannot remove."
+                )
             else:
                 # Add reservation
-                dao.remove_reservation(user, doujin)
-                message = f"Removed reserveration {doujin.title} for <@{ctx.author.id}>"
-            await ctx.reply(message)
+                bot.dao.remove_reservation(user, doujin)
+                bot.autocomplete.forget_reservations(ctx.guild.id, discord_id)
+                messages.append(
+                    f"Removed reserveration {doujin.title} for <@{discord_id}>"
+                )
+
+        return messages
 
+    await ctx.defer()
+    try:
+        messages = await asyncio.to_thread(remove)
     except Exception as e:
         await ctx.send(f"Error: {e}")
         raise e
 
+    for message in messages:
+        await ctx.reply(message)
+
 
-@bot.command(brief="Lists all doujin reservation made by the user")
+@bot.hybrid_command(brief="Lists all doujin reservation made by the user")
+@commands.guild_only()
+@app_commands.describe(user="User whose reservations are listed, yourself by default")
 async def ls(ctx: commands.Context, user: discord.Member | None = None):
     """List all doujins reserved by a user.
 
@@ -201,12 +936,17 @@ async def ls(ctx: commands.Context, user: discord.Member | None = None):
         message = "List of added Doujins"
 
     discord_id = user.id if user is not None else ctx.author.id
+    await ctx.defer()
     reservations = []
+    total_yen, total_usd = 0, 0.0
     try:
-        user_data = dao.get_user_by_discord_id(discord_id)
+        user_data = await asyncio.to_thread(
+            bot.dao.get_user_by_discord_id, discord_id, ctx.guild.id
+        )
         # Creates user on first interaction
         if user_data:
             reservations = user_data.reservations
+            total_yen, total_usd = user_data.total_yen, user_data.total_usd
         else:
             reservations = []
 
@@ -214,43 +954,208 @@ async def ls(ctx: commands.Context, user: discord.Member | None = None):
         await ctx.send(f"Error: {e}")
         raise e
 
-    await list_doujins(message, ctx, reservations)
+    await list_doujins(message, ctx, reservations, total_yen, total_usd)
+
 
+@rm.autocomplete("doujin_ids")
+async def rm_autocomplete(
+    interaction: discord.Interaction, current: str
+) -> list[app_commands.Choice[str]]:
+    """Suggest the doujin reserved by the user, by title, circle or ID.
+
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        Autocomplete interaction
+    current : str
+        What the user typed so far
 
-@bot.command(brief="Show doujin details given an ID")
-async def show(ctx: commands.Context, *args: str):
+    Returns
+    -------
+    list[app_commands.Choice[str]]
+        Suggestions
+
+    """
+    if interaction.guild_id is None:
+        return []
+
+    return await bot.autocomplete.suggest_reserved(
+        interaction.guild_id, interaction.user.id, current
+    )
+
+
+@bot.hybrid_command(brief="Show doujin details given an ID")
+@commands.guild_only()
+@app_commands.describe(doujin_ids="IDs of the doujin, separated by spaces")
+async def show(ctx: commands.Context, *, doujin_ids: str):
     """Show data related to a doujin given an Id.
 
     Parameters
     ----------
     ctx : commands.Context
         Discord context
-    args : str
-        List of IDs
+    doujin_ids : str
+        IDs, separated by spaces
 
     """
-    to_show = []
-    for arg in args:
-        try:
-            doujin = dao.get_doujin_by_id_with_reservation_data(ObjectId(arg))
-            if doujin is None:
-                raise Exception(f"Unable to find doujin with id {arg}")
-
-            to_show.append(doujin)
-        except Exception as e:
-            await ctx.send(f"Error: {e}")
-            raise e
-
-    for doujin in to_show:
-        if doujin is not None:
-            await generate_doujin_embed(ctx, "", doujin)
+    args = doujin_ids.split()
+    await ctx.defer()
+    try:
+        doujin_by_id = await asyncio.to_thread(
+            resolve_doujin_ids, list(args), ctx.guild.id
+        )
+        to_show = [doujin_by_id[arg] for arg in args]
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await reply_with_doujin_embeds(ctx, ["" for _ in to_show], to_show)
+
+
+@show.autocomplete("doujin_ids")
+async def show_autocomplete(
+    interaction: discord.Interaction, current: str
+) -> list[app_commands.Choice[str]]:
+    """Suggest doujin by title, circle or ID, those reserved by the user first.
+
+    Parameters
+    ----------
+    interaction : discord.Interaction
+        Autocomplete interaction
+    current : str
+        What the user typed so far
+
+    Returns
+    -------
+    list[app_commands.Choice[str]]
+        Suggestions
+
+    """
+    if interaction.guild_id is None:
+        return []
+
+    return await bot.autocomplete.suggest_doujin(
+        interaction.guild_id, interaction.user.id, current
+    )
+
+
+@bot.hybrid_command(brief="Search doujin by title, circle, author, genre or event")
+@commands.guild_only()
+@app_commands.describe(query="Words to search for, any of which matches")
+async def search(ctx: commands.Context, *, query: str):
+    """Search the doujin in the database, best match first.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord context
+    query : str
+        Words to search for
+
+    """
+    await ctx.defer()
+    try:
+        results = await asyncio.to_thread(bot.dao.search_doujin, query, ctx.guild.id)
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await list_search_results(ctx, query, results)
+
+
+@bot.hybrid_command(brief="Show the most reserved doujin, circles or events")
+@commands.guild_only()
+@app_commands.describe(kind="What to rank, doujin by default")
+async def top(
+    ctx: commands.Context, kind: Literal["doujin", "circle", "event"] = "doujin"
+):
+    """Show the doujin, circles or events with the most reservations in the current server.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord Context
+    kind : str
+        "doujin", "circle" or "event"
+
+    """
+    await ctx.defer()
+    try:
+        if kind == "doujin":
+            ranking = await asyncio.to_thread(bot.dao.retrieve_top_doujin, ctx.guild.id)
         else:
-            await ctx.send("Error: unable to find doujin with that ID")
+            ranking = await asyncio.to_thread(
+                bot.dao.retrieve_top_groups,
+                ctx.guild.id,
+                "circle_name" if kind == "circle" else "events",
+            )
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await list_top(ctx, kind, ranking)
+
+
+@bot.hybrid_command(brief="List what to buy, grouped by event and circle")
+@commands.guild_only()
+@app_commands.describe(
+    event="Only list the doujin of this event, e.g. コミックマーケット105"
+)
+async def manifest(ctx: commands.Context, *, event: str | None = None):
+    """List every reserved doujin with the number of copies to buy, grouped by event and circle, with totals.
 
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord Context
+    event : str | None
+        Only list the doujin of this event. If None, each doujin is listed under the first of its events.
 
-@bot.command(brief="Export doujin reservations to a CSV")
+    """
+    await ctx.defer()
+    try:
+        purchases = await asyncio.to_thread(
+            bot.dao.retrieve_manifest, ctx.guild.id, event
+        )
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await list_manifest(ctx, event, purchases)
+
+
+@bot.hybrid_command(brief="Export doujin reservations to a CSV")
+@commands.guild_only()
 async def export(ctx: commands.Context):
-    """Export doujin data into a CSV.
+    """Export the doujin data of the current server into a CSV.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord Context
+
+    """
+    await ctx.defer()
+    try:
+        all_users, all_doujin_data = await asyncio.gather(
+            asyncio.to_thread(bot.dao.retrieve_user_totals, ctx.guild.id),
+            asyncio.to_thread(bot.dao.retrieve_all_doujin, ctx.guild.id),
+        )
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await export_doujin_data(ctx, all_users, all_doujin_data)
+
+
+@bot.command(
+    brief="Recompute every user's reservation count and totals, and every doujin's reservation count"
+)
+@commands.is_owner()
+async def rebuild_totals(ctx: commands.Context):
+    """Recompute the reservation totals of users and the reservation counts of doujin, repairing any drift.
+
+    Only the current server is rebuilt, or every server if ran in a direct message.
 
     Parameters
     ----------
@@ -258,7 +1163,88 @@ async def export(ctx: commands.Context):
         Discord Context
 
     """
-    all_user_data = dao.retrieve_all_users()
-    all_doujin_data = dao.retrieve_all_doujin()
+    try:
+        guild_id = ctx.guild.id if ctx.guild is not None else None
+        updated = await asyncio.to_thread(bot.dao.rebuild_user_totals, guild_id)
+        updated_doujin = await asyncio.to_thread(bot.dao.rebuild_doujin_stats, guild_id)
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await ctx.reply(
+        f"Rebuilt reservation totals, {updated} user(s) and {updated_doujin} doujin were out of date"
+    )
+
+
+@bot.command(brief="Add every doujin of an event or circle ahead of time")
+@commands.is_owner()
+async def crawl(ctx: commands.Context, kind: str, *name: str):
+    """Crawl the Melonbooks listing of an event or circle, adding every doujin that isn't in the database yet.
+
+    Requests are rate limited, so crawling a large event takes a while. The reply is edited once it finishes.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord Context
+    kind : str
+        "event" or "circle"
+    name : tuple(str)
+        Name of the event or circle, as listed on Melonbooks
+
+    """
+    reply = await ctx.reply(f"Crawling {kind} {' '.join(name)}")
+    try:
+        progress = await CatalogueCrawler(bot.dao, bot.doujin_scraper).crawl(
+            kind, " ".join(name)
+        )
+    except Exception as e:
+        await reply.edit(content=f"Error: {e}")
+        raise e
+
+    await reply.edit(content=progress.summary())
+
+
+@bot.command(brief="Register the slash commands with Discord")
+@commands.is_owner()
+async def sync_commands(ctx: commands.Context):
+    """Register the slash commands with Discord, after they were added or changed.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord Context
+
+    """
+    try:
+        synced = await bot.tree.sync()
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
+
+    await ctx.reply(f"Synced {len(synced)} slash command(s)")
+
+
+@bot.command(brief="Invalidate a cache namespace in every bot process")
+@commands.is_owner()
+async def invalidate_cache(ctx: commands.Context, *namespaces: str):
+    """Invalidate cached values, e.g. after editing doujin directly in the database.
+
+    Parameters
+    ----------
+    ctx : commands.Context
+        Discord Context
+    namespaces : tuple(str)
+        Namespaces to invalidate (doujin, doujin_url, exchange_rate or scrape).
+        If none are provided, every namespace is invalidated.
+
+    """
+    try:
+        namespaces = namespaces or ("doujin", "doujin_url", "exchange_rate", "scrape")
+        for namespace in namespaces:
+            await asyncio.to_thread(bot.cache.invalidate, namespace)
+    except Exception as e:
+        await ctx.send(f"Error: {e}")
+        raise e
 
-    await export_doujin_data(ctx, all_user_data, all_doujin_data)
+    await ctx.reply(f"Invalidated {', '.join(namespaces)}")
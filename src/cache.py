@@ -0,0 +1,395 @@
+"""Key-value caches shared by the DAO, the currency wrapper and the scraper."""
+
+import json
+import logging
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any
+
+import bson
+import redis
+
+from src.metrics import CACHE_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+
+class Cache(ABC):
+    """Base class of the cache backends.
+
+    Keys are grouped into namespaces (e.g. "doujin"). Every namespace has a version that is part of the keys stored by
+    the backend, so invalidating a namespace is a single version increment instead of deleting every key.
+
+    Values are stored BSON encoded, so anything a MongoDB document can hold (ObjectId, datetime, lists, dicts, ...)
+    can be cached, and callers never share mutable values with the cache. None cannot be cached.
+
+    Attributes
+    ----------
+    prefix : Prefix of every key stored by the backend
+
+    """
+
+    def __init__(self, prefix: str = "comiket:"):
+        """Initialize the cache.
+
+        Parameters
+        ----------
+        prefix : str
+            Prefix of every key stored by the backend
+
+        """
+        self.prefix = prefix
+
+    def get(self, namespace: str, key: str) -> Any | None:
+        """Retrieve a value from the cache.
+
+        Parameters
+        ----------
+        namespace : str
+            Namespace of the key
+        key : str
+            Key
+
+        Returns
+        -------
+        Any | None
+            The cached value, or None if it isn't cached or has expired.
+
+        """
+        return self.get_many(namespace, [key]).get(key)
+
+    def get_many(self, namespace: str, keys: list[str]) -> dict[str, Any]:
+        """Retrieve multiple values from the cache, using a single request.
+
+        Parameters
+        ----------
+        namespace : str
+            Namespace of the keys
+        keys : list[str]
+            Keys
+
+        Returns
+        -------
+        dict[str, Any]
+            Cached values, keyed by key. Keys that aren't cached are left out.
+
+        """
+        if not keys:
+            return {}
+
+        version = self._version(namespace)
+        raw_values = self._load(
+            [self._full_key(namespace, version, key) for key in keys]
+        )
+
+        values = {
+            key: bson.decode(raw_value)["value"]
+            for key, raw_value in zip(keys, raw_values)
+            if raw_value is not None
+        }
+        CACHE_REQUESTS.labels(cache=namespace, result="hit").inc(len(values))
+        CACHE_REQUESTS.labels(cache=namespace, result="miss").inc(
+            len(keys) - len(values)
+        )
+
+        return values
+
+    def set(
+        self, namespace: str, key: str, value: Any, ttl: float | None = None
+    ) -> None:
+        """Store a value in the cache.
+
+        Parameters
+        ----------
+        namespace : str
+            Namespace of the key
+        key : str
+            Key
+        value : Any
+            Value, must be BSON encodable
+        ttl : float | None
+            Time to live, in seconds. If None, the value is kept until evicted or invalidated.
+
+        """
+        self.set_many(namespace, {key: value}, ttl)
+
+    def set_many(
+        self, namespace: str, values: dict[str, Any], ttl: float | None = None
+    ) -> None:
+        """Store multiple values in the cache, using a single request.
+
+        Parameters
+        ----------
+        namespace : str
+            Namespace of the keys
+        values : dict[str, Any]
+            Values, keyed by key. Values must be BSON encodable.
+        ttl : float | None
+            Time to live, in seconds. If None, the values are kept until evicted or invalidated.
+
+        """
+        if not values:
+            return
+
+        if any(value is None for value in values.values()):
+            raise ValueError("None cannot be cached")
+
+        version = self._version(namespace)
+        self._store(
+            {
+                self._full_key(namespace, version, key): bson.encode({"value": value})
+                for key, value in values.items()
+            },
+            ttl,
+        )
+
+    def delete(self, namespace: str, key: str) -> None:
+        """Remove a value from the cache.
+
+        Parameters
+        ----------
+        namespace : str
+            Namespace of the key
+        key : str
+            Key
+
+        """
+        self._remove([self._full_key(namespace, self._version(namespace), key)])
+
+    def invalidate(self, namespace: str) -> int:
+        """Invalidate every value of a namespace, in every instance sharing the cache.
+
+        Parameters
+        ----------
+        namespace : str
+            Namespace to invalidate
+
+        Returns
+        -------
+        int
+            New version of the namespace.
+
+        """
+        return self._bump_version(namespace)
+
+    def close(self) -> None:
+        """Release the resources held by the cache."""
+
+    def _full_key(self, namespace: str, version: int, key: str) -> str:
+        return f"{self.prefix}{namespace}:{version}:{key}"
+
+    @abstractmethod
+    def _load(self, full_keys: list[str]) -> list[bytes | None]:
+        """Retrieve encoded values, None for keys that aren't stored."""
+
+    @abstractmethod
+    def _store(self, values: dict[str, bytes], ttl: float | None) -> None:
+        """Store encoded values, keyed by full key."""
+
+    @abstractmethod
+    def _remove(self, full_keys: list[str]) -> None:
+        """Remove values."""
+
+    @abstractmethod
+    def _version(self, namespace: str) -> int:
+        """Retrieve the current version of a namespace."""
+
+    @abstractmethod
+    def _bump_version(self, namespace: str) -> int:
+        """Increment the version of a namespace, returning the new version."""
+
+
+class InMemoryCache(Cache):
+    """Cache held in the memory of the process, evicting the least recently used values once full.
+
+    Invalidating a namespace only increments its version: values of older versions can never be read again, and are
+    evicted as they become the least recently used.
+
+    Attributes
+    ----------
+    max_entries : Maximum number of values held
+    entries : Encoded values and when they expire (from time.monotonic), least recently used first
+    versions : Version of each namespace
+    lock : Lock guarding the entries, as the cache is used from worker threads
+
+    """
+
+    def __init__(self, max_entries: int = 10000, prefix: str = "comiket:"):
+        """Initialize an empty cache.
+
+        Parameters
+        ----------
+        max_entries : int
+            Maximum number of values held
+        prefix : str
+            Prefix of every key
+
+        """
+        super().__init__(prefix)
+        self.max_entries = max_entries
+        self.entries: OrderedDict[str, tuple[bytes, float | None]] = OrderedDict()
+        self.versions: dict[str, int] = {}
+        self.lock = threading.Lock()
+
+    def _load(self, full_keys: list[str]) -> list[bytes | None]:
+        now = time.monotonic()
+        raw_values = []
+        with self.lock:
+            for full_key in full_keys:
+                entry = self.entries.get(full_key)
+                if entry is not None and entry[1] is not None and entry[1] <= now:
+                    del self.entries[full_key]
+                    entry = None
+
+                if entry is not None:
+                    self.entries.move_to_end(full_key)
+                raw_values.append(entry[0] if entry is not None else None)
+
+        return raw_values
+
+    def _store(self, values: dict[str, bytes], ttl: float | None) -> None:
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self.lock:
+            for full_key, raw_value in values.items():
+                self.entries[full_key] = (raw_value, expires_at)
+                self.entries.move_to_end(full_key)
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def _remove(self, full_keys: list[str]) -> None:
+        with self.lock:
+            for full_key in full_keys:
+                self.entries.pop(full_key, None)
+
+    def _version(self, namespace: str) -> int:
+        return self.versions.get(namespace, 0)
+
+    def _bump_version(self, namespace: str) -> int:
+        with self.lock:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+            return self.versions[namespace]
+
+
+class RedisCache(Cache):
+    """Cache stored in Redis, shared by every process and shard, and kept across restarts.
+
+    Namespace versions are kept locally to avoid a round trip per lookup. Invalidating a namespace publishes its new
+    version, so that every instance stops reading the old version right away. Messages carry the version, so a
+    message that arrives late never rolls a namespace back. Local versions are also re-read after version_ttl seconds,
+    in case a message was missed while disconnected.
+
+    Attributes
+    ----------
+    client : Redis client
+    channel : Pub/sub channel invalidation messages are published on
+    version_ttl : Number of seconds a namespace version is trusted before being read again
+    versions : Version of each namespace, and when it was read (from time.monotonic)
+    listener : Thread receiving invalidation messages
+
+    """
+
+    def __init__(self, url: str, prefix: str = "comiket:", version_ttl: float = 30):
+        """Connect to Redis and subscribe to invalidation messages.
+
+        Parameters
+        ----------
+        url : str
+            Redis URL, e.g. redis://localhost:6379/0
+        prefix : str
+            Prefix of every key
+        version_ttl : float
+            Number of seconds a namespace version is trusted before being read again
+
+        """
+        super().__init__(prefix)
+        self.client = redis.Redis.from_url(url)
+        self.channel = f"{prefix}invalidations"
+        self.version_ttl = version_ttl
+        self.versions: dict[str, tuple[int, float]] = {}
+        self.lock = threading.Lock()
+
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: self._on_invalidation})
+        self.listener = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def close(self) -> None:
+        """Stop receiving invalidation messages and close the connections to Redis."""
+        self.listener.stop()
+        self.client.close()
+
+    def _load(self, full_keys: list[str]) -> list[bytes | None]:
+        return self.client.mget(full_keys)
+
+    def _store(self, values: dict[str, bytes], ttl: float | None) -> None:
+        pipeline = self.client.pipeline(transaction=False)
+        for full_key, raw_value in values.items():
+            pipeline.set(full_key, raw_value, px=int(ttl * 1000) if ttl else None)
+        pipeline.execute()
+
+    def _remove(self, full_keys: list[str]) -> None:
+        self.client.delete(*full_keys)
+
+    def _version_key(self, namespace: str) -> str:
+        return f"{self.prefix}{namespace}:version"
+
+    def _version(self, namespace: str) -> int:
+        with self.lock:
+            local = self.versions.get(namespace)
+        if local is not None and time.monotonic() - local[1] < self.version_ttl:
+            return local[0]
+
+        version = int(self.client.get(self._version_key(namespace)) or 0)
+        self._observe_version(namespace, version)
+        return version
+
+    def _bump_version(self, namespace: str) -> int:
+        version = self.client.incr(self._version_key(namespace))
+        self._observe_version(namespace, version)
+        self.client.publish(
+            self.channel, json.dumps({"namespace": namespace, "version": version})
+        )
+        return version
+
+    def _observe_version(self, namespace: str, version: int) -> None:
+        with self.lock:
+            local = self.versions.get(namespace)
+            if local is None or version >= local[0]:
+                self.versions[namespace] = (version, time.monotonic())
+
+    def _on_invalidation(self, message: dict) -> None:
+        try:
+            invalidation = json.loads(message["data"])
+            self._observe_version(
+                invalidation["namespace"], int(invalidation["version"])
+            )
+        except Exception:
+            logger.exception("Ignoring malformed cache invalidation message")
+
+
+def cache_from_env() -> Cache:
+    """Create the cache configured by environment variables.
+
+    CACHE_URL selects the backend: unset for an in-memory cache, or a redis:// URL to share the cache between
+    processes. CACHE_PREFIX (default "comiket:") prefixes every key, so multiple deployments can share a server.
+    CACHE_MAX_ENTRIES (default 10000) bounds the in-memory cache.
+
+    Returns
+    -------
+    Cache
+        The cache.
+
+    """
+    prefix = os.getenv("CACHE_PREFIX", "comiket:")
+    url = os.getenv("CACHE_URL")
+    if url is not None:
+        if not url.startswith(("redis://", "rediss://", "unix://")):
+            raise ValueError(f"Unsupported cache URL {url}")
+
+        # Never fall back to a cache local to the process, other processes would keep reading invalidated values
+        return RedisCache(url, prefix=prefix)
+
+    return InMemoryCache(int(os.getenv("CACHE_MAX_ENTRIES", "10000")), prefix=prefix)
@@ -0,0 +1,296 @@
+"""Crawler of Melonbooks listing pages, adding the doujin of an event or circle before they are reserved."""
+
+import asyncio
+import html
+import logging
+import os
+import re
+import time
+from urllib.parse import urlencode, urljoin
+
+from src.dao import DAO
+from src.scrape import (
+    MELONBOOKS_BASE_URL,
+    DoujinMetadata,
+    DoujinScraper,
+    canonicalize_url,
+)
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of seconds between two requests of a crawl, listing and product pages alike
+CRAWL_REQUEST_INTERVAL = float(os.getenv("CRAWL_REQUEST_INTERVAL", "1"))
+# Maximum number of listing pages walked by a crawl
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "50"))
+# Number of product pages being fetched at once, the request interval still applies
+CRAWL_CONCURRENCY = 2
+# Number of scraped doujin inserted together
+CRAWL_BATCH_SIZE = 50
+
+# Links to product pages, e.g. href="/detail/detail.php?product_id=123"
+PRODUCT_LINK = re.compile(
+    r"""href=["']([^"']*detail\.php\?[^"']*product_id=\d+[^"']*)["']"""
+)
+
+
+class RateLimiter:
+    """Spaces out requests shared by concurrent tasks, so that they start at least interval seconds apart.
+
+    Attributes
+    ----------
+    interval : Minimum number of seconds between two requests
+    next_slot : When the next request may start (from time.monotonic)
+    lock : Lock handing out slots in order
+
+    """
+
+    def __init__(self, interval: float):
+        """Initialize a rate limiter whose first slot is available right away.
+
+        Parameters
+        ----------
+        interval : float
+            Minimum number of seconds between two requests
+
+        """
+        self.interval = interval
+        self.next_slot = 0.0
+        self.lock = asyncio.Lock()
+
+    async def wait(self) -> None:
+        """Wait for the next slot."""
+        async with self.lock:
+            delay = self.next_slot - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.next_slot = time.monotonic() + self.interval
+
+
+class CrawlProgress:
+    """Outcome of a crawl.
+
+    Attributes
+    ----------
+    pages : Number of listing pages walked
+    found : Number of distinct product pages listed
+    existing : Number of listed doujin that were already in the database
+    added : Number of doujin added
+    failures : Why each listing or product page that couldn't be added failed, keyed by URL
+
+    """
+
+    def __init__(self):
+        """Initialize the outcome of a crawl that hasn't started."""
+        self.pages = 0
+        self.found = 0
+        self.existing = 0
+        self.added = 0
+        self.failures: dict[str, str] = {}
+
+    def summary(self) -> str:
+        """Describe the outcome of the crawl.
+
+        Returns
+        -------
+        str
+            Counters, followed by the number of failures.
+
+        """
+        summary = (
+            f"Walked {self.pages} listing page(s): {self.found} doujin listed, "
+            f"{self.existing} already added, {self.added} added"
+        )
+        if self.failures:
+            summary += f", {len(self.failures)} failed"
+
+        return summary
+
+
+class CatalogueCrawler:
+    """Walks the listing pages of an event or circle, and adds every listed doujin that isn't in the database yet.
+
+    Every request goes through a single rate limiter, and scraped pages are inserted in bulk.
+
+    Attributes
+    ----------
+    dao : DAO the doujin are added with
+    scraper : Melonbooks scraper, whose session is also used to fetch listing pages
+    base_url : Melonbooks URL the listing pages are under
+    rate_limiter : Rate limiter of every request
+    max_pages : Maximum number of listing pages walked by a crawl
+    concurrency : Number of product pages being fetched at once
+    batch_size : Number of scraped doujin inserted together
+
+    """
+
+    def __init__(
+        self,
+        dao: DAO,
+        scraper: DoujinScraper,
+        base_url: str = MELONBOOKS_BASE_URL,
+        request_interval: float = CRAWL_REQUEST_INTERVAL,
+        max_pages: int = CRAWL_MAX_PAGES,
+        concurrency: int = CRAWL_CONCURRENCY,
+        batch_size: int = CRAWL_BATCH_SIZE,
+    ):
+        """Initialize the crawler.
+
+        Parameters
+        ----------
+        dao : DAO
+            DAO the doujin are added with
+        scraper : DoujinScraper
+            Melonbooks scraper
+        base_url : str
+            Melonbooks URL the listing pages are under, e.g. a local fixture server
+        request_interval : float
+            Minimum number of seconds between two requests
+        max_pages : int
+            Maximum number of listing pages walked by a crawl
+        concurrency : int
+            Number of product pages being fetched at once
+        batch_size : int
+            Number of scraped doujin inserted together
+
+        """
+        self.dao = dao
+        self.scraper = scraper
+        self.base_url = base_url.rstrip("/")
+        self.rate_limiter = RateLimiter(request_interval)
+        self.max_pages = max_pages
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+
+    def listing_url(self, kind: str, name: str, page: int) -> str:
+        """Build the URL of a page of search results.
+
+        Parameters
+        ----------
+        kind : str
+            "event" or "circle"
+        name : str
+            Name of the event or circle
+        page : int
+            Page number, starting at 1
+
+        Returns
+        -------
+        str
+            URL of the listing page
+
+        """
+        if kind not in ("event", "circle"):
+            raise ValueError("kind must be 'event' or 'circle'")
+
+        query = {"mode": "search", "text_type": kind, "name": name, "pageno": page}
+        return f"{self.base_url}/search/search.php?{urlencode(query)}"
+
+    async def crawl(self, kind: str, name: str) -> CrawlProgress:
+        """Add every doujin listed for an event or circle that isn't in the database yet.
+
+        Listing pages are walked until one doesn't list any new product, while product pages are scraped as
+        soon as they are found. If a listing page can't be fetched, the walk stops there and the products already
+        listed are still added.
+
+        Parameters
+        ----------
+        kind : str
+            "event" or "circle"
+        name : str
+            Name of the event or circle
+
+        Returns
+        -------
+        CrawlProgress
+            Outcome of the crawl.
+
+        """
+        progress = CrawlProgress()
+        product_urls = asyncio.Queue(self.batch_size)
+        scraped: dict[str, DoujinMetadata] = {}
+
+        async def walk() -> None:
+            seen = set()
+            for page in range(1, self.max_pages + 1):
+                listing_url = self.listing_url(kind, name, page)
+                try:
+                    urls = await self._fetch_listing(listing_url)
+                except Exception as e:
+                    logger.warning("Failed to fetch %s: %s", listing_url, e)
+                    progress.failures[listing_url] = str(e)
+                    break
+
+                new_urls = [url for url in urls if url not in seen]
+                if not new_urls:
+                    break
+
+                progress.pages += 1
+                progress.found += len(new_urls)
+                seen.update(new_urls)
+
+                existing = await asyncio.to_thread(
+                    self.dao.get_doujin_ids_by_urls, new_urls
+                )
+                progress.existing += len(existing)
+                for url in new_urls:
+                    if url not in existing:
+                        await product_urls.put(url)
+
+            for _ in range(self.concurrency):
+                await product_urls.put(None)
+
+        async def scrape() -> None:
+            while (url := await product_urls.get()) is not None:
+                await self.rate_limiter.wait()
+                try:
+                    scraped[url] = await asyncio.to_thread(self.scraper.scrape_url, url)
+                except Exception as e:
+                    progress.failures[url] = str(e)
+                    continue
+
+                if len(scraped) >= self.batch_size:
+                    await self._insert(scraped, progress)
+
+        try:
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(walk())
+                for _ in range(self.concurrency):
+                    tasks.create_task(scrape())
+        except ExceptionGroup as e:
+            # Report the error that stopped the crawl, the other tasks were cancelled
+            raise e.exceptions[0]
+        finally:
+            # Pages that were already scraped are added even if the crawl was stopped
+            await self._insert(scraped, progress)
+
+        logger.info("Crawled %s %s: %s", kind, name, progress.summary())
+
+        return progress
+
+    async def _fetch_listing(self, url: str) -> list[str]:
+        await self.rate_limiter.wait()
+        response = await asyncio.to_thread(self.scraper.session.get, url)
+        response.raise_for_status()
+
+        # Listing pages link each product several times (cover, title, ...)
+        return list(
+            dict.fromkeys(
+                canonicalize_url(urljoin(url, html.unescape(link)))
+                for link in PRODUCT_LINK.findall(response.text)
+            )
+        )
+
+    async def _insert(
+        self, scraped: dict[str, DoujinMetadata], progress: CrawlProgress
+    ) -> None:
+        if not scraped:
+            return
+
+        batch = dict(scraped)
+        scraped.clear()
+        try:
+            added = await asyncio.to_thread(self.dao.add_doujins, batch)
+        except Exception as e:
+            progress.failures.update((url, str(e)) for url in batch)
+        else:
+            progress.added += len(added)
@@ -6,6 +6,12 @@ from pathlib import Path
 
 import requests
 
+from src.cache import Cache, InMemoryCache
+from src.metrics import CACHE_REQUESTS, CURRENCY_REFRESHES
+
+# Number of seconds an exchange rate is used before being retrieved again
+RATE_TTL = 7200
+
 
 class Currency:
     """Wrapper to hold Currency API logic.
@@ -18,6 +24,7 @@ class Currency:
     currency_from : Currency to exchange from
     currency_to : Currency to exchange to
     logger : Logger
+    cache : Cache shared with other processes, so the rate is only retrieved once per RATE_TTL
 
     """
 
@@ -27,6 +34,7 @@ class Currency:
         currency_from: str = "JPY",
         currency_to: str = "USD",
         log_file: str | Path = "currency.log",
+        cache: Cache | None = None,
     ):
         """Initialize the wrapper for the currency exchange API.
 
@@ -40,6 +48,8 @@ class Currency:
             Currency to convert from.
         currency_to : str
             Currency to convert to.
+        cache : Cache | None
+            Cache shared with other processes. If None, an in-memory cache is used.
 
         """
         self.current_rate: float = 0
@@ -47,6 +57,7 @@ class Currency:
         self.api_key: str = api_key
         self.currency_from: str = currency_from
         self.currency_to: str = currency_to
+        self.cache: Cache = cache if cache is not None else InMemoryCache()
 
         self.logger = logging.getLogger(__name__)
 
@@ -75,18 +86,28 @@ class Currency:
             try:
                 self.current_rate = float(json["rates"][self.currency_to]["rate"])
                 self.last_update = datetime.now()
+                CURRENCY_REFRESHES.labels(outcome="success").inc()
+                self.cache.set(
+                    "exchange_rate",
+                    self._cache_key,
+                    [self.current_rate, self.last_update],
+                    ttl=RATE_TTL,
+                )
             except Exception:
                 self.logger.error("API May have changed!")
+                CURRENCY_REFRESHES.labels(outcome="unexpected_response").inc()
 
                 self.last_update = datetime.min
                 self.current_rate = -1
         else:
             self.logger.error("API Key missing / invalid!")
+            CURRENCY_REFRESHES.labels(outcome="invalid_key").inc()
 
     def get_rate(self, force_update: bool = False) -> float:
         """Get the exchange rate from currency_from to currency_to.
 
         The results from this operation will be cached for 2 hours, before being retrieved again.
+        A rate retrieved by another process sharing the cache is reused.
 
         Parameters
         ----------
@@ -102,13 +123,28 @@ class Currency:
         if (
             force_update
             or self.last_update is None
-            or (datetime.now() - self.last_update).seconds > 7200
+            or (datetime.now() - self.last_update).total_seconds() > RATE_TTL
             or self.current_rate == 0
         ):
-            self.update_cache()
+            CACHE_REQUESTS.labels(cache="currency_rate", result="miss").inc()
+            shared_rate = (
+                None
+                if force_update
+                else self.cache.get("exchange_rate", self._cache_key)
+            )
+            if shared_rate is not None:
+                self.current_rate, self.last_update = shared_rate
+            else:
+                self.update_cache()
+        else:
+            CACHE_REQUESTS.labels(cache="currency_rate", result="hit").inc()
 
         return self.current_rate
 
+    @property
+    def _cache_key(self) -> str:
+        return f"{self.currency_from}:{self.currency_to}"
+
     def convert_to(self, amount: float) -> float:
         """Perform a conversion from currency_from to currency_to.
 
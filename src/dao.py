@@ -1,19 +1,156 @@
 """Data Access Object (DAO)."""
 # pyright: ignore[reportUnreachable]
 
+import importlib.util
+import logging
 import os
+import threading
+import time
+from collections import defaultdict, deque
 from datetime import UTC, datetime
 
 from bson.objectid import ObjectId
-from pymongo import MongoClient
-
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    TEXT,
+    DeleteOne,
+    MongoClient,
+    ReturnDocument,
+    UpdateMany,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from src.cache import Cache, InMemoryCache
 from src.currency import Currency
 from src.doujin import Doujin
 from src.doujin_with_reservation import DoujinWithReservationData
+from src.journal import (
+    JOURNAL_ADD,
+    JOURNAL_ADD_USER,
+    JOURNAL_REMOVE,
+    ReservationJournal,
+)
+from src.metrics import DAO_LATENCY, PoolMetricsListener, timed_method
+from src.query_log import QueryLogListener
+from src.replica import LiveReplica
 from src.reservation import DoujinReservation, UserReservation
+from src.scrape import DoujinMetadata, canonicalize_url
+from src.search import SEARCH_WEIGHTS, search_ngrams, search_string
 from src.user import User
 from src.user_with_reservation import UserWithReservationData
 
+logger = logging.getLogger(__name__)
+
+# Only request the fields used to build each data class.
+# Notably, this skips the legacy embedded reservation arrays of documents that haven't been migrated yet.
+DOUJIN_PROJECTION = {
+    "title": 1,
+    "price_in_yen": 1,
+    "price_in_usd": 1,
+    "image_preview_url": 1,
+    "url": 1,
+    "is_r18": 1,
+    "circle_name": 1,
+    "author_names": 1,
+    "genres": 1,
+    "events": 1,
+    "last_updated": 1,
+}
+USER_PROJECTION = {
+    "guild_id": 1,
+    "discord_id": 1,
+    "name": 1,
+    "last_updated": 1,
+    "reservation_count": 1,
+    "total_yen": 1,
+    "total_usd": 1,
+}
+# Fields of a doujin copied onto its reservation counts, so that leaderboards don't need to read the doujin
+DOUJIN_STATS_FIELDS = ("title", "url", "circle_name", "events", "price_in_yen")
+RESERVATION_PROJECTION = {
+    "_id": 0,
+    "user_id": 1,
+    "doujin_id": 1,
+    "datetime_added": 1,
+}
+
+# Documents per batch for reads that can return many documents.
+# The server's default first batch only holds 101 documents, so larger results always cost an extra round trip,
+# while batches of a few thousand small documents stay far below the 16 MB reply limit.
+BULK_BATCH_SIZE = 5000
+
+# Number of seconds a purchase manifest is cached. Reservation changes invalidate it, so this only bounds how long
+# changes made outside of the DAO (e.g. !rebuild_totals, manual edits) take to show up.
+MANIFEST_CACHE_TTL = 3600
+
+# Number of seconds doujin documents are cached. Doujin are never updated once inserted, so this only bounds how long
+# manual edits to the database take to show up without invalidating the "doujin" cache namespace.
+DOUJIN_CACHE_TTL = 86400
+
+# Number of seconds the reservation writes of this process are applied to reads served by the replica, which only
+# receives them through its change stream
+RECENT_WRITE_TTL = 10
+
+# MongoClient options that can be set through environment variables, and how to parse them
+CLIENT_OPTION_ENV_VARIABLES = {
+    "MONGO_MIN_POOL_SIZE": ("minPoolSize", int),
+    "MONGO_MAX_POOL_SIZE": ("maxPoolSize", int),
+    "MONGO_MAX_IDLE_TIME_MS": ("maxIdleTimeMS", int),
+    "MONGO_WAIT_QUEUE_TIMEOUT_MS": ("waitQueueTimeoutMS", int),
+    "MONGO_CONNECT_TIMEOUT_MS": ("connectTimeoutMS", int),
+    "MONGO_SOCKET_TIMEOUT_MS": ("socketTimeoutMS", int),
+    "MONGO_SERVER_SELECTION_TIMEOUT_MS": ("serverSelectionTimeoutMS", int),
+    "MONGO_ZLIB_COMPRESSION_LEVEL": ("zlibCompressionLevel", int),
+}
+
+# Packages needed by each wire compressor, zlib is part of the standard library
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+
+def client_options_from_env() -> dict:
+    """Build the MongoClient connection pool, timeout and compression options from environment variables.
+
+    MONGO_COMPRESSORS is a comma separated list of compressors, in order of preference (e.g. "zstd,snappy,zlib").
+    Compressors whose package isn't installed are skipped.
+
+    Returns
+    -------
+    dict
+        Keyword arguments for MongoClient.
+
+    """
+    options = {}
+    for env_variable, (option, parse) in CLIENT_OPTION_ENV_VARIABLES.items():
+        value = os.getenv(env_variable)
+        if value is not None:
+            options[option] = parse(value)
+
+    compressors = []
+    for compressor in os.getenv("MONGO_COMPRESSORS", "").split(","):
+        compressor = compressor.strip()
+        if not compressor:
+            continue
+
+        if compressor not in COMPRESSOR_PACKAGES:
+            raise ValueError(f"Unknown MongoDB compressor {compressor}")
+
+        if importlib.util.find_spec(COMPRESSOR_PACKAGES[compressor]) is None:
+            logger.warning(
+                "Skipping MongoDB compressor %s, %s is not installed",
+                compressor,
+                COMPRESSOR_PACKAGES[compressor],
+            )
+            continue
+
+        compressors.append(compressor)
+
+    if compressors:
+        options["compressors"] = compressors
+
+    return options
+
 
 class DAO:
     """Data Access Object (DAO).
@@ -24,10 +161,19 @@ class DAO:
     ----------
     db : MongoDB Client
     currency : Currency API
+    cache : Cache of doujin documents, and of the id of the doujin of each URL
+    replica : In-memory replica serving reads once it is loaded, None unless enabled by create_replica
+    journal : Journal reservation writes are appended to instead of MongoDB, None unless enabled by create_journal
+    user_id_aliases : Id of the existing user that replaced each journaled user, for reads of the pending writes
+    add_user_lock : Lock serializing the creation of users in the journal
+    recent_writes : Reservation writes made to MongoDB while the replica is enabled, with when they were made
+    recent_writes_lock : Lock guarding recent_writes
 
     """
 
-    def __init__(self, connection_str: str, currency: Currency) -> None:
+    def __init__(
+        self, connection_str: str, currency: Currency, cache: Cache | None = None
+    ) -> None:
         """Initialize the Doujin DAO.
 
         Parameters
@@ -38,6 +184,10 @@ class DAO:
         currency: Currency
             Currency API
 
+        cache : Cache | None
+            Cache of doujin documents, possibly shared with other processes.
+            If None, an in-memory cache is used.
+
         """
         if not isinstance(connection_str, str):
             raise TypeError("connection_str must be a str")
@@ -45,9 +195,87 @@ class DAO:
         if not isinstance(currency, Currency):
             raise TypeError("current must be a Currency")
 
-        self.db = MongoClient(connection_str).get_database(os.getenv("MONGO_DB_NAME"))
+        self.db = MongoClient(
+            connection_str,
+            event_listeners=[QueryLogListener(), PoolMetricsListener()],
+            **client_options_from_env(),
+        ).get_database(os.getenv("MONGO_DB_NAME"))
         self.currency = currency
+        self.cache: Cache = cache if cache is not None else InMemoryCache()
+        self.replica: LiveReplica | None = None
+        self.journal: ReservationJournal | None = None
+        self.user_id_aliases: dict[ObjectId, ObjectId] = {}
+        self.add_user_lock = threading.Lock()
+        self.recent_writes: deque[tuple[float, dict]] = deque()
+        self.recent_writes_lock = threading.Lock()
+
+    def create_replica(self) -> LiveReplica:
+        """Serve reads of users, doujin and reservations from an in-memory replica, once it is loaded.
+
+        Writes still go to MongoDB, and reach the replica through its change stream. Lookups by Id, URL or Discord Id
+        that miss the replica fall back to MongoDB, so a document that was just inserted is always found.
+
+        Returns
+        -------
+        LiveReplica
+            The replica, which must be started.
+
+        """
+        self.replica = LiveReplica(
+            self.db,
+            {
+                "users": USER_PROJECTION,
+                "doujins": DOUJIN_PROJECTION,
+                "reservations": {**RESERVATION_PROJECTION, "_id": 1, "guild_id": 1},
+            },
+        )
+        return self.replica
+
+    def create_journal(self, path: str) -> ReservationJournal:
+        """Append reservation writes to a local journal instead of writing them to MongoDB.
+
+        A write is acknowledged once it is on disk, and reads include the writes that weren't replayed yet.
+        Reservations are accepted while MongoDB is slow or unavailable as long as reads are served by the replica,
+        see create_replica. The journal must be replayed by a JournalFlusher calling replay_reservations.
+
+        Parameters
+        ----------
+        path : str
+            Path of the journal, which must not be shared with another process
+
+        Returns
+        -------
+        ReservationJournal
+            The journal.
+
+        """
+        self.journal = ReservationJournal(path)
+        return self.journal
+
+    @property
+    def replica_ready(self) -> bool:
+        """Whether or not reads are served by the replica.
+
+        Returns
+        -------
+        bool
+            True if a replica is enabled and loaded.
 
+        """
+        return self.replica is not None and self.replica.ready
+
+    def ping(self) -> bool:
+        """Check whether or not the database is reachable.
+
+        Returns
+        -------
+        bool
+            Whether or not the database responded to a ping.
+
+        """
+        return self.db.command("ping").get("ok") == 1
+
+    @timed_method(DAO_LATENCY)
     def add_doujin(
         self,
         url: str,
@@ -60,7 +288,9 @@ class DAO:
         is_r18: bool,
         image_preview_url: str,
     ) -> DoujinWithReservationData:
-        """Add a doujin to the database.
+        """Add a doujin to the database, unless a doujin with the same canonical URL was already added.
+
+        The doujin is upserted on its unique URL, so concurrent calls for the same URL never create duplicates.
 
         Parameters
         ----------
@@ -86,9 +316,53 @@ class DAO:
         Returns
         -------
         Doujin
-            Doujin data class
+            Doujin data class. If the doujin was already added, the stored doujin, without its reservations.
 
         """
+        parameters = self._doujin_document(
+            url,
+            title,
+            price_in_yen,
+            circle_name,
+            author_names,
+            genres,
+            events,
+            is_r18,
+            image_preview_url,
+        )
+        url = parameters["url"]
+
+        try:
+            doujin_metadata = self.db.doujins.find_one_and_update(
+                {"url": url},
+                {"$setOnInsert": parameters},
+                projection=DOUJIN_PROJECTION,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # Lost the race against a concurrent upsert of the same URL
+            doujin_metadata = self.db.doujins.find_one({"url": url}, DOUJIN_PROJECTION)
+
+        self._cache_doujin_metadata([doujin_metadata])
+
+        return DoujinWithReservationData(
+            doujin=self._create_doujin(doujin_metadata),
+            reservations=[],
+        )
+
+    def _doujin_document(
+        self,
+        url: str,
+        title: str,
+        price_in_yen: int,
+        circle_name: str | None,
+        author_names: list[str],
+        genres: list[str],
+        events: list[str],
+        is_r18: bool,
+        image_preview_url: str,
+    ) -> dict:
         if not isinstance(url, str):
             raise TypeError(
                 f"Expected 'url' to be of type 'str', but got '{type(url).__name__}'"
@@ -125,6 +399,7 @@ class DAO:
             raise TypeError(
                 f"Expected 'image_preview_url' to be of type 'str', but got '{type(image_preview_url).__name__}'"
             )
+        url = canonicalize_url(url)
         now = datetime.now(UTC)
         price_in_usd = self.currency.convert_to(price_in_yen)
 
@@ -140,37 +415,120 @@ class DAO:
             "genres": genres,
             "events": events,
             "last_updated": now,
-            "reservations": [],
+            "search_ngrams": search_ngrams(title, circle_name, *author_names),
         }
 
-        id = self.db.doujins.insert_one(parameters).inserted_id
-        doujin = Doujin(
-            _id=id,
-            title=title,
-            price_in_yen=price_in_yen,
-            price_in_usd=price_in_usd,
-            image_preview_url=image_preview_url,
-            url=url,
-            is_r18=is_r18,
-            circle_name=circle_name,
-            author_names=author_names,
-            genres=genres,
-            events=events,
-            last_updated=now,
-        )
+        return parameters
 
-        return DoujinWithReservationData(
-            doujin=doujin,
-            reservations=[],
-        )
+    @timed_method(DAO_LATENCY)
+    def add_doujins(
+        self, all_doujin_metadata: dict[str, DoujinMetadata]
+    ) -> dict[str, ObjectId]:
+        """Add doujin to the database in bulk, skipping those whose canonical URL was already added.
+
+        Parameters
+        ----------
+        all_doujin_metadata : dict[str, DoujinMetadata]
+            Scraped metadata of each doujin, keyed by URL
+
+        Returns
+        -------
+        dict[str, ObjectId]
+            Id of each doujin, keyed by canonical URL.
+
+        """
+        documents = [
+            self._doujin_document(url, *doujin_metadata)
+            for url, doujin_metadata in all_doujin_metadata.items()
+        ]
+        if not documents:
+            return {}
+
+        operations = [
+            UpdateOne({"url": document["url"]}, {"$setOnInsert": document}, upsert=True)
+            for document in documents
+        ]
+        try:
+            self.db.doujins.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Lost the race against concurrent upserts of the same URLs, which inserted them
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+        return self.get_doujin_ids_by_urls([document["url"] for document in documents])
+
+    @timed_method(DAO_LATENCY)
+    def get_doujin_ids_by_urls(self, urls: list[str]) -> dict[str, ObjectId]:
+        """Retrieve the Id of doujin by URL, from the cache when possible.
+
+        Parameters
+        ----------
+        urls : list[str]
+            URLs of the doujin
+
+        Returns
+        -------
+        dict[str, ObjectId]
+            Id of the doujin that exist, keyed by canonical URL.
+
+        """
+        urls = list({canonicalize_url(url): None for url in urls})
+        if not urls:
+            return {}
+
+        if self.replica_ready:
+            doujin_ids = self.replica.get_doujin_ids(urls)
+        else:
+            doujin_ids = self.cache.get_many("doujin_url", urls)
+        missing_urls = [url for url in urls if url not in doujin_ids]
+        if missing_urls:
+            fetched = list(
+                self.db.doujins.find(
+                    {"url": {"$in": missing_urls}},
+                    DOUJIN_PROJECTION,
+                    batch_size=BULK_BATCH_SIZE,
+                )
+            )
+            self._cache_doujin_metadata(fetched)
+            doujin_ids.update(
+                (doujin_metadata["url"], doujin_metadata["_id"])
+                for doujin_metadata in fetched
+            )
+
+        return doujin_ids
+
+    @timed_method(DAO_LATENCY)
+    def get_doujins_by_ids(self, doujin_ids: list[ObjectId]) -> dict[ObjectId, Doujin]:
+        """Retrieve doujin by Id, without their reservations, from the cache when possible.
+
+        Parameters
+        ----------
+        doujin_ids : list[ObjectId]
+            Ids of the doujin
+
+        Returns
+        -------
+        dict[ObjectId, Doujin]
+            Doujin that exist, keyed by Id.
+
+        """
+        if not all(isinstance(doujin_id, ObjectId) for doujin_id in doujin_ids):
+            raise TypeError("doujin_ids must be a list of ObjectId")
 
-    def get_doujin_by_url(self, url: str) -> DoujinWithReservationData | None:
+        return self._get_doujins_by_ids(list(set(doujin_ids)))
+
+    @timed_method(DAO_LATENCY)
+    def get_doujin_by_url(
+        self, url: str, guild_id: int
+    ) -> DoujinWithReservationData | None:
         """Retrieve a doujin by URL.
 
         Parameters
         ----------
         url : str
             URL of the doujin.
+        guild_id : int
+            Id of the Discord server whose reservations are retrieved.
 
         Returns
         -------
@@ -183,46 +541,118 @@ class DAO:
             raise TypeError(
                 f"Expected 'url' to be of type 'str', but got '{type(url).__name__}'"
             )
-        parameters = {"url": url}
-        doujin_metadata = self.db.doujins.find_one(parameters)
+        if not isinstance(guild_id, int):
+            raise TypeError(
+                f"Expected 'guild_id' to be of type 'int', but got '{type(guild_id).__name__}'"
+            )
+        url = canonicalize_url(url)
+        doujin_metadata = None
+        if self.replica_ready:
+            doujin_id = self.replica.get_doujin_ids([url]).get(url)
+        else:
+            doujin_id = self.cache.get("doujin_url", url)
+        if doujin_id is not None:
+            doujin_metadata = self._get_doujin_metadata_by_ids([doujin_id]).get(
+                doujin_id
+            )
 
-        if doujin_metadata is not None:
-            doujin = Doujin(
-                _id=doujin_metadata["_id"],
-                title=doujin_metadata["title"],
-                price_in_yen=doujin_metadata["price_in_yen"],
-                price_in_usd=doujin_metadata["price_in_usd"],
-                image_preview_url=doujin_metadata["image_preview_url"],
-                url=doujin_metadata["url"],
-                is_r18=doujin_metadata["is_r18"],
-                circle_name=doujin_metadata["circle_name"],
-                author_names=doujin_metadata["author_names"],
-                genres=doujin_metadata["genres"],
-                events=doujin_metadata["events"],
-                last_updated=doujin_metadata["last_updated"],
-            )
-
-            reservations = []
-            for reservation in doujin_metadata["reservations"]:
-                user = self.get_user_by_id(reservation["user_id"])
-                if user is None:
-                    raise Exception(
-                        "User reserved Doujin without corresponding data being inserted in doujin collection."
-                    )
+        if doujin_metadata is None:
+            parameters = {"url": url}
+            doujin_metadata = self.db.doujins.find_one(parameters, DOUJIN_PROJECTION)
+            if doujin_metadata is not None:
+                self._cache_doujin_metadata([doujin_metadata])
 
-                else:
-                    reservation = UserReservation(
-                        user=user, datetime_added=reservation["datetime_added"]
-                    )
-                    reservations.append(reservation)
+        if doujin_metadata is not None:
+            reservations = self._get_reservations_by_doujin(
+                [doujin_metadata["_id"]], guild_id
+            )
 
             return DoujinWithReservationData(
-                doujin=doujin,
-                reservations=reservations,
+                doujin=self._create_doujin(doujin_metadata),
+                reservations=reservations[doujin_metadata["_id"]],
             )
 
         return None
 
+    @timed_method(DAO_LATENCY)
+    def search_doujin(
+        self, query: str, guild_id: int, limit: int = 10
+    ) -> list[DoujinWithReservationData]:
+        """Search doujin by title, circle, authors, genres and events, using the text index.
+
+        Parameters
+        ----------
+        query : str
+            Words to search for, any of which matches
+        guild_id : int
+            Id of the Discord server whose reservations are retrieved.
+        limit : int
+            Maximum number of doujin returned
+
+        Returns
+        -------
+        list[DoujinWithReservationData]
+            Matching doujin, best match first.
+
+        """
+        if not isinstance(query, str):
+            raise TypeError("query must be a str")
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        search = search_string(query)
+        if not search:
+            return []
+
+        score = {"$meta": "textScore"}
+        all_doujin_metadata = list(
+            self.db.doujins.find(
+                {"$text": {"$search": search}},
+                {**DOUJIN_PROJECTION, "score": score},
+            )
+            .sort([("score", score)])
+            .limit(limit)
+        )
+        for doujin_metadata in all_doujin_metadata:
+            del doujin_metadata["score"]
+        self._cache_doujin_metadata(all_doujin_metadata)
+
+        reservations = self._get_reservations_by_doujin(
+            [doujin_metadata["_id"] for doujin_metadata in all_doujin_metadata],
+            guild_id,
+        )
+
+        return [
+            DoujinWithReservationData(
+                doujin=self._create_doujin(doujin_metadata),
+                reservations=reservations[doujin_metadata["_id"]],
+            )
+            for doujin_metadata in all_doujin_metadata
+        ]
+
+    @timed_method(DAO_LATENCY)
+    def retrieve_doujin_titles(self, after_id: ObjectId | None = None) -> list[dict]:
+        """Retrieve the title and circle of doujin, oldest first.
+
+        Parameters
+        ----------
+        after_id : ObjectId | None
+            Only retrieve the doujin added after this one, i.e. with a greater Id. If None, every doujin is retrieved.
+
+        Returns
+        -------
+        list[dict]
+            Documents with the _id, title and circle_name of each doujin, sorted by Id.
+
+        """
+        parameters = {} if after_id is None else {"_id": {"$gt": after_id}}
+        return list(
+            self.db.doujins.find(
+                parameters, {"title": 1, "circle_name": 1}, batch_size=BULK_BATCH_SIZE
+            ).sort("_id", ASCENDING)
+        )
+
+    @timed_method(DAO_LATENCY)
     def get_doujin_by_id(self, doujin_id: ObjectId) -> Doujin | None:
         """Retrieve a doujin by id.
 
@@ -242,29 +672,16 @@ class DAO:
             raise TypeError(
                 f"Expected 'doujin_id' to be of type 'ObjectId', but got '{type(doujin_id).__name__}'"
             )
-        parameters = {"_id": doujin_id}
-        doujin_metadata = self.db.doujins.find_one(parameters)
+        doujin_metadata = self._get_doujin_metadata_by_ids([doujin_id]).get(doujin_id)
 
         if doujin_metadata is not None:
-            return Doujin(
-                _id=doujin_metadata["_id"],
-                title=doujin_metadata["title"],
-                price_in_yen=doujin_metadata["price_in_yen"],
-                price_in_usd=doujin_metadata["price_in_usd"],
-                image_preview_url=doujin_metadata["image_preview_url"],
-                url=doujin_metadata["url"],
-                is_r18=doujin_metadata["is_r18"],
-                circle_name=doujin_metadata["circle_name"],
-                author_names=doujin_metadata["author_names"],
-                genres=doujin_metadata["genres"],
-                events=doujin_metadata["events"],
-                last_updated=doujin_metadata["last_updated"],
-            )
+            return self._create_doujin(doujin_metadata)
 
         return None
 
+    @timed_method(DAO_LATENCY)
     def get_doujin_by_id_with_reservation_data(
-        self, doujin_id: ObjectId
+        self, doujin_id: ObjectId, guild_id: int
     ) -> DoujinWithReservationData | None:
         """Retrieve a doujin by id, but includes reservation data.
 
@@ -276,6 +693,8 @@ class DAO:
         ----------
         doujin_id : ObjectId
             Id of the doujin.
+        guild_id : int
+            Id of the Discord server whose reservations are retrieved.
 
         Returns
         -------
@@ -288,273 +707,781 @@ class DAO:
             raise TypeError(
                 f"Expected 'doujin_id' to be of type 'ObjectId', but got '{type(doujin_id).__name__}'"
             )
+        if not isinstance(guild_id, int):
+            raise TypeError(
+                f"Expected 'guild_id' to be of type 'int', but got '{type(guild_id).__name__}'"
+            )
 
-        parameters = {"_id": doujin_id}
-        doujin_metadata = self.db.doujins.find_one(parameters)
+        doujin_metadata = self._get_doujin_metadata_by_ids([doujin_id]).get(doujin_id)
 
         if doujin_metadata is not None:
-            doujin = Doujin(
-                _id=doujin_metadata["_id"],
-                title=doujin_metadata["title"],
-                price_in_yen=doujin_metadata["price_in_yen"],
-                price_in_usd=doujin_metadata["price_in_usd"],
-                image_preview_url=doujin_metadata["image_preview_url"],
-                url=doujin_metadata["url"],
-                is_r18=doujin_metadata["is_r18"],
-                circle_name=doujin_metadata["circle_name"],
-                author_names=doujin_metadata["author_names"],
-                genres=doujin_metadata["genres"],
-                events=doujin_metadata["events"],
-                last_updated=doujin_metadata["last_updated"],
-            )
-
-            reservations = []
-            for reservation in doujin_metadata["reservations"]:
-                user = self.get_user_by_id(reservation["user_id"])
-                if user is None:
-                    raise Exception(
-                        "User reserved Doujin without corresponding data being inserted in doujin collection."
-                    )
-
-                else:
-                    reservation = UserReservation(
-                        user=user, datetime_added=reservation["datetime_added"]
-                    )
-                    reservations.append(reservation)
+            reservations = self._get_reservations_by_doujin([doujin_id], guild_id)
 
             return DoujinWithReservationData(
-                doujin=doujin,
-                reservations=reservations,
+                doujin=self._create_doujin(doujin_metadata),
+                reservations=reservations[doujin_id],
             )
 
         return None
 
-    def add_user(self, discord_id: int, name: str) -> UserWithReservationData:
-        """Add a user to the database.
+    @timed_method(DAO_LATENCY)
+    def get_doujins_by_ids_with_reservation_data(
+        self, doujin_ids: list[ObjectId], guild_id: int
+    ) -> list[DoujinWithReservationData | None]:
+        """Retrieve multiple doujin by id, including reservation data.
+
+        The doujin, their reservations and the users that made them are each fetched with a single query.
 
         Parameters
         ----------
-        discord_id : int
-            Discord Id
-        name : str
-            Global name of the user.
-            If the global name is not available, the server name will be used instead.
+        doujin_ids : list[ObjectId]
+            Ids of the doujin.
+        guild_id : int
+            Id of the Discord server whose reservations are retrieved.
 
         Returns
         -------
-        User
-            User object representing the user just added to the database.
+        list[DoujinWithReservationData | None]
+            Doujin data classes, with reservation data, in the same order as doujin_ids.
+            An entry is None if a doujin with the corresponding Id was not found in the database.
 
         """
-        if not isinstance(discord_id, int):
-            raise TypeError("discord_id must be an int")
+        if not isinstance(doujin_ids, list) or not all(
+            isinstance(doujin_id, ObjectId) for doujin_id in doujin_ids
+        ):
+            raise TypeError("Expected 'doujin_ids' to be a list of 'ObjectId'")
+        if not isinstance(guild_id, int):
+            raise TypeError(
+                f"Expected 'guild_id' to be of type 'int', but got '{type(guild_id).__name__}'"
+            )
 
-        if not isinstance(name, str):
-            raise TypeError("name must be an str")
+        if not doujin_ids:
+            return []
 
-        # In the database, only need to store doujin id as reservation
-        now = datetime.now(UTC)
-        parameters = {
-            "discord_id": discord_id,
-            "name": name,
-            "reservations": [],
-            "last_updated": now,
-        }
+        doujins = self._get_doujins_by_ids(list(set(doujin_ids)))
+        reservations = self._get_reservations_by_doujin(list(doujins), guild_id)
 
-        id = self.db.users.insert_one(parameters).inserted_id
-        user = User(_id=id, discord_id=discord_id, name=name, last_updated=now)
+        return [
+            DoujinWithReservationData(
+                doujin=doujins[doujin_id],
+                reservations=reservations[doujin_id],
+            )
+            if doujin_id in doujins
+            else None
+            for doujin_id in doujin_ids
+        ]
+
+    def _create_doujin(self, doujin_metadata: dict) -> Doujin:
+        return Doujin(
+            _id=doujin_metadata["_id"],
+            title=doujin_metadata["title"],
+            price_in_yen=doujin_metadata["price_in_yen"],
+            price_in_usd=doujin_metadata["price_in_usd"],
+            image_preview_url=doujin_metadata["image_preview_url"],
+            url=doujin_metadata["url"],
+            is_r18=doujin_metadata["is_r18"],
+            circle_name=doujin_metadata["circle_name"],
+            author_names=doujin_metadata["author_names"],
+            genres=doujin_metadata["genres"],
+            events=doujin_metadata["events"],
+            last_updated=doujin_metadata["last_updated"],
+        )
 
-        return UserWithReservationData(user=user, reservations=[])
+    def _create_user(self, user_metadata: dict) -> User:
+        return User(
+            _id=user_metadata["_id"],
+            discord_id=user_metadata["discord_id"],
+            name=user_metadata["name"],
+            last_updated=user_metadata["last_updated"],
+            reservation_count=user_metadata.get("reservation_count", 0),
+            total_yen=user_metadata.get("total_yen", 0),
+            total_usd=user_metadata.get("total_usd", 0.0),
+            guild_id=user_metadata.get("guild_id"),
+        )
 
-    def get_user_by_discord_id(
-        self,
-        discord_id: int,
-    ) -> UserWithReservationData | None:
-        """Get a user from the database by Discord Id.
+    def _get_doujins_by_ids(self, doujin_ids: list[ObjectId]) -> dict[ObjectId, Doujin]:
+        return {
+            doujin_id: self._create_doujin(doujin_metadata)
+            for doujin_id, doujin_metadata in self._get_doujin_metadata_by_ids(
+                doujin_ids
+            ).items()
+        }
+
+    def _get_doujin_metadata_by_ids(
+        self, doujin_ids: list[ObjectId]
+    ) -> dict[ObjectId, dict]:
+        """Retrieve doujin documents, from the cache when possible.
 
         Parameters
         ----------
-        discord_id : int
-            Discord Id
+        doujin_ids : list[ObjectId]
+            Ids of the doujin
 
         Returns
         -------
-        User | None
-            The User with the Discord Id passed in.
-            If there is no user found with the given Discord Id, None will be returned.
+        dict[ObjectId, dict]
+            Documents of the doujin that exist, keyed by Id.
 
         """
-        if not isinstance(discord_id, int):
-            raise TypeError("discord_id must be an int")
+        if not doujin_ids:
+            return {}
 
-        parameters = {"discord_id": discord_id}
-        user_metadata = self.db.users.find_one(parameters)
+        if self.replica_ready:
+            all_doujin_metadata = self.replica.get_doujins(doujin_ids)
+        else:
+            cached = self.cache.get_many(
+                "doujin", [str(doujin_id) for doujin_id in doujin_ids]
+            )
+            all_doujin_metadata = {
+                doujin_metadata["_id"]: doujin_metadata
+                for doujin_metadata in cached.values()
+            }
+
+        missing_ids = [
+            doujin_id
+            for doujin_id in doujin_ids
+            if doujin_id not in all_doujin_metadata
+        ]
+        if missing_ids:
+            fetched = list(
+                self.db.doujins.find(
+                    {"_id": {"$in": missing_ids}},
+                    DOUJIN_PROJECTION,
+                    batch_size=BULK_BATCH_SIZE,
+                )
+            )
+            self._cache_doujin_metadata(fetched)
+            all_doujin_metadata.update(
+                (doujin_metadata["_id"], doujin_metadata) for doujin_metadata in fetched
+            )
 
-        if user_metadata is not None:
-            user = User(
-                _id=user_metadata["_id"],
-                discord_id=user_metadata["discord_id"],
-                name=user_metadata["name"],
-                last_updated=user_metadata["last_updated"],
-            )
-
-            reservations = []
-            for reservation_metadata in user_metadata["reservations"]:
-                doujin = self.get_doujin_by_id(reservation_metadata["doujin_id"])
-                if doujin is None:
-                    raise Exception(
-                        "Doujin was reserved without corresponding data being inserted in doujin collection."
-                    )
-                else:
-                    reservation = DoujinReservation(
-                        doujin=doujin,
-                        datetime_added=reservation_metadata["datetime_added"],
-                    )
+        return all_doujin_metadata
 
-                    reservations.append(reservation)
+    def _cache_doujin_metadata(self, all_doujin_metadata: list[dict]) -> None:
+        self.cache.set_many(
+            "doujin",
+            {
+                str(doujin_metadata["_id"]): doujin_metadata
+                for doujin_metadata in all_doujin_metadata
+            },
+            ttl=DOUJIN_CACHE_TTL,
+        )
+        self.cache.set_many(
+            "doujin_url",
+            {
+                doujin_metadata["url"]: doujin_metadata["_id"]
+                for doujin_metadata in all_doujin_metadata
+            },
+            ttl=DOUJIN_CACHE_TTL,
+        )
 
-            return UserWithReservationData(
-                user=user,
-                reservations=reservations,
+    def _get_users_by_ids(
+        self, user_ids: list[ObjectId] | None
+    ) -> dict[ObjectId, User]:
+        if user_ids is not None and not user_ids:
+            return {}
+
+        all_user_metadata = {}
+        if user_ids is not None:
+            pending_users = self._pending_users()
+            all_user_metadata = {
+                user_id: pending_users[user_id]
+                for user_id in user_ids
+                if user_id in pending_users
+            }
+            user_ids = [
+                user_id for user_id in user_ids if user_id not in all_user_metadata
+            ]
+
+        if self.replica_ready and user_ids is not None:
+            all_user_metadata.update(self.replica.get_users(user_ids))
+            user_ids = [
+                user_id for user_id in user_ids if user_id not in all_user_metadata
+            ]
+
+        if user_ids is None or user_ids:
+            parameters = {} if user_ids is None else {"_id": {"$in": user_ids}}
+            all_user_metadata.update(
+                (user_metadata["_id"], user_metadata)
+                for user_metadata in self.db.users.find(
+                    parameters, USER_PROJECTION, batch_size=BULK_BATCH_SIZE
+                )
             )
 
-        return None
+        return {
+            user_id: self._create_user(user_metadata)
+            for user_id, user_metadata in all_user_metadata.items()
+        }
 
-    def get_user_by_id(
+    def _find_reservations(
         self,
-        _id: ObjectId,
-    ) -> User | None:
-        """Get a user from the database by  Id.
+        guild_id: int | None,
+        user_ids: list[ObjectId] | None = None,
+        doujin_ids: list[ObjectId] | None = None,
+    ) -> list[dict]:
+        """Find the reservations of a Discord server made by users or on doujin, from the replica when loaded.
 
         Parameters
         ----------
-        _id : ObjectId
-            Id
+        guild_id : int | None
+            Id of the Discord server the reservations belong to, None for data predating servers.
+        user_ids : list[ObjectId] | None
+            Only find the reservations made by these users
+        doujin_ids : list[ObjectId] | None
+            Only find the reservations made on these doujin
 
         Returns
         -------
-        User | None
-            The User with the Id passed in.
-            If there is no user found with the given  Id, None will be returned.
+        list[dict]
+            Reservation documents, oldest first, including the writes missing from the replica or MongoDB.
 
         """
-        if not isinstance(_id, ObjectId):
-            raise TypeError("discord_id must be an ObjectId")
-
-        parameters = {"_id": _id}
-        user_metadata = self.db.users.find_one(parameters)
+        if self.replica_ready:
+            all_reservation_metadata = self.replica.find_reservations(
+                guild_id, user_ids, doujin_ids
+            )
+        else:
+            parameters = {"guild_id": guild_id}
+            if user_ids is not None:
+                parameters["user_id"] = {"$in": user_ids}
+            if doujin_ids is not None:
+                parameters["doujin_id"] = {"$in": doujin_ids}
+            all_reservation_metadata = self.db.reservations.find(
+                parameters, RESERVATION_PROJECTION, batch_size=BULK_BATCH_SIZE
+            )
 
-        if user_metadata is not None:
-            return User(
-                _id=user_metadata["_id"],
-                discord_id=user_metadata["discord_id"],
-                name=user_metadata["name"],
-                last_updated=user_metadata["last_updated"],
+        unapplied_writes = self._unapplied_writes()
+        if unapplied_writes:
+            all_reservation_metadata = self._overlay_reservation_writes(
+                all_reservation_metadata,
+                unapplied_writes,
+                guild_id,
+                user_ids,
+                doujin_ids,
             )
 
-        return None
+        return sorted(
+            all_reservation_metadata,
+            key=lambda reservation_metadata: reservation_metadata["datetime_added"],
+        )
 
-    def get_user_by_id_with_reservation_data(
-        self,
-        _id: ObjectId,
-    ) -> UserWithReservationData | None:
-        """Get a user from the database by  Id.
+    def _record_writes(self, entries: list[dict]) -> None:
+        """Remember reservation writes made to MongoDB, until the replica has received them.
 
         Parameters
         ----------
-        _id : ObjectId
-            Id
-
-        Returns
-        -------
-        User | None
-            The User with the Id passed in.
-            If there is no user found with the given  Id, None will be returned.
+        entries : list[dict]
+            Writes, in the same format as the entries of the journal
 
         """
-        if not isinstance(_id, ObjectId):
-            raise TypeError("discord_id must be an ObjectId")
+        if self.replica is None:
+            return
+
+        now = time.monotonic()
+        with self.recent_writes_lock:
+            self.recent_writes.extend(
+                # The replica returns naive datetimes, like MongoDB
+                (
+                    now,
+                    {
+                        **entry,
+                        "datetime_added": entry["datetime_added"].replace(tzinfo=None),
+                    },
+                )
+                if "datetime_added" in entry
+                else (now, entry)
+                for entry in entries
+            )
+            self._expire_recent_writes()
 
-        parameters = {"_id": _id}
-        user_metadata = self.db.users.find_one(parameters)
+    def _expire_recent_writes(self) -> None:
+        # Must be called with recent_writes_lock held
+        expired = time.monotonic() - RECENT_WRITE_TTL
+        while self.recent_writes and self.recent_writes[0][0] < expired:
+            self.recent_writes.popleft()
 
-        if user_metadata is not None:
-            user = User(
-                _id=user_metadata["_id"],
-                discord_id=user_metadata["discord_id"],
-                name=user_metadata["name"],
-                last_updated=user_metadata["last_updated"],
-            )
-
-            reservations = []
-            for reservation_metadata in user_metadata["reservations"]:
-                doujin = self.get_doujin_by_id(reservation_metadata["doujin_id"])
-                if doujin is None:
-                    raise Exception(
-                        "Doujin was reserved without corresponding data being inserted in doujin collection."
-                    )
-                else:
-                    reservation = DoujinReservation(
-                        doujin=doujin,
-                        datetime_added=reservation_metadata["datetime_added"],
-                    )
+    def _unapplied_writes(self) -> list[dict]:
+        """Find the reservation writes that reads from the replica or MongoDB may not include yet.
 
-                    reservations.append(reservation)
+        These are the writes of the journal that weren't replayed yet and, while reads are served by the replica,
+        the writes this process made to MongoDB in the last RECENT_WRITE_TTL seconds, as its change stream lags.
 
-            return UserWithReservationData(
-                user=user,
-                reservations=reservations,
-            )
+        Returns
+        -------
+        list[dict]
+            Writes, oldest first, in the same format as the entries of the journal.
 
-        return None
+        """
+        entries = []
+        if self.replica_ready:
+            with self.recent_writes_lock:
+                self._expire_recent_writes()
+                entries = [entry for _, entry in self.recent_writes]
 
-    def add_reservation(
+        if self.journal is not None and self.journal.has_pending():
+            entries.extend(self.journal.pending_entries())
+
+        return entries
+
+    def _overlay_reservation_writes(
         self,
-        user_with_reservation_data: UserWithReservationData,
-        doujin_with_reservation_data: DoujinWithReservationData,
-    ) -> tuple[UserWithReservationData, DoujinWithReservationData]:
-        """Add a reservation to a user.
+        all_reservation_metadata: list[dict],
+        entries: list[dict],
+        guild_id: int | None,
+        user_ids: list[ObjectId] | None,
+        doujin_ids: list[ObjectId] | None,
+    ) -> list[dict]:
+        """Apply reservation writes to reservation documents, see _unapplied_writes.
 
         Parameters
         ----------
-        user_with_reservation_data : UserWithReservationData
-            User object, with user data
-        doujin_with_reservation_data : DoujinWithReservationData
-            Doujin object, with doujin data
+        all_reservation_metadata : list[dict]
+            Reservation documents read from the replica or MongoDB
+        entries : list[dict]
+            Writes, oldest first
+        guild_id : int | None
+            Id of the Discord server the reservations belong to
+        user_ids : list[ObjectId] | None
+            Only apply the writes of these users
+        doujin_ids : list[ObjectId] | None
+            Only apply the writes on these doujin
 
         Returns
         -------
-        tuple[UserWithReservationData, DoujinWithReservationData]
-            Updated user object (with reservations) and doujin object (with reservations).
+        list[dict]
+            Reservation documents, in no particular order.
 
         """
-        if not isinstance(user_with_reservation_data, UserWithReservationData):
-            raise TypeError(
-                "user_with_reservation_data must be a UserWithReservationData"
+        user_ids = None if user_ids is None else set(user_ids)
+        doujin_ids = None if doujin_ids is None else set(doujin_ids)
+
+        reservations = {
+            (
+                reservation_metadata["user_id"],
+                reservation_metadata["doujin_id"],
+            ): reservation_metadata
+            for reservation_metadata in all_reservation_metadata
+        }
+        for entry in entries:
+            if entry["op"] == JOURNAL_ADD_USER or entry["guild_id"] != guild_id:
+                continue
+
+            user_id = self.user_id_aliases.get(entry["user_id"], entry["user_id"])
+            if user_ids is not None and user_id not in user_ids:
+                continue
+            if doujin_ids is not None and entry["doujin_id"] not in doujin_ids:
+                continue
+
+            key = (user_id, entry["doujin_id"])
+            if entry["op"] == JOURNAL_ADD:
+                # Same as the upsert of replay_reservations, an existing reservation is kept
+                reservations.setdefault(
+                    key,
+                    {
+                        "user_id": user_id,
+                        "doujin_id": entry["doujin_id"],
+                        "datetime_added": entry["datetime_added"],
+                    },
+                )
+            else:
+                reservations.pop(key, None)
+
+        return list(reservations.values())
+
+    def _pending_users(self, guild_id: int | None = None) -> dict[ObjectId, dict]:
+        """Find the users added to the journal that weren't replayed yet.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            Only find the users of this Discord server, every user if None
+
+        Returns
+        -------
+        dict[ObjectId, dict]
+            User documents, by Id.
+
+        """
+        if self.journal is None or not self.journal.has_pending():
+            return {}
+
+        return {
+            entry["_id"]: {
+                field: value for field, value in entry.items() if field != "op"
+            }
+            for entry in self.journal.pending_entries()
+            if entry["op"] == JOURNAL_ADD_USER
+            and (guild_id is None or entry["guild_id"] == guild_id)
+        }
+
+    def _apply_pending_totals(
+        self, user: User, reservations: list[DoujinReservation]
+    ) -> None:
+        """Recompute the reservation count and totals of a user from its reservations, if some writes are unapplied.
+
+        The totals stored on the user don't include the writes returned by _unapplied_writes.
+
+        Parameters
+        ----------
+        user : User
+            User to update
+        reservations : list[DoujinReservation]
+            Every reservation of the user, including the unapplied writes
+
+        """
+        if self._unapplied_writes():
+            self._recompute_totals(user, reservations)
+
+    def _recompute_totals(
+        self, user: User, reservations: list[DoujinReservation]
+    ) -> None:
+        user.reservation_count = len(reservations)
+        user.total_yen = sum(
+            reservation.doujin.price_in_yen for reservation in reservations
+        )
+        user.total_usd = sum(
+            reservation.doujin.price_in_usd for reservation in reservations
+        )
+
+    def _find_user(self, parameters: dict) -> dict | None:
+        """Find a user by Id, or by server and Discord Id, from the replica when loaded.
+
+        Parameters
+        ----------
+        parameters : dict
+            Either {"_id": ...} or {"guild_id": ..., "discord_id": ...}
+
+        Returns
+        -------
+        dict | None
+            User document, None if there is no such user.
+
+        """
+        for user_metadata in self._pending_users(parameters.get("guild_id")).values():
+            if all(
+                user_metadata[field] == value for field, value in parameters.items()
+            ):
+                return user_metadata
+
+        if self.replica_ready:
+            if "_id" in parameters:
+                user_metadata = self.replica.get_users([parameters["_id"]]).get(
+                    parameters["_id"]
+                )
+            else:
+                user_metadata = self.replica.find_user(
+                    parameters["guild_id"], parameters["discord_id"]
+                )
+            if user_metadata is not None:
+                return user_metadata
+
+            if self.journal is not None:
+                # Keeps working while MongoDB is unavailable. A user the replica didn't receive yet is added again
+                # to the journal, and replay_reservations keeps the existing user.
+                return None
+
+        return self.db.users.find_one(parameters, USER_PROJECTION)
+
+    def _get_reservations_by_user(
+        self, user_ids: list[ObjectId] | None, guild_id: int | None
+    ) -> defaultdict[ObjectId, list[DoujinReservation]]:
+        """Retrieve the reservations made by users, along with the reserved doujin.
+
+        Parameters
+        ----------
+        user_ids : list[ObjectId] | None
+            Ids of the users. If None, the reservations of every user of the server are retrieved.
+        guild_id : int | None
+            Id of the Discord server the reservations belong to, None for data predating servers.
+
+        Returns
+        -------
+        defaultdict[ObjectId, list[DoujinReservation]]
+            Reservations of each user, oldest first.
+
+        """
+        all_reservation_metadata = self._find_reservations(guild_id, user_ids=user_ids)
+
+        doujins = self._get_doujins_by_ids(
+            list({metadata["doujin_id"] for metadata in all_reservation_metadata})
+        )
+
+        reservations = defaultdict(list)
+        for reservation_metadata in all_reservation_metadata:
+            doujin = doujins.get(reservation_metadata["doujin_id"])
+            if doujin is None:
+                raise Exception(
+                    "Doujin was reserved without corresponding data being inserted in doujin collection."
+                )
+
+            reservations[reservation_metadata["user_id"]].append(
+                DoujinReservation(
+                    doujin=doujin,
+                    datetime_added=reservation_metadata["datetime_added"],
+                )
             )
 
-        if not isinstance(doujin_with_reservation_data, DoujinWithReservationData):
-            raise TypeError(
-                "doujin_with_reservation_data must be a DoujinWithReservationData"
+        return reservations
+
+    def _get_reservations_by_doujin(
+        self, doujin_ids: list[ObjectId] | None, guild_id: int | None
+    ) -> defaultdict[ObjectId, list[UserReservation]]:
+        """Retrieve the reservations made on doujin, along with the users that made them.
+
+        Parameters
+        ----------
+        doujin_ids : list[ObjectId] | None
+            Ids of the doujin. If None, the reservations of every doujin reserved in the server are retrieved.
+        guild_id : int | None
+            Id of the Discord server the reservations belong to, None for data predating servers.
+
+        Returns
+        -------
+        defaultdict[ObjectId, list[UserReservation]]
+            Reservations of each doujin, oldest first.
+
+        """
+        all_reservation_metadata = self._find_reservations(
+            guild_id, doujin_ids=doujin_ids
+        )
+
+        users = self._get_users_by_ids(
+            list({metadata["user_id"] for metadata in all_reservation_metadata})
+        )
+
+        reservations = defaultdict(list)
+        for reservation_metadata in all_reservation_metadata:
+            user = users.get(reservation_metadata["user_id"])
+            if user is None:
+                raise Exception(
+                    "User reserved Doujin without corresponding data being inserted in doujin collection."
+                )
+
+            reservations[reservation_metadata["doujin_id"]].append(
+                UserReservation(
+                    user=user, datetime_added=reservation_metadata["datetime_added"]
+                )
             )
 
+        return reservations
+
+    @timed_method(DAO_LATENCY)
+    def add_user(
+        self, discord_id: int, name: str, guild_id: int
+    ) -> UserWithReservationData:
+        """Add a user to the database, unless the user was already added.
+
+        Users are scoped to a Discord server, the same Discord user has a separate document in every server.
+        The user is upserted on its server and Discord Id, so concurrent commands of a new user never fail.
+
+        Parameters
+        ----------
+        discord_id : int
+            Discord Id
+        name : str
+            Global name of the user.
+            If the global name is not available, the server name will be used instead.
+        guild_id : int
+            Id of the Discord server the user reserves doujin in.
+
+        Returns
+        -------
+        User
+            User object representing the user just added to the database.
+            If the user was already added, the stored user, with its reservations.
+
+        """
+        if not isinstance(discord_id, int):
+            raise TypeError("discord_id must be an int")
+
+        if not isinstance(name, str):
+            raise TypeError("name must be an str")
+
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
         now = datetime.now(UTC)
+        parameters = {
+            "guild_id": guild_id,
+            "discord_id": discord_id,
+            "name": name,
+            "last_updated": now,
+            "reservation_count": 0,
+            "total_yen": 0,
+            "total_usd": 0.0,
+        }
 
-        updated_doujin = self._add_user_reservation(
-            user_with_reservation_data, doujin_with_reservation_data, now
-        )
-        updated_user = self._add_doujin_reservation(
-            user_with_reservation_data, doujin_with_reservation_data, now
+        id = ObjectId()
+        if self.journal is not None:
+            with self.add_user_lock:
+                added = (
+                    self._find_user({"guild_id": guild_id, "discord_id": discord_id})
+                    is None
+                )
+                if added:
+                    # Written to MongoDB by replay_reservations, which may replace the Id with the one of an
+                    # existing user
+                    self.journal.append(
+                        [{"op": JOURNAL_ADD_USER, "_id": id, **parameters}]
+                    )
+        else:
+            try:
+                user_metadata = self.db.users.find_one_and_update(
+                    {"guild_id": guild_id, "discord_id": discord_id},
+                    {"$setOnInsert": {"_id": id, **parameters}},
+                    projection={"_id": 1},
+                    upsert=True,
+                    return_document=ReturnDocument.AFTER,
+                )
+                added = user_metadata["_id"] == id
+            except DuplicateKeyError:
+                # Lost the race against a concurrent upsert of the same user
+                added = False
+
+        if not added:
+            return self.get_user_by_discord_id(discord_id, guild_id)
+
+        user = User(
+            _id=id,
+            discord_id=discord_id,
+            name=name,
+            last_updated=now,
+            guild_id=guild_id,
         )
 
-        return updated_user, updated_doujin
+        return UserWithReservationData(user=user, reservations=[])
+
+    @timed_method(DAO_LATENCY)
+    def get_user_by_discord_id(
+        self,
+        discord_id: int,
+        guild_id: int,
+    ) -> UserWithReservationData | None:
+        """Get a user from the database by Discord Id.
+
+        Parameters
+        ----------
+        discord_id : int
+            Discord Id
+        guild_id : int
+            Id of the Discord server the user reserves doujin in.
+
+        Returns
+        -------
+        User | None
+            The User with the Discord Id passed in.
+            If there is no user found with the given Discord Id, None will be returned.
+
+        """
+        if not isinstance(discord_id, int):
+            raise TypeError("discord_id must be an int")
+
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        parameters = {"guild_id": guild_id, "discord_id": discord_id}
+        user_metadata = self._find_user(parameters)
+
+        if user_metadata is not None:
+            reservations = self._get_reservations_by_user(
+                [user_metadata["_id"]], guild_id
+            )
+            user = self._create_user(user_metadata)
+            self._apply_pending_totals(user, reservations[user._id])
+
+            return UserWithReservationData(
+                user=user, reservations=reservations[user._id]
+            )
+
+        return None
+
+    @timed_method(DAO_LATENCY)
+    def get_user_by_id(
+        self,
+        _id: ObjectId,
+    ) -> User | None:
+        """Get a user from the database by  Id.
+
+        Parameters
+        ----------
+        _id : ObjectId
+            Id
+
+        Returns
+        -------
+        User | None
+            The User with the Id passed in.
+            If there is no user found with the given  Id, None will be returned.
+
+        """
+        if not isinstance(_id, ObjectId):
+            raise TypeError("discord_id must be an ObjectId")
+
+        parameters = {"_id": _id}
+        user_metadata = self._find_user(parameters)
+
+        if user_metadata is not None:
+            return self._create_user(user_metadata)
+
+        return None
+
+    @timed_method(DAO_LATENCY)
+    def get_user_by_id_with_reservation_data(
+        self,
+        _id: ObjectId,
+    ) -> UserWithReservationData | None:
+        """Get a user from the database by  Id.
+
+        Parameters
+        ----------
+        _id : ObjectId
+            Id
+
+        Returns
+        -------
+        User | None
+            The User with the Id passed in.
+            If there is no user found with the given  Id, None will be returned.
+
+        """
+        if not isinstance(_id, ObjectId):
+            raise TypeError("discord_id must be an ObjectId")
+
+        parameters = {"_id": _id}
+        user_metadata = self._find_user(parameters)
+
+        if user_metadata is not None:
+            reservations = self._get_reservations_by_user(
+                [_id], user_metadata.get("guild_id")
+            )
+            user = self._create_user(user_metadata)
+            self._apply_pending_totals(user, reservations[_id])
+
+            return UserWithReservationData(user=user, reservations=reservations[_id])
+
+        return None
 
-    def _add_doujin_reservation(
+    @timed_method(DAO_LATENCY)
+    def add_reservation(
         self,
         user_with_reservation_data: UserWithReservationData,
         doujin_with_reservation_data: DoujinWithReservationData,
-        now: datetime,
-    ) -> UserWithReservationData:
+    ) -> tuple[UserWithReservationData, DoujinWithReservationData]:
+        """Add a reservation to a user.
+
+        Parameters
+        ----------
+        user_with_reservation_data : UserWithReservationData
+            User object, with user data
+        doujin_with_reservation_data : DoujinWithReservationData
+            Doujin object, with doujin data
+
+        Returns
+        -------
+        tuple[UserWithReservationData, DoujinWithReservationData]
+            Updated user object (with reservations) and doujin object (with reservations).
+
+        """
         if not isinstance(user_with_reservation_data, UserWithReservationData):
             raise TypeError(
                 "user_with_reservation_data must be a UserWithReservationData"
@@ -565,74 +1492,226 @@ class DAO:
                 "doujin_with_reservation_data must be a DoujinWithReservationData"
             )
 
-        if not isinstance(now, datetime):
-            raise TypeError("now must be a datetime")
-
-        parameters = {"_id": user_with_reservation_data._id}
-        update = {
-            "$push": {
-                "reservations": {
-                    "doujin_id": doujin_with_reservation_data._id,
-                    "datetime_added": now,
-                }
-            },
-            "$set": {"last_updated": now},
+        now = datetime.now(UTC)
+        parameters = {
+            "guild_id": user_with_reservation_data.guild_id,
+            "user_id": user_with_reservation_data._id,
+            "doujin_id": doujin_with_reservation_data._id,
+            "datetime_added": now,
         }
 
-        result = self.db.users.update_one(parameters, update)
-        if result.modified_count == 1:
-            user_with_reservation_data.user.last_updated = now
-            user_with_reservation_data.reservations.append(
-                DoujinReservation(
-                    doujin=doujin_with_reservation_data.doujin, datetime_added=now
-                )
+        if self.journal is not None:
+            # Written to MongoDB by replay_reservations
+            self.journal.append(
+                [
+                    {
+                        "op": JOURNAL_ADD,
+                        "discord_id": user_with_reservation_data.discord_id,
+                        **parameters,
+                    }
+                ]
+            )
+            self._adjust_user_totals(
+                user_with_reservation_data, doujin_with_reservation_data, 1
             )
-            return user_with_reservation_data
         else:
-            raise Exception("Database failed to update user's reservations")
+            try:
+                self.db.reservations.insert_one(parameters)
+            except DuplicateKeyError:
+                raise Exception("User has already reserved this doujin")
+            self._record_writes([{"op": JOURNAL_ADD, **parameters}])
+
+            self._update_user_totals(
+                user_with_reservation_data, doujin_with_reservation_data, 1
+            )
+            self._update_doujin_stats(
+                user_with_reservation_data.guild_id,
+                [doujin_with_reservation_data.doujin],
+                1,
+            )
+            self._invalidate_manifest(user_with_reservation_data.guild_id)
+
+        user_with_reservation_data.reservations.append(
+            DoujinReservation(
+                doujin=doujin_with_reservation_data.doujin, datetime_added=now
+            )
+        )
+        doujin_with_reservation_data.reservations.append(
+            UserReservation(user=user_with_reservation_data.user, datetime_added=now)
+        )
+
+        return user_with_reservation_data, doujin_with_reservation_data
 
-    def _add_user_reservation(
+    @timed_method(DAO_LATENCY)
+    def add_reservations(
         self,
         user_with_reservation_data: UserWithReservationData,
-        doujin_with_reservation_data: DoujinWithReservationData,
-        now: datetime,
-    ) -> DoujinWithReservationData:
+        doujin_ids: list[ObjectId],
+    ) -> list[ObjectId]:
+        """Add reservations to a user in bulk, skipping doujin the user already reserved.
+
+        Parameters
+        ----------
+        user_with_reservation_data : UserWithReservationData
+            User object, with user data
+        doujin_ids : list[ObjectId]
+            Ids of the doujin to reserve, which must exist
+
+        Returns
+        -------
+        list[ObjectId]
+            Ids of the doujin that were reserved, i.e. not already reserved.
+
+        """
         if not isinstance(user_with_reservation_data, UserWithReservationData):
             raise TypeError(
                 "user_with_reservation_data must be a UserWithReservationData"
             )
 
-        if not isinstance(doujin_with_reservation_data, DoujinWithReservationData):
-            raise TypeError(
-                "doujin_with_reservation_data must be a DoujinWithReservationData"
-            )
-
-        if not isinstance(now, datetime):
-            raise TypeError("now must be a datetime")
+        doujins = self.get_doujins_by_ids(doujin_ids)
+        if not doujins:
+            return []
 
-        parameters = {"_id": doujin_with_reservation_data._id}
-        update = {
-            "$push": {
-                "reservations": {
+        now = datetime.now(UTC)
+        if self.journal is not None:
+            return self._journal_reservations(user_with_reservation_data, doujins, now)
+
+        reserved_ids = list(doujins)
+        operations = [
+            UpdateOne(
+                {
+                    "guild_id": user_with_reservation_data.guild_id,
                     "user_id": user_with_reservation_data._id,
+                    "doujin_id": doujin_id,
+                },
+                {"$setOnInsert": {"datetime_added": now}},
+                upsert=True,
+            )
+            for doujin_id in reserved_ids
+        ]
+        try:
+            upserted = self.db.reservations.bulk_write(
+                operations, ordered=False
+            ).upserted_ids
+        except BulkWriteError as e:
+            # A concurrent command reserved some of the doujin first
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            upserted = {
+                upsert["index"]: upsert["_id"] for upsert in e.details["upserted"]
+            }
+
+        added = [reserved_ids[index] for index in sorted(upserted)]
+        if not added:
+            return []
+        self._record_writes(
+            [
+                {
+                    "op": JOURNAL_ADD,
+                    "guild_id": user_with_reservation_data.guild_id,
+                    "user_id": user_with_reservation_data._id,
+                    "doujin_id": doujin_id,
                     "datetime_added": now,
                 }
+                for doujin_id in added
+            ]
+        )
+
+        user = user_with_reservation_data.user
+        price_in_yen = sum(doujins[doujin_id].price_in_yen for doujin_id in added)
+        price_in_usd = sum(doujins[doujin_id].price_in_usd for doujin_id in added)
+        result = self.db.users.update_one(
+            {"_id": user._id},
+            {
+                "$inc": {
+                    "reservation_count": len(added),
+                    "total_yen": price_in_yen,
+                    "total_usd": price_in_usd,
+                }
             },
-            "$set": {"last_updated": now},
+        )
+        if result.matched_count != 1:
+            raise Exception("Database failed to update user's reservation totals")
+
+        self._update_doujin_stats(
+            user_with_reservation_data.guild_id,
+            [doujins[doujin_id] for doujin_id in added],
+            1,
+        )
+        self._invalidate_manifest(user_with_reservation_data.guild_id)
+        user.reservation_count += len(added)
+        user.total_yen += price_in_yen
+        user.total_usd += price_in_usd
+        user_with_reservation_data.reservations.extend(
+            DoujinReservation(doujin=doujins[doujin_id], datetime_added=now)
+            for doujin_id in added
+        )
+
+        return added
+
+    def _journal_reservations(
+        self,
+        user_with_reservation_data: UserWithReservationData,
+        doujins: dict[ObjectId, Doujin],
+        now: datetime,
+    ) -> list[ObjectId]:
+        """Append reservations to the journal, skipping doujin the user already reserved.
+
+        Parameters
+        ----------
+        user_with_reservation_data : UserWithReservationData
+            User object, with user data
+        doujins : dict[ObjectId, Doujin]
+            Doujin to reserve, by Id
+        now : datetime
+            When the reservations were made
+
+        Returns
+        -------
+        list[ObjectId]
+            Ids of the doujin that were reserved, i.e. not already reserved.
+
+        """
+        guild_id = user_with_reservation_data.guild_id
+        reserved = {
+            reservation_metadata["doujin_id"]
+            for reservation_metadata in self._find_reservations(
+                guild_id,
+                user_ids=[user_with_reservation_data._id],
+                doujin_ids=list(doujins),
+            )
         }
+        added = [doujin_id for doujin_id in doujins if doujin_id not in reserved]
+        if not added:
+            return []
+
+        # Written to MongoDB by replay_reservations
+        self.journal.append(
+            [
+                {
+                    "op": JOURNAL_ADD,
+                    "guild_id": guild_id,
+                    "user_id": user_with_reservation_data._id,
+                    "discord_id": user_with_reservation_data.discord_id,
+                    "doujin_id": doujin_id,
+                    "datetime_added": now,
+                }
+                for doujin_id in added
+            ]
+        )
+
+        user = user_with_reservation_data.user
+        user.reservation_count += len(added)
+        user.total_yen += sum(doujins[doujin_id].price_in_yen for doujin_id in added)
+        user.total_usd += sum(doujins[doujin_id].price_in_usd for doujin_id in added)
+        user_with_reservation_data.reservations.extend(
+            DoujinReservation(doujin=doujins[doujin_id], datetime_added=now)
+            for doujin_id in added
+        )
 
-        result = self.db.doujins.update_one(parameters, update)
-        if result.modified_count == 1:
-            doujin_with_reservation_data.doujin.last_updated = now
-            doujin_with_reservation_data.reservations.append(
-                UserReservation(
-                    user=user_with_reservation_data.user, datetime_added=now
-                )
-            )
-            return doujin_with_reservation_data
-        else:
-            raise Exception("Database failed to update user's reservations")
+        return added
 
+    @timed_method(DAO_LATENCY)
     def remove_reservation(
         self,
         user_with_reservation_data: UserWithReservationData,
@@ -663,187 +1742,1019 @@ class DAO:
                 "doujin_with_reservation_data must be a DoujinWithReservationData"
             )
 
-        now = datetime.now(UTC)
-
-        updated_user = self._remove_doujin_reservation(
-            user_with_reservation_data, doujin_with_reservation_data, now
-        )
-        updated_doujin = self._remove_user_reservation(
-            user_with_reservation_data, doujin_with_reservation_data, now
-        )
+        parameters = {
+            "guild_id": user_with_reservation_data.guild_id,
+            "user_id": user_with_reservation_data._id,
+            "doujin_id": doujin_with_reservation_data._id,
+        }
 
-        return updated_user, updated_doujin
+        if self.journal is not None:
+            # Written to MongoDB by replay_reservations
+            self.journal.append(
+                [
+                    {
+                        "op": JOURNAL_REMOVE,
+                        "discord_id": user_with_reservation_data.discord_id,
+                        **parameters,
+                    }
+                ]
+            )
+            self._adjust_user_totals(
+                user_with_reservation_data, doujin_with_reservation_data, -1
+            )
+        else:
+            result = self.db.reservations.delete_one(parameters)
+            if result.deleted_count != 1:
+                raise Exception("Database failed to update user's reservations")
+            self._record_writes([{"op": JOURNAL_REMOVE, **parameters}])
 
-    def _remove_doujin_reservation(
+            self._update_user_totals(
+                user_with_reservation_data, doujin_with_reservation_data, -1
+            )
+            self._update_doujin_stats(
+                user_with_reservation_data.guild_id,
+                [doujin_with_reservation_data.doujin],
+                -1,
+            )
+            self._invalidate_manifest(user_with_reservation_data.guild_id)
+
+        user_with_reservation_data.reservations = [
+            reservation
+            for reservation in user_with_reservation_data.reservations
+            if reservation.doujin._id != doujin_with_reservation_data._id
+        ]
+        doujin_with_reservation_data.reservations = [
+            reservation
+            for reservation in doujin_with_reservation_data.reservations
+            if reservation.user._id != user_with_reservation_data._id
+        ]
+
+        return user_with_reservation_data, doujin_with_reservation_data
+
+    def _update_user_totals(
         self,
         user_with_reservation_data: UserWithReservationData,
         doujin_with_reservation_data: DoujinWithReservationData,
-        now: datetime,
-    ) -> UserWithReservationData:
-        if not isinstance(user_with_reservation_data, UserWithReservationData):
-            raise TypeError(
-                "user_with_reservation_data must be a UserWithReservationData"
-            )
+        direction: int,
+    ) -> None:
+        """Atomically adjust the reservation count and totals stored on the user document.
 
-        if not isinstance(doujin_with_reservation_data, DoujinWithReservationData):
-            raise TypeError(
-                "doujin_with_reservation_data must be a DoujinWithReservationData"
-            )
+        Parameters
+        ----------
+        user_with_reservation_data : UserWithReservationData
+            User that added or removed a reservation
+        doujin_with_reservation_data : DoujinWithReservationData
+            Doujin that was reserved or unreserved
+        direction : int
+            1 if a reservation was added, -1 if it was removed
 
-        if not isinstance(now, datetime):
-            raise TypeError("now must be a datetime")
+        """
+        price_in_yen = direction * doujin_with_reservation_data.price_in_yen
+        price_in_usd = direction * doujin_with_reservation_data.price_in_usd
 
         parameters = {"_id": user_with_reservation_data._id}
         update = {
-            "$pull": {
-                "reservations": {
-                    "doujin_id": doujin_with_reservation_data._id,
-                }
-            },
-            "$set": {"last_updated": now},
+            "$inc": {
+                "reservation_count": direction,
+                "total_yen": price_in_yen,
+                "total_usd": price_in_usd,
+            }
         }
 
         result = self.db.users.update_one(parameters, update)
-        if result.modified_count == 1:
-            user_with_reservation_data.user.last_updated = now
-            updated_reservations = []
-            for reservation in user_with_reservation_data.reservations:
-                if reservation.doujin._id != doujin_with_reservation_data._id:
-                    updated_reservations.append(reservation)
-
-            user_with_reservation_data.reservations = updated_reservations
-            return user_with_reservation_data
-        else:
-            raise Exception("Database failed to update user's reservations")
+        if result.matched_count != 1:
+            raise Exception("Database failed to update user's reservation totals")
+
+        self._adjust_user_totals(
+            user_with_reservation_data, doujin_with_reservation_data, direction
+        )
 
-    def _remove_user_reservation(
+    def _adjust_user_totals(
         self,
         user_with_reservation_data: UserWithReservationData,
         doujin_with_reservation_data: DoujinWithReservationData,
-        now: datetime,
-    ) -> DoujinWithReservationData:
-        if not isinstance(user_with_reservation_data, UserWithReservationData):
-            raise TypeError(
-                "user_with_reservation_data must be a UserWithReservationData"
+        direction: int,
+    ) -> None:
+        user = user_with_reservation_data.user
+        user.reservation_count += direction
+        user.total_yen += direction * doujin_with_reservation_data.price_in_yen
+        user.total_usd += direction * doujin_with_reservation_data.price_in_usd
+
+    @timed_method(DAO_LATENCY)
+    def replay_reservations(self, entries: list[dict]) -> None:
+        """Write journaled reservation writes to MongoDB, with a single ordered bulk write.
+
+        Replaying the same writes again has no effect: reservations are upserted or deleted by their
+        (guild_id, user_id, doujin_id) key, and the totals of the affected users and doujin are recomputed
+        rather than incremented.
+
+        Users are upserted by (guild_id, discord_id) first. If a journaled user already exists, e.g. because it was
+        added while the replica was behind, the existing user is kept. Reservations are written to the user of their
+        (guild_id, discord_id), so they never refer to a journaled user that was replaced, even if the user was
+        replayed in an earlier batch.
+
+        Parameters
+        ----------
+        entries : list[dict]
+            Writes in the order they were made, each with an op. JOURNAL_ADD_USER writes hold a user document,
+            JOURNAL_ADD and JOURNAL_REMOVE writes a guild_id, user_id, discord_id and doujin_id, and the
+            datetime_added of added reservations.
+
+        """
+        if not entries:
+            return
+
+        user_entries = [entry for entry in entries if entry["op"] == JOURNAL_ADD_USER]
+        if user_entries:
+            self.db.users.bulk_write(
+                [
+                    UpdateOne(
+                        {
+                            "guild_id": entry["guild_id"],
+                            "discord_id": entry["discord_id"],
+                        },
+                        {
+                            "$setOnInsert": {
+                                field: value
+                                for field, value in entry.items()
+                                if field != "op"
+                            }
+                        },
+                        upsert=True,
+                    )
+                    for entry in user_entries
+                ],
+                ordered=True,
             )
 
-        if not isinstance(doujin_with_reservation_data, DoujinWithReservationData):
-            raise TypeError(
-                "doujin_with_reservation_data must be a DoujinWithReservationData"
+        # Entries journaled before reservations recorded the Discord Id of their user only have its Id
+        user_keys = {
+            (entry["guild_id"], entry["discord_id"])
+            for entry in entries
+            if "discord_id" in entry
+        }
+        user_ids = {}
+        if user_keys:
+            user_ids = {
+                (user_metadata["guild_id"], user_metadata["discord_id"]): user_metadata[
+                    "_id"
+                ]
+                for user_metadata in self.db.users.find(
+                    {
+                        "$or": [
+                            {"guild_id": guild_id, "discord_id": discord_id}
+                            for guild_id, discord_id in user_keys
+                        ]
+                    },
+                    {"_id": 1, "guild_id": 1, "discord_id": 1},
+                )
+            }
+
+        for entry in user_entries:
+            user_id = user_ids[(entry["guild_id"], entry["discord_id"])]
+            if user_id != entry["_id"]:
+                # Only used by reads, to find the journaled reservations of the user that replaced it
+                self.user_id_aliases[entry["_id"]] = user_id
+
+        entries = [
+            {
+                **entry,
+                "user_id": user_ids.get(
+                    (entry["guild_id"], entry.get("discord_id")),
+                    self.user_id_aliases.get(entry["user_id"], entry["user_id"]),
+                ),
+            }
+            for entry in entries
+            if entry["op"] != JOURNAL_ADD_USER
+        ]
+        if not entries:
+            return
+
+        operations = []
+        for entry in entries:
+            parameters = {
+                "guild_id": entry["guild_id"],
+                "user_id": entry["user_id"],
+                "doujin_id": entry["doujin_id"],
+            }
+            if entry["op"] == JOURNAL_ADD:
+                operations.append(
+                    UpdateOne(
+                        parameters,
+                        {"$setOnInsert": {"datetime_added": entry["datetime_added"]}},
+                        upsert=True,
+                    )
+                )
+            elif entry["op"] == JOURNAL_REMOVE:
+                operations.append(DeleteOne(parameters))
+            else:
+                raise ValueError(f"Unknown journal operation {entry['op']}")
+
+        # Ordered, so that a reservation removed after it was added stays removed
+        self.db.reservations.bulk_write(operations, ordered=True)
+        self._record_writes(entries)
+
+        self.rebuild_user_totals(user_ids=list({entry["user_id"] for entry in entries}))
+        self.rebuild_doujin_stats(
+            doujin_ids=list({entry["doujin_id"] for entry in entries})
+        )
+        for guild_id in {entry["guild_id"] for entry in entries}:
+            self._invalidate_manifest(guild_id)
+
+    def _update_doujin_stats(
+        self, guild_id: int | None, doujins: list[Doujin], direction: int
+    ) -> None:
+        """Atomically adjust the number of reservations of doujin in a Discord server, with a single bulk write.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            Id of the Discord server the reservations belong to
+        doujins : list[Doujin]
+            Doujin that were reserved or unreserved
+        direction : int
+            1 if reservations were added, -1 if they were removed
+
+        """
+        if not doujins:
+            return
+
+        self.db.doujin_stats.bulk_write(
+            [
+                UpdateOne(
+                    {"guild_id": guild_id, "doujin_id": doujin._id},
+                    {
+                        "$inc": {"reservation_count": direction},
+                        "$setOnInsert": {
+                            field: getattr(doujin, field)
+                            for field in DOUJIN_STATS_FIELDS
+                        },
+                    },
+                    upsert=True,
+                )
+                for doujin in doujins
+            ],
+            ordered=False,
+        )
+
+    @timed_method(DAO_LATENCY)
+    def retrieve_user_totals(self, guild_id: int) -> list[User]:
+        """Retrieve all users of a Discord server, without their reservations.
+
+        Each user carries its reservation count and totals, so this only costs a single query.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+
+        Returns
+        -------
+        list[User]
+            List of all users of the server, sorted by total price in Japanese Yen (highest first).
+
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        if self.replica_ready:
+            all_user_metadata = sorted(
+                self.replica.find_users(guild_id),
+                key=lambda user_metadata: user_metadata.get("total_yen", 0),
+                reverse=True,
             )
+        else:
+            all_user_metadata = self.db.users.find(
+                filter={"guild_id": guild_id},
+                projection=USER_PROJECTION,
+                batch_size=BULK_BATCH_SIZE,
+            ).sort("total_yen", DESCENDING)
+
+        users = [
+            self._create_user(user_metadata) for user_metadata in all_user_metadata
+        ]
+        unapplied_writes = self._unapplied_writes()
+        if not unapplied_writes:
+            return users
+
+        users.extend(
+            self._create_user(user_metadata)
+            for user_metadata in self._pending_users(guild_id).values()
+        )
+        pending_user_ids = {
+            self.user_id_aliases.get(entry["user_id"], entry["user_id"])
+            for entry in unapplied_writes
+            if entry["op"] != JOURNAL_ADD_USER and entry["guild_id"] == guild_id
+        }
+        reservations = self._get_reservations_by_user(list(pending_user_ids), guild_id)
+        for user in users:
+            if user._id in pending_user_ids:
+                self._recompute_totals(user, reservations[user._id])
 
-        if not isinstance(now, datetime):
-            raise TypeError("now must be a datetime")
+        return sorted(users, key=lambda user: user.total_yen, reverse=True)
 
-        parameters = {"_id": doujin_with_reservation_data._id}
-        update = {
-            "$pull": {
-                "reservations": {
-                    "user_id": user_with_reservation_data._id,
+    @timed_method(DAO_LATENCY)
+    def has_users_without_totals(self) -> bool:
+        """Check whether or not some users were created before reservation totals were stored on users.
+
+        Returns
+        -------
+        bool
+            Whether or not a user is missing its reservation count and totals.
+
+        """
+        parameters = {"reservation_count": {"$exists": False}}
+        return self.db.users.find_one(parameters, {"_id": 1}) is not None
+
+    @timed_method(DAO_LATENCY)
+    def rebuild_user_totals(
+        self, guild_id: int | None = None, user_ids: list[ObjectId] | None = None
+    ) -> int:
+        """Recompute the reservation count and totals of every user from the reservations collection.
+
+        Use this to repair drift, e.g. after a write failed between inserting a reservation and updating the totals.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            Only rebuild the totals of the users of this Discord server. If None, the totals of every user are rebuilt.
+        user_ids : list[ObjectId] | None
+            Only rebuild the totals of these users
+
+        Returns
+        -------
+        int
+            Number of users whose totals changed.
+
+        """
+        parameters = {} if guild_id is None else {"guild_id": guild_id}
+        user_parameters = dict(parameters)
+        if user_ids is not None:
+            parameters["user_id"] = {"$in": user_ids}
+            user_parameters["_id"] = {"$in": user_ids}
+        pipeline = [
+            {"$match": parameters},
+            {
+                "$lookup": {
+                    "from": "doujins",
+                    "localField": "doujin_id",
+                    "foreignField": "_id",
+                    "as": "doujin",
                 }
             },
-            "$set": {"last_updated": now},
+            {"$unwind": "$doujin"},
+            {
+                "$group": {
+                    "_id": "$user_id",
+                    "reservation_count": {"$sum": 1},
+                    "total_yen": {"$sum": "$doujin.price_in_yen"},
+                    "total_usd": {"$sum": "$doujin.price_in_usd"},
+                }
+            },
+        ]
+        totals = {
+            user_totals["_id"]: user_totals
+            for user_totals in self.db.reservations.aggregate(
+                pipeline, batchSize=BULK_BATCH_SIZE
+            )
         }
 
-        result = self.db.doujins.update_one(parameters, update)
-        if result.modified_count == 1:
-            doujin_with_reservation_data.doujin.last_updated = now
-            updated_reservations = []
-            for reservation in doujin_with_reservation_data.reservations:
-                if reservation.user._id != user_with_reservation_data._id:
-                    updated_reservations.append(reservation)
+        operations = []
+        projection = {"reservation_count": 1, "total_yen": 1, "total_usd": 1}
+        for user_metadata in self.db.users.find(
+            filter=user_parameters, projection=projection, batch_size=BULK_BATCH_SIZE
+        ):
+            user_totals = totals.get(user_metadata["_id"], {})
+            update = {
+                "reservation_count": user_totals.get("reservation_count", 0),
+                "total_yen": user_totals.get("total_yen", 0),
+                "total_usd": float(user_totals.get("total_usd", 0.0)),
+            }
+            if any(user_metadata.get(key) != value for key, value in update.items()):
+                operations.append(
+                    UpdateOne({"_id": user_metadata["_id"]}, {"$set": update})
+                )
+
+        if operations:
+            self.db.users.bulk_write(operations, ordered=False)
+
+        return len(operations)
+
+    def _invalidate_manifest(self, guild_id: int | None) -> None:
+        """Invalidate the cached purchase manifests of a Discord server, after its reservations changed.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            Id of the Discord server
+
+        """
+        self.cache.invalidate(f"manifest:{guild_id}")
+
+    @timed_method(DAO_LATENCY)
+    def retrieve_manifest(self, guild_id: int, event: str | None = None) -> list[dict]:
+        """Retrieve the doujin to buy for a Discord server, grouped by event and circle, with a single aggregation.
+
+        The manifest is cached until the next reservation change in the server.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        event : str | None
+            Only include the doujin listed for this event. If None, every reserved doujin is included once, under
+            the first event it is listed for.
+
+        Returns
+        -------
+        list[dict]
+            One entry per (event, circle_name), sorted by event then circle, with the number of copies to buy
+            (quantity), their total_yen and total_usd, and the doujin to buy: _id, title, url, price_in_yen,
+            price_in_usd and quantity, sorted by title.
 
-            doujin_with_reservation_data.reservations = updated_reservations
-            return doujin_with_reservation_data
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        namespace = f"manifest:{guild_id}"
+        key = "*" if event is None else event
+        manifest = self.cache.get(namespace, key)
+        if manifest is not None:
+            return manifest
+
+        pipeline = [
+            {"$match": {"guild_id": guild_id}},
+            # Copies of each doujin, before joining so each doujin is looked up once
+            {"$group": {"_id": "$doujin_id", "quantity": {"$sum": 1}}},
+            {
+                "$lookup": {
+                    "from": "doujins",
+                    "localField": "_id",
+                    "foreignField": "_id",
+                    "as": "doujin",
+                }
+            },
+            {"$unwind": "$doujin"},
+        ]
+        if event is None:
+            pipeline.append(
+                {
+                    "$addFields": {
+                        "event": {
+                            "$ifNull": [{"$arrayElemAt": ["$doujin.events", 0]}, None]
+                        }
+                    }
+                }
+            )
         else:
-            raise Exception("Database failed to update user's reservations")
+            pipeline += [
+                {"$match": {"doujin.events": event}},
+                {"$addFields": {"event": event}},
+            ]
+        pipeline += [
+            {"$sort": {"doujin.title": ASCENDING}},
+            {
+                "$group": {
+                    "_id": {"event": "$event", "circle_name": "$doujin.circle_name"},
+                    "doujins": {
+                        "$push": {
+                            "_id": "$_id",
+                            "title": "$doujin.title",
+                            "url": "$doujin.url",
+                            "price_in_yen": "$doujin.price_in_yen",
+                            "price_in_usd": "$doujin.price_in_usd",
+                            "quantity": "$quantity",
+                        }
+                    },
+                    "quantity": {"$sum": "$quantity"},
+                    "total_yen": {
+                        "$sum": {"$multiply": ["$quantity", "$doujin.price_in_yen"]}
+                    },
+                    "total_usd": {
+                        "$sum": {"$multiply": ["$quantity", "$doujin.price_in_usd"]}
+                    },
+                }
+            },
+            {"$sort": {"_id.event": ASCENDING, "_id.circle_name": ASCENDING}},
+        ]
+
+        manifest = [
+            {
+                "event": group["_id"]["event"],
+                "circle_name": group["_id"]["circle_name"],
+                "quantity": group["quantity"],
+                "total_yen": group["total_yen"],
+                "total_usd": float(group["total_usd"]),
+                "doujins": group["doujins"],
+            }
+            for group in self.db.reservations.aggregate(
+                pipeline, batchSize=BULK_BATCH_SIZE
+            )
+        ]
+        self.cache.set(namespace, key, manifest, ttl=MANIFEST_CACHE_TTL)
+
+        return manifest
+
+    @timed_method(DAO_LATENCY)
+    def retrieve_top_doujin(self, guild_id: int, limit: int = 10) -> list[dict]:
+        """Retrieve the most reserved doujin of a Discord server.
+
+        The reservation count of each doujin is kept up to date by every reservation write, so this is a single
+        query walking the (guild_id, reservation_count) index.
 
-    def retrieve_all_users(self) -> list[UserWithReservationData]:
-        """Retrieve all users present in the database.
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        limit : int
+            Maximum number of doujin returned
 
         Returns
         -------
-        list[Doujin]
-            List of all users
+        list[dict]
+            Id, reservation count, title, URL, circle, events and price of each doujin, most reserved first.
+
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        return list(
+            self.db.doujin_stats.find(
+                {"guild_id": guild_id, "reservation_count": {"$gt": 0}},
+                {"_id": 0, "guild_id": 0},
+            )
+            .sort("reservation_count", DESCENDING)
+            .limit(limit)
+        )
+
+    @timed_method(DAO_LATENCY)
+    def retrieve_top_groups(
+        self, guild_id: int, group_by: str, limit: int = 10
+    ) -> list[dict]:
+        """Retrieve the circles or events with the most reservations in a Discord server.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        group_by : str
+            "circle_name" or "events"
+        limit : int
+            Maximum number of circles or events returned
+
+        Returns
+        -------
+        list[dict]
+            Name (_id), reservation count and number of reserved doujin of each circle or event, most reserved first.
+
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        if group_by not in ("circle_name", "events"):
+            raise ValueError("group_by must be 'circle_name' or 'events'")
+
+        pipeline = [{"$match": {"guild_id": guild_id, "reservation_count": {"$gt": 0}}}]
+        if group_by == "events":
+            # A doujin counts towards each of its events
+            pipeline.append({"$unwind": "$events"})
+        pipeline += [
+            {
+                "$group": {
+                    "_id": f"${group_by}",
+                    "reservation_count": {"$sum": "$reservation_count"},
+                    "doujin_count": {"$sum": 1},
+                }
+            },
+            {"$sort": {"reservation_count": DESCENDING, "_id": ASCENDING}},
+            {"$limit": limit},
+        ]
+
+        return list(self.db.doujin_stats.aggregate(pipeline))
+
+    @timed_method(DAO_LATENCY)
+    def has_reservations_without_stats(self) -> bool:
+        """Check whether or not reservations were made before reservation counts were kept on doujin.
+
+        Returns
+        -------
+        bool
+            Whether or not there are reservations but no reservation count.
+
+        """
+        return (
+            self.db.doujin_stats.find_one({}, {"_id": 1}) is None
+            and self.db.reservations.find_one({}, {"_id": 1}) is not None
+        )
+
+    @timed_method(DAO_LATENCY)
+    def rebuild_doujin_stats(
+        self, guild_id: int | None = None, doujin_ids: list[ObjectId] | None = None
+    ) -> int:
+        """Recompute the reservation count of every doujin from the reservations collection.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            Only rebuild the counts of this Discord server. If None, the counts of every server are rebuilt.
+        doujin_ids : list[ObjectId] | None
+            Only rebuild the counts of these doujin
+
+        Returns
+        -------
+        int
+            Number of counts that changed.
 
         """
-        ret = []
-        for user_metadata in self.db.users.find(filter=None):
-            user = User(
-                _id=user_metadata["_id"],
-                discord_id=user_metadata["discord_id"],
-                name=user_metadata["name"],
-                last_updated=user_metadata["last_updated"],
+        parameters = {} if guild_id is None else {"guild_id": guild_id}
+        if doujin_ids is not None:
+            parameters["doujin_id"] = {"$in": doujin_ids}
+        pipeline = [
+            {"$match": parameters},
+            {
+                "$group": {
+                    "_id": {"guild_id": "$guild_id", "doujin_id": "$doujin_id"},
+                    "reservation_count": {"$sum": 1},
+                }
+            },
+        ]
+        counts = {
+            (count["_id"]["guild_id"], count["_id"]["doujin_id"]): count[
+                "reservation_count"
+            ]
+            for count in self.db.reservations.aggregate(
+                pipeline, batchSize=BULK_BATCH_SIZE
             )
+        }
 
-            reservations = []
-            for reservation_metadata in user_metadata["reservations"]:
-                doujin = self.get_doujin_by_id(reservation_metadata["doujin_id"])
-                if doujin is None:
-                    raise Exception(
-                        "Doujin was reserved without corresponding data being inserted in doujin collection."
-                    )
-                else:
-                    reservation = DoujinReservation(
-                        doujin=doujin,
-                        datetime_added=reservation_metadata["datetime_added"],
+        operations = []
+        for stats in self.db.doujin_stats.find(
+            parameters,
+            {"guild_id": 1, "doujin_id": 1, "reservation_count": 1},
+            batch_size=BULK_BATCH_SIZE,
+        ):
+            reservation_count = counts.pop((stats["guild_id"], stats["doujin_id"]), 0)
+            if stats["reservation_count"] != reservation_count:
+                operations.append(
+                    UpdateOne(
+                        {"_id": stats["_id"]},
+                        {"$set": {"reservation_count": reservation_count}},
                     )
+                )
 
-                    reservations.append(reservation)
+        # Doujin reserved without a count yet
+        doujins = self._get_doujins_by_ids(list({doujin_id for _, doujin_id in counts}))
+        operations += [
+            UpdateOne(
+                {"guild_id": stats_guild_id, "doujin_id": doujin_id},
+                {
+                    "$set": {"reservation_count": reservation_count},
+                    "$setOnInsert": {
+                        field: getattr(doujins[doujin_id], field)
+                        for field in DOUJIN_STATS_FIELDS
+                    },
+                },
+                upsert=True,
+            )
+            for (stats_guild_id, doujin_id), reservation_count in counts.items()
+            if doujin_id in doujins
+        ]
 
-            ret.append(
-                UserWithReservationData(
-                    user=user,
-                    reservations=reservations,
-                )
+        if operations:
+            self.db.doujin_stats.bulk_write(operations, ordered=False)
+
+        return len(operations)
+
+    @timed_method(DAO_LATENCY)
+    def retrieve_all_users(self, guild_id: int) -> list[UserWithReservationData]:
+        """Retrieve all users of a Discord server.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+
+        Returns
+        -------
+        list[Doujin]
+            List of all users of the server
+
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        if self.replica_ready:
+            all_user_metadata = self.replica.find_users(guild_id)
+        else:
+            all_user_metadata = self.db.users.find(
+                {"guild_id": guild_id}, USER_PROJECTION, batch_size=BULK_BATCH_SIZE
             )
+        users = {
+            user_metadata["_id"]: self._create_user(user_metadata)
+            for user_metadata in all_user_metadata
+        }
+        users.update(
+            (user_id, self._create_user(user_metadata))
+            for user_id, user_metadata in self._pending_users(guild_id).items()
+        )
+        reservations = self._get_reservations_by_user(None, guild_id)
+        if self._unapplied_writes():
+            for user_id, user in users.items():
+                self._recompute_totals(user, reservations[user_id])
+
+        return [
+            UserWithReservationData(user=user, reservations=reservations[user_id])
+            for user_id, user in users.items()
+        ]
 
-        return ret
+    @timed_method(DAO_LATENCY)
+    def retrieve_all_doujin(self, guild_id: int) -> list[DoujinWithReservationData]:
+        """Retrieve all doujin reserved in a Discord server.
 
-    def retrieve_all_doujin(self) -> list[DoujinWithReservationData]:
-        """Retrieve all doujin in the database.
+        Only the server's reservations are read, so the cost is proportional to the size of the server
+        rather than to the size of the database.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
 
         Returns
         -------
         list[DoujinWithReservationData]
-            List of all doujin, with reservation data
-
-        """
-        ret = []
-        for doujin_metadata in self.db.doujins.find(filter=None):
-            doujin = Doujin(
-                _id=doujin_metadata["_id"],
-                title=doujin_metadata["title"],
-                price_in_yen=doujin_metadata["price_in_yen"],
-                price_in_usd=doujin_metadata["price_in_usd"],
-                image_preview_url=doujin_metadata["image_preview_url"],
-                url=doujin_metadata["url"],
-                is_r18=doujin_metadata["is_r18"],
-                circle_name=doujin_metadata["circle_name"],
-                author_names=doujin_metadata["author_names"],
-                genres=doujin_metadata["genres"],
-                events=doujin_metadata["events"],
-                last_updated=doujin_metadata["last_updated"],
-            )
-
-            reservations = []
-            for reservation in doujin_metadata["reservations"]:
-                user = self.get_user_by_id(reservation["user_id"])
-                if user is None:
-                    raise Exception(
-                        "User reserved Doujin without corresponding data being inserted in doujin collection."
-                    )
+            List of all doujin reserved in the server, with the server's reservation data
+
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        reservations = self._get_reservations_by_doujin(None, guild_id)
+        doujins = self._get_doujins_by_ids(list(reservations))
+
+        return [
+            DoujinWithReservationData(
+                doujin=doujin, reservations=reservations[doujin_id]
+            )
+            for doujin_id, doujin in doujins.items()
+        ]
+
+    @timed_method(DAO_LATENCY)
+    def migrate_embedded_reservations(self, batch_size: int = 500) -> int:
+        """Move reservations stored in the legacy users.reservations and doujins.reservations arrays into the reservations collection.
 
-                else:
-                    reservation = UserReservation(
-                        user=user, datetime_added=reservation["datetime_added"]
+        The migration is idempotent and can run while the bot is online:
+        each document's reservations are upserted before its array is removed.
+
+        Parameters
+        ----------
+        batch_size : int
+            Number of documents to migrate per bulk write
+
+        Returns
+        -------
+        int
+            Number of reservations inserted into the reservations collection.
+
+        """
+        inserted = 0
+        for collection, reservation_key in (
+            (self.db.users, "doujin_id"),
+            (self.db.doujins, "user_id"),
+        ):
+            owner_key = "user_id" if reservation_key == "doujin_id" else "doujin_id"
+            parameters = {"reservations": {"$exists": True}}
+            projection = {"reservations": 1}
+
+            while True:
+                documents = list(
+                    collection.find(parameters, projection).limit(batch_size)
+                )
+                if not documents:
+                    break
+
+                # The owning server is unknown, see assign_legacy_guild
+                operations = [
+                    UpdateOne(
+                        {
+                            "guild_id": None,
+                            owner_key: document["_id"],
+                            reservation_key: reservation[reservation_key],
+                        },
+                        {
+                            "$setOnInsert": {
+                                "datetime_added": reservation["datetime_added"]
+                            }
+                        },
+                        upsert=True,
                     )
-                    reservations.append(reservation)
+                    for document in documents
+                    for reservation in document["reservations"]
+                ]
+                if operations:
+                    inserted += self.db.reservations.bulk_write(
+                        operations, ordered=False
+                    ).upserted_count
+
+                collection.update_many(
+                    {"_id": {"$in": [document["_id"] for document in documents]}},
+                    {"$unset": {"reservations": ""}},
+                )
 
-            ret.append(
-                DoujinWithReservationData(
-                    doujin=doujin,
-                    reservations=reservations,
+        return inserted
+
+    @timed_method(DAO_LATENCY)
+    def index_search_ngrams(self) -> int:
+        """Compute the search terms of doujin added before they were searchable.
+
+        Returns
+        -------
+        int
+            Number of doujin updated.
+
+        """
+        operations = [
+            UpdateOne(
+                {"_id": doujin["_id"]},
+                {
+                    "$set": {
+                        "search_ngrams": search_ngrams(
+                            doujin["title"],
+                            doujin.get("circle_name") or "",
+                            *doujin.get("author_names", []),
+                        )
+                    }
+                },
+            )
+            for doujin in self.db.doujins.find(
+                {"search_ngrams": {"$exists": False}},
+                {"title": 1, "circle_name": 1, "author_names": 1},
+                batch_size=BULK_BATCH_SIZE,
+            )
+        ]
+        if not operations:
+            return 0
+
+        return self.db.doujins.bulk_write(operations, ordered=False).modified_count
+
+    @timed_method(DAO_LATENCY)
+    def has_users_without_guild(self) -> bool:
+        """Check whether or not some users were created before users were scoped to a Discord server.
+
+        Returns
+        -------
+        bool
+            Whether or not a user isn't assigned to a Discord server.
+
+        """
+        parameters = {"guild_id": None}
+        return self.db.users.find_one(parameters, {"_id": 1}) is not None
+
+    @timed_method(DAO_LATENCY)
+    def assign_legacy_guild(self, guild_id: int) -> int:
+        """Assign the users and reservations created before users were scoped to a Discord server to a server.
+
+        Run this before the bot handles commands: a user created in the server in the meantime would conflict with
+        its legacy document.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server the legacy data belongs to
+
+        Returns
+        -------
+        int
+            Number of users and reservations assigned to the server.
+
+        """
+        if not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int")
+
+        parameters = {"guild_id": None}
+        update = {"$set": {"guild_id": guild_id}}
+
+        return sum(
+            collection.update_many(parameters, update).modified_count
+            for collection in (self.db.users, self.db.reservations)
+        )
+
+    @timed_method(DAO_LATENCY)
+    def merge_duplicate_doujin(self) -> int:
+        """Canonicalize the URL of every doujin, and merge doujin sharing a canonical URL into the oldest of them.
+
+        Reservations of the merged doujin are moved to the remaining doujin, and dropped if the user already reserved it.
+        Merged doujin are removed before the URL of the remaining doujin is canonicalized, so this works whether or not
+        URLs are uniquely indexed yet.
+
+        Returns
+        -------
+        int
+            Number of doujin removed or whose URL was canonicalized.
+
+        """
+        kept_by_url = {}
+        merged_ids_by_kept_id = {}
+        for doujin in (
+            self.db.doujins.find({}, {"url": 1})
+            .sort("_id", ASCENDING)
+            .batch_size(BULK_BATCH_SIZE)
+        ):
+            kept = kept_by_url.setdefault(canonicalize_url(doujin["url"]), doujin)
+            if kept is not doujin:
+                merged_ids_by_kept_id.setdefault(kept["_id"], []).append(doujin["_id"])
+
+        removed = 0
+        for kept_id, merged_ids in merged_ids_by_kept_id.items():
+            operations = [
+                UpdateOne({"_id": reservation["_id"]}, {"$set": {"doujin_id": kept_id}})
+                for reservation in self.db.reservations.find(
+                    {"doujin_id": {"$in": merged_ids}}, {"_id": 1}
                 )
+            ]
+            if operations:
+                try:
+                    self.db.reservations.bulk_write(operations, ordered=False)
+                except BulkWriteError:
+                    # The user already reserved the remaining doujin
+                    pass
+
+                self.db.reservations.delete_many({"doujin_id": {"$in": merged_ids}})
+
+            self.db.doujin_stats.delete_many({"doujin_id": {"$in": merged_ids}})
+            removed += self.db.doujins.delete_many(
+                {"_id": {"$in": merged_ids}}
+            ).deleted_count
+
+        renamed = {
+            kept["_id"]: url for url, kept in kept_by_url.items() if kept["url"] != url
+        }
+        if renamed:
+            self.db.doujins.bulk_write(
+                [
+                    UpdateOne({"_id": _id}, {"$set": {"url": url}})
+                    for _id, url in renamed.items()
+                ],
+                ordered=False,
             )
-        return ret
+            self.db.doujin_stats.bulk_write(
+                [
+                    UpdateMany({"doujin_id": _id}, {"$set": {"url": url}})
+                    for _id, url in renamed.items()
+                ],
+                ordered=False,
+            )
+
+        if removed or renamed:
+            self.cache.invalidate("doujin")
+            self.cache.invalidate("doujin_url")
+        if removed:
+            # Users who reserved several copies of a doujin were charged for each of them
+            self.rebuild_user_totals()
+            self.rebuild_doujin_stats()
+
+        return removed + len(renamed)
+
+    def create_indexes(self) -> None:
+        """Create the indexes used by the DAO, if they don't exist yet.
+
+        Every index on users and reservations is led by the guild id, so each command only reads its server's data.
+        """
+        self.db.users.create_index(
+            [("guild_id", ASCENDING), ("discord_id", ASCENDING)], unique=True
+        )
+        self.db.users.create_index([("guild_id", ASCENDING), ("total_yen", DESCENDING)])
+        self.db.reservations.create_index(
+            [("guild_id", ASCENDING), ("user_id", ASCENDING), ("doujin_id", ASCENDING)],
+            unique=True,
+        )
+        self.db.reservations.create_index(
+            [("guild_id", ASCENDING), ("doujin_id", ASCENDING), ("user_id", ASCENDING)]
+        )
+        self.db.doujin_stats.create_index(
+            [("guild_id", ASCENDING), ("doujin_id", ASCENDING)], unique=True
+        )
+        self.db.doujin_stats.create_index(
+            [("guild_id", ASCENDING), ("reservation_count", DESCENDING)]
+        )
+
+        try:
+            self.db.doujins.create_index([("url", ASCENDING)], unique=True)
+        except DuplicateKeyError:
+            # Doujin added before URLs were unique
+            logger.warning("Merging duplicate doujin before indexing their URL")
+            self.merge_duplicate_doujin()
+            self.db.doujins.create_index([("url", ASCENDING)], unique=True)
+
+        self.db.doujins.create_index(
+            [(field, TEXT) for field in SEARCH_WEIGHTS],
+            weights=SEARCH_WEIGHTS,
+            # Terms are neither stemmed nor filtered, as most of them are Japanese
+            default_language="none",
+            name="doujin_search",
+        )
+
+        # Replaced by the indexes above
+        existing_indexes = self.db.reservations.index_information()
+        for index_name in ("user_id_1_doujin_id_1", "doujin_id_1_user_id_1"):
+            if index_name in existing_indexes:
+                self.db.reservations.drop_index(index_name)
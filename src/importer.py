@@ -0,0 +1,252 @@
+"""Bulk import of reservations from a list of Melonbooks URLs or doujin IDs."""
+
+import asyncio
+import csv
+import io
+from collections.abc import Awaitable, Callable
+
+from bson.objectid import ObjectId
+
+from src.dao import DAO
+from src.scrape import DoujinMetadata, DoujinScraper, canonicalize_url
+from src.user_with_reservation import UserWithReservationData
+
+# Largest accepted file, in bytes
+IMPORT_MAX_BYTES = 1024 * 1024
+# Number of URLs or IDs resolved, inserted and reserved together
+IMPORT_BATCH_SIZE = 50
+# Number of pages scraped concurrently by an import
+IMPORT_SCRAPE_CONCURRENCY = 4
+# Number of batches a stage can get ahead of the next one
+IMPORT_QUEUE_SIZE = 2
+
+
+class ImportProgress:
+    """Progress of an import.
+
+    Attributes
+    ----------
+    total : Number of distinct URLs and IDs to import
+    resolved : Number of URLs and IDs looked up in the database
+    scraped : Number of pages scraped, for URLs that weren't in the database
+    reserved : Number of doujin reserved
+    already_reserved : Number of doujin that were already reserved
+    duplicates : Number of URLs and IDs referring to a doujin already referred to by another URL or ID of the import
+    failures : Why each URL or ID that couldn't be imported failed, keyed by URL or ID
+
+    """
+
+    def __init__(self, total: int):
+        """Initialize the progress of an import that hasn't started.
+
+        Parameters
+        ----------
+        total : int
+            Number of distinct URLs and IDs to import
+
+        """
+        self.total = total
+        self.resolved = 0
+        self.scraped = 0
+        self.reserved = 0
+        self.already_reserved = 0
+        self.duplicates = 0
+        self.failures: dict[str, str] = {}
+
+    @property
+    def done(self) -> int:
+        """Number of URLs and IDs that were imported or failed."""
+        return (
+            self.reserved + self.already_reserved + self.duplicates + len(self.failures)
+        )
+
+    def summary(self) -> str:
+        """Describe the progress of the import.
+
+        Returns
+        -------
+        str
+            One line per counter, followed by the first failures.
+
+        """
+        lines = [
+            f"Imported {self.done}/{self.total}",
+            f"Reserved: {self.reserved}, already reserved: {self.already_reserved}, scraped: {self.scraped}",
+        ]
+        if self.duplicates:
+            lines.append(f"Duplicates: {self.duplicates}")
+        if self.failures:
+            lines.append(f"Failed: {len(self.failures)}")
+            lines.extend(
+                f"- {token}: {error}"
+                for token, error in list(self.failures.items())[:10]
+            )
+
+        return "\n".join(lines)
+
+
+def parse_import_file(content: bytes) -> list[str]:
+    """Extract Melonbooks URLs and doujin IDs from a text or CSV file.
+
+    Every cell is considered, so URLs can be listed one per line or in any column of a CSV export.
+    Cells that are neither a Melonbooks URL nor a doujin ID (e.g. headers) are ignored.
+
+    Parameters
+    ----------
+    content : bytes
+        Content of the file, UTF-8 encoded
+
+    Returns
+    -------
+    list[str]
+        Canonical URLs and IDs, without duplicates, in the order they appear.
+
+    """
+    if len(content) > IMPORT_MAX_BYTES:
+        raise Exception(f"File is larger than {IMPORT_MAX_BYTES // 1024} KiB")
+
+    tokens = {}
+    for row in csv.reader(io.StringIO(content.decode("utf-8-sig"))):
+        for cell in row:
+            for token in cell.split():
+                if "melonbooks" in token:
+                    tokens[canonicalize_url(token)] = None
+                elif ObjectId.is_valid(token):
+                    tokens[token] = None
+
+    return list(tokens)
+
+
+async def import_reservations(
+    dao: DAO,
+    scraper: DoujinScraper,
+    user: UserWithReservationData,
+    tokens: list[str],
+    on_progress: Callable[[ImportProgress], Awaitable[None]],
+    batch_size: int = IMPORT_BATCH_SIZE,
+    scrape_concurrency: int = IMPORT_SCRAPE_CONCURRENCY,
+) -> ImportProgress:
+    """Reserve every doujin referred to by a list of URLs or IDs, scraping the URLs that aren't in the database.
+
+    Batches stream through three stages connected by bounded queues, so a batch is looked up while the previous
+    one is being scraped, and reserved while the next one is being scraped:
+
+    1. Resolve: look up the URLs and IDs of a batch with one query each.
+    2. Scrape: scrape the URLs that weren't found concurrently, and insert them with one bulk write.
+    3. Reserve: reserve the batch with one bulk write.
+
+    Parameters
+    ----------
+    dao : DAO
+        Database access object
+    scraper : DoujinScraper
+        Melonbooks scraper
+    user : UserWithReservationData
+        User making the reservations
+    tokens : list[str]
+        Canonical URLs and IDs, as returned by parse_import_file
+    on_progress : Callable[[ImportProgress], Awaitable[None]]
+        Coroutine called with the progress after each batch is reserved
+    batch_size : int
+        Number of URLs or IDs per batch
+    scrape_concurrency : int
+        Number of pages scraped concurrently
+
+    Returns
+    -------
+    ImportProgress
+        Final progress of the import.
+
+    """
+    progress = ImportProgress(len(tokens))
+    resolved = asyncio.Queue(IMPORT_QUEUE_SIZE)
+    scraped = asyncio.Queue(IMPORT_QUEUE_SIZE)
+    scrape_slots = asyncio.Semaphore(scrape_concurrency)
+
+    async def resolve() -> None:
+        for start in range(0, len(tokens), batch_size):
+            batch = tokens[start : start + batch_size]
+            await resolved.put(
+                await asyncio.to_thread(_resolve_batch, dao, batch, progress)
+            )
+        await resolved.put(None)
+
+    async def scrape_one(url: str) -> tuple[str, DoujinMetadata | None]:
+        async with scrape_slots:
+            try:
+                return url, await asyncio.to_thread(scraper.scrape_url, url)
+            except Exception as e:
+                progress.failures[url] = str(e)
+                return url, None
+
+    async def scrape() -> None:
+        while (batch := await resolved.get()) is not None:
+            doujin_ids, missing_urls = batch
+            pages = await asyncio.gather(*[scrape_one(url) for url in missing_urls])
+            all_doujin_metadata = {
+                url: metadata for url, metadata in pages if metadata is not None
+            }
+            progress.scraped += len(all_doujin_metadata)
+
+            if all_doujin_metadata:
+                try:
+                    added = await asyncio.to_thread(
+                        dao.add_doujins, all_doujin_metadata
+                    )
+                except Exception as e:
+                    progress.failures.update(
+                        (url, str(e)) for url in all_doujin_metadata
+                    )
+                else:
+                    doujin_ids.extend(added.values())
+            await scraped.put(doujin_ids)
+        await scraped.put(None)
+
+    seen_ids = set()
+
+    async def reserve() -> None:
+        while (doujin_ids := await scraped.get()) is not None:
+            # The same doujin can be referred to by both its URL and its ID
+            unique_ids = [
+                doujin_id
+                for doujin_id in dict.fromkeys(doujin_ids)
+                if doujin_id not in seen_ids
+            ]
+            progress.duplicates += len(doujin_ids) - len(unique_ids)
+            seen_ids.update(unique_ids)
+            doujin_ids = unique_ids
+            added = await asyncio.to_thread(dao.add_reservations, user, doujin_ids)
+            progress.reserved += len(added)
+            progress.already_reserved += len(doujin_ids) - len(added)
+            await on_progress(progress)
+
+    try:
+        async with asyncio.TaskGroup() as stages:
+            stages.create_task(resolve())
+            stages.create_task(scrape())
+            stages.create_task(reserve())
+    except ExceptionGroup as e:
+        # Report the error that stopped the pipeline, the other stages were cancelled
+        raise e.exceptions[0]
+
+    return progress
+
+
+def _resolve_batch(
+    dao: DAO, batch: list[str], progress: ImportProgress
+) -> tuple[list[ObjectId], list[str]]:
+    urls = [token for token in batch if not ObjectId.is_valid(token)]
+    ids = [ObjectId(token) for token in batch if ObjectId.is_valid(token)]
+
+    doujin_ids = dao.get_doujin_ids_by_urls(urls)
+    existing_ids = dao.get_doujins_by_ids(ids)
+    for doujin_id in ids:
+        if doujin_id not in existing_ids:
+            progress.failures[str(doujin_id)] = "unknown doujin ID"
+
+    progress.resolved += len(batch)
+    return (
+        list(doujin_ids.values())
+        + [doujin_id for doujin_id in ids if doujin_id in existing_ids],
+        [url for url in urls if url not in doujin_ids],
+    )
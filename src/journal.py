@@ -0,0 +1,283 @@
+"""Write-ahead journal of reservation writes, replayed to MongoDB in the background."""
+
+import asyncio
+import logging
+import os
+import threading
+from collections.abc import Callable
+
+from bson import json_util
+
+from src.metrics import JOURNAL_FLUSHES, JOURNAL_PENDING
+
+logger = logging.getLogger(__name__)
+
+JOURNAL_ADD = "add"
+JOURNAL_REMOVE = "remove"
+JOURNAL_ADD_USER = "add_user"
+
+# Number of seconds between two looks for journaled writes to flush
+JOURNAL_FLUSH_INTERVAL = 0.2
+# Maximum number of journaled writes replayed together
+JOURNAL_BATCH_SIZE = 500
+# Maximum number of seconds between two attempts while MongoDB is failing
+JOURNAL_MAX_BACKOFF = 30
+
+
+class ReservationJournal:
+    """Append-only file of reservation writes, one JSON document per line, each append synced to disk.
+
+    How far the journal was replayed is stored as a byte offset in a separate checkpoint file, replaced atomically.
+    The journal is truncated whenever it was entirely replayed, so it only grows while MongoDB is unavailable.
+    The writes that weren't replayed yet are also kept in memory, so that reads can include them.
+
+    Attributes
+    ----------
+    path : Path of the journal
+    checkpoint_path : Path of the file holding how many bytes of the journal were replayed
+    file : Journal, opened for appending
+    size : Size of the journal, in bytes
+    flushed_offset : Number of bytes of the journal that were replayed
+    entries : Writes that weren't replayed yet, oldest first, as read back from the journal
+    entry_ends : Offset of the end of each of these writes in the journal
+    lock : Lock serializing appends, reads and truncations
+
+    """
+
+    def __init__(self, path: str):
+        """Open a journal, creating it if it doesn't exist.
+
+        A line that was partially written when the process stopped was never acknowledged, so it is dropped.
+
+        Parameters
+        ----------
+        path : str
+            Path of the journal
+
+        """
+        self.path = path
+        self.checkpoint_path = f"{path}.checkpoint"
+        self.lock = threading.Lock()
+
+        # Kept open for appends until close() is called, so it can't be opened in a with block
+        self.file = open(path, "ab+")  # noqa: SIM115
+        self.file.seek(0)
+        content = self.file.read()
+        self.size = content.rfind(b"\n") + 1
+        if self.size != len(content):
+            logger.warning("Dropping a partially written entry at the end of %s", path)
+            self.file.truncate(self.size)
+            os.fsync(self.file.fileno())
+
+        self.flushed_offset = 0
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as checkpoint:
+                self.flushed_offset = min(int(checkpoint.read() or 0), self.size)
+
+        self.entries: list[dict] = []
+        self.entry_ends: list[int] = []
+        offset = self.flushed_offset
+        for line in content[self.flushed_offset : self.size].splitlines(keepends=True):
+            offset += len(line)
+            self.entries.append(json_util.loads(line))
+            self.entry_ends.append(offset)
+        JOURNAL_PENDING.set(len(self.entries))
+
+    @property
+    def pending(self) -> int:
+        """Number of writes that weren't replayed yet."""
+        return len(self.entries)
+
+    def append(self, entries: list[dict]) -> None:
+        """Append writes to the journal, returning once they are on disk.
+
+        Parameters
+        ----------
+        entries : list[dict]
+            Writes, see DAO.replay_reservations. Values must be encodable by bson.json_util.
+
+        """
+        lines = [f"{json_util.dumps(entry)}\n".encode() for entry in entries]
+        # Read back, so that values are the same as after a restart (e.g. datetimes are naive and in milliseconds)
+        decoded = [json_util.loads(line) for line in lines]
+        with self.lock:
+            self.file.write(b"".join(lines))
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            for line, entry in zip(lines, decoded):
+                self.size += len(line)
+                self.entries.append(entry)
+                self.entry_ends.append(self.size)
+            JOURNAL_PENDING.set(len(self.entries))
+
+    def pending_entries(self) -> list[dict]:
+        """Retrieve the writes that weren't replayed yet.
+
+        Returns
+        -------
+        list[dict]
+            Writes, oldest first. They must not be modified.
+
+        """
+        with self.lock:
+            return list(self.entries)
+
+    def has_pending(self) -> bool:
+        """Whether or not some writes weren't replayed yet.
+
+        Returns
+        -------
+        bool
+            True if the journal holds writes after the checkpoint.
+
+        """
+        return self.flushed_offset < self.size
+
+    def read_pending(self, limit: int = JOURNAL_BATCH_SIZE) -> tuple[list[dict], int]:
+        """Read the oldest writes that weren't replayed yet.
+
+        Parameters
+        ----------
+        limit : int
+            Maximum number of writes read
+
+        Returns
+        -------
+        tuple[list[dict], int]
+            Writes, oldest first, and the offset to checkpoint once they are replayed.
+
+        """
+        with self.lock:
+            entries = self.entries[:limit]
+            return entries, self.entry_ends[
+                len(entries) - 1
+            ] if entries else self.flushed_offset
+
+    def checkpoint(self, offset: int, replayed: int) -> None:
+        """Record that the writes before an offset were replayed, truncating the journal if it was entirely replayed.
+
+        Parameters
+        ----------
+        offset : int
+            Offset returned by read_pending
+        replayed : int
+            Number of writes before the offset that weren't replayed yet
+
+        """
+        with self.lock:
+            del self.entries[:replayed]
+            del self.entry_ends[:replayed]
+            if offset == self.size:
+                self.file.truncate(0)
+                os.fsync(self.file.fileno())
+                self.size = 0
+                offset = 0
+
+            temporary_path = f"{self.checkpoint_path}.tmp"
+            with open(temporary_path, "w") as checkpoint:
+                checkpoint.write(str(offset))
+                checkpoint.flush()
+                os.fsync(checkpoint.fileno())
+            os.replace(temporary_path, self.checkpoint_path)
+            self.flushed_offset = offset
+            JOURNAL_PENDING.set(len(self.entries))
+
+    def close(self) -> None:
+        """Close the journal, writes that weren't replayed are replayed once it is opened again."""
+        with self.lock:
+            self.file.close()
+
+
+class JournalFlusher:
+    """Replays the journal to MongoDB in batches, backing off while MongoDB is failing.
+
+    Attributes
+    ----------
+    journal : Journal to replay
+    replay : Function writing a batch of journaled writes to MongoDB, which must be idempotent
+    interval : Number of seconds between two looks for writes to replay
+    batch_size : Maximum number of writes replayed together
+    task : Running flusher
+
+    """
+
+    def __init__(
+        self,
+        journal: ReservationJournal,
+        replay: Callable[[list[dict]], None],
+        interval: float = JOURNAL_FLUSH_INTERVAL,
+        batch_size: int = JOURNAL_BATCH_SIZE,
+    ):
+        """Initialize the flusher, without starting it.
+
+        Parameters
+        ----------
+        journal : ReservationJournal
+            Journal to replay
+        replay : Callable[[list[dict]], None]
+            Function writing a batch of journaled writes to MongoDB, which must be idempotent since a batch is
+            replayed again if the process stops before it is checkpointed
+        interval : float
+            Number of seconds between two looks for writes to replay
+        batch_size : int
+            Maximum number of writes replayed together
+
+        """
+        self.journal = journal
+        self.replay = replay
+        self.interval = interval
+        self.batch_size = batch_size
+        self.task: asyncio.Task | None = None
+
+    def start(self) -> None:
+        """Start replaying the journal, starting with the writes left by the previous run."""
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the flusher once the journal is replayed, or right away if MongoDB is failing."""
+        if self.task is None:
+            return
+
+        self.task.cancel()
+        await asyncio.gather(self.task, return_exceptions=True)
+        self.task = None
+        try:
+            await self.flush()
+        except Exception:
+            logger.exception("Failed to replay the journal before stopping")
+
+    async def flush(self) -> int:
+        """Replay every write of the journal.
+
+        Returns
+        -------
+        int
+            Number of writes replayed.
+
+        """
+        replayed = 0
+        while self.journal.has_pending():
+            entries, offset = await asyncio.to_thread(
+                self.journal.read_pending, self.batch_size
+            )
+            await asyncio.to_thread(self.replay, entries)
+            await asyncio.to_thread(self.journal.checkpoint, offset, len(entries))
+            JOURNAL_FLUSHES.labels(outcome="done").inc()
+            replayed += len(entries)
+
+        return replayed
+
+    async def _run(self) -> None:
+        delay = self.interval
+        while True:
+            await asyncio.sleep(delay)
+            try:
+                await self.flush()
+            except Exception:
+                JOURNAL_FLUSHES.labels(outcome="failed").inc()
+                logger.exception(
+                    "Failed to replay the journal, retrying in %s seconds", delay
+                )
+                delay = min(JOURNAL_MAX_BACKOFF, delay * 2)
+            else:
+                delay = self.interval
@@ -0,0 +1,258 @@
+"""Prometheus-format metrics for the bot, served over an optional local HTTP endpoint."""
+
+import asyncio
+import functools
+import threading
+import time
+from collections.abc import Callable
+
+from aiohttp import web
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from pymongo import monitoring
+
+COMMAND_LATENCY = Histogram(
+    "comiket_command_latency_seconds",
+    "Latency of bot commands.",
+    ("command", "status"),
+)
+COMMAND_ROUND_TRIPS = Histogram(
+    "comiket_command_database_round_trips",
+    "Number of MongoDB round trips made by bot commands.",
+    ("command",),
+    buckets=(1, 2, 3, 5, 10, 20, 50, 100, 250),
+)
+DAO_LATENCY = Histogram(
+    "comiket_dao_latency_seconds",
+    "Latency of DAO method calls.",
+    ("method",),
+)
+SCRAPE_FETCH_LATENCY = Histogram(
+    "comiket_scrape_fetch_seconds",
+    "Time spent fetching Melonbooks pages.",
+)
+SCRAPE_PARSE_LATENCY = Histogram(
+    "comiket_scrape_parse_seconds",
+    "Time spent parsing Melonbooks pages.",
+)
+SCRAPE_COALESCED = Counter(
+    "comiket_scrape_coalesced_total",
+    "Scrapes that waited for a fetch of the same URL already in flight instead of fetching it again.",
+)
+SCRAPE_JOBS = Counter(
+    "comiket_scrape_jobs_total",
+    "Scrape job attempts, by outcome (done, retried or failed).",
+    ("outcome",),
+)
+SCRAPE_JOB_DURATION = Histogram(
+    "comiket_scrape_job_seconds",
+    "Time from submitting a scrape job until it is done or has failed for good.",
+    buckets=(0.5, 1, 2.5, 5, 10, 30, 60, 300, 900, 3600),
+)
+JOURNAL_PENDING = Gauge(
+    "comiket_journal_pending_entries",
+    "Reservation writes acknowledged in the local journal but not written to MongoDB yet.",
+)
+JOURNAL_FLUSHES = Counter(
+    "comiket_journal_flushes_total",
+    "Attempts to write journaled reservation writes to MongoDB, by outcome (done or failed).",
+    ("outcome",),
+)
+CURRENCY_REFRESHES = Counter(
+    "comiket_currency_refreshes_total",
+    "Outcomes of exchange rate refreshes.",
+    ("outcome",),
+)
+CACHE_REQUESTS = Counter(
+    "comiket_cache_requests_total",
+    "Cache lookups, by cache and result (hit or miss).",
+    ("cache", "result"),
+)
+EVENT_LOOP_LAG = Gauge(
+    "comiket_event_loop_lag_seconds",
+    "Delay between when a periodic event loop callback was scheduled and when it ran.",
+)
+STARTUP_PHASE_DURATION = Gauge(
+    "comiket_startup_phase_seconds",
+    "Duration of each phase of the last startup (import, login, connect, gateway).",
+    ("phase",),
+)
+MONGO_CHECKOUT_WAIT = Histogram(
+    "comiket_mongo_pool_checkout_wait_seconds",
+    "Time spent waiting to check a connection out of the MongoDB connection pool.",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5),
+)
+MONGO_CHECKOUT_FAILURES = Counter(
+    "comiket_mongo_pool_checkout_failures_total",
+    "Failed connection checkouts from the MongoDB connection pool, by reason.",
+    ("reason",),
+)
+MONGO_CONNECTIONS = Gauge(
+    "comiket_mongo_pool_connections",
+    "Connections in the MongoDB connection pool, by state (open or checked_out).",
+    ("state",),
+)
+MONGO_POOL_CLEARED = Counter(
+    "comiket_mongo_pool_cleared_total",
+    "Number of times the MongoDB connection pool was cleared, e.g. after a network error.",
+)
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """PyMongo listener that publishes connection pool usage, so pool starvation shows up in the metrics.
+
+    Attributes
+    ----------
+    checkout_started : Thread local holding when the current thread started waiting for a connection
+
+    """
+
+    def __init__(self):
+        """Initialize the listener."""
+        self.checkout_started = threading.local()
+
+    def pool_created(self, event: monitoring.PoolCreatedEvent) -> None:
+        """Handle a pool being created."""
+
+    def pool_ready(self, event: monitoring.PoolReadyEvent) -> None:
+        """Handle a pool becoming ready."""
+
+    def pool_cleared(self, event: monitoring.PoolClearedEvent) -> None:
+        """Count a pool being cleared."""
+        MONGO_POOL_CLEARED.inc()
+
+    def pool_closed(self, event: monitoring.PoolClosedEvent) -> None:
+        """Handle a pool being closed."""
+
+    def connection_created(self, event: monitoring.ConnectionCreatedEvent) -> None:
+        """Count a new connection."""
+        MONGO_CONNECTIONS.labels(state="open").inc()
+
+    def connection_ready(self, event: monitoring.ConnectionReadyEvent) -> None:
+        """Handle a connection becoming ready."""
+
+    def connection_closed(self, event: monitoring.ConnectionClosedEvent) -> None:
+        """Count a closed connection."""
+        MONGO_CONNECTIONS.labels(state="open").dec()
+
+    def connection_check_out_started(
+        self, event: monitoring.ConnectionCheckOutStartedEvent
+    ) -> None:
+        """Record when the current thread started waiting for a connection."""
+        self.checkout_started.time = time.perf_counter()
+
+    def connection_check_out_failed(
+        self, event: monitoring.ConnectionCheckOutFailedEvent
+    ) -> None:
+        """Count a failed checkout, e.g. when waitQueueTimeoutMS elapsed."""
+        MONGO_CHECKOUT_FAILURES.labels(reason=str(event.reason)).inc()
+        self._observe_wait()
+
+    def connection_checked_out(
+        self, event: monitoring.ConnectionCheckedOutEvent
+    ) -> None:
+        """Record how long the current thread waited for a connection."""
+        MONGO_CONNECTIONS.labels(state="checked_out").inc()
+        self._observe_wait()
+
+    def connection_checked_in(self, event: monitoring.ConnectionCheckedInEvent) -> None:
+        """Count a connection returned to the pool."""
+        MONGO_CONNECTIONS.labels(state="checked_out").dec()
+
+    def _observe_wait(self) -> None:
+        started = getattr(self.checkout_started, "time", None)
+        if started is not None:
+            MONGO_CHECKOUT_WAIT.observe(time.perf_counter() - started)
+            self.checkout_started.time = None
+
+
+def timed_method(histogram: Histogram) -> Callable:
+    """Observe the latency of every call to the decorated method, labelled by method name.
+
+    Parameters
+    ----------
+    histogram : Histogram
+        Histogram with a single "method" label
+
+    Returns
+    -------
+    Callable
+        Decorator
+
+    """
+
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.labels(method=func.__name__).time():
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+async def monitor_event_loop_lag(interval: float = 1) -> None:
+    """Periodically measure how late the event loop runs a scheduled wake up.
+
+    Parameters
+    ----------
+    interval : float
+        Seconds between measurements
+
+    """
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.set(max(0, time.perf_counter() - start - interval))
+
+
+async def start_metrics_server(
+    host: str, port: int, is_ready: Callable[[], bool]
+) -> web.AppRunner:
+    """Start the HTTP server exposing /metrics and /ready.
+
+    Parameters
+    ----------
+    host : str
+        Host to listen on
+    port : int
+        Port to listen on
+    is_ready : Callable[[], bool]
+        Blocking readiness check, ran in a thread on every request to /ready
+
+    Returns
+    -------
+    web.AppRunner
+        Runner of the server, use it to stop the server.
+
+    """
+
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(
+            body=generate_latest(), headers={"Content-Type": CONTENT_TYPE_LATEST}
+        )
+
+    async def ready(_: web.Request) -> web.Response:
+        try:
+            ok = await asyncio.to_thread(is_ready)
+        except Exception:
+            ok = False
+
+        return web.Response(
+            text="ok" if ok else "unavailable", status=200 if ok else 503
+        )
+
+    app = web.Application()
+    app.add_routes([web.get("/metrics", metrics), web.get("/ready", ready)])
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+
+    return runner
@@ -0,0 +1,236 @@
+"""Per-command accounting of MongoDB round trips, used to find slow commands and N+1 query patterns."""
+
+import time
+from collections import namedtuple
+from contextvars import ContextVar
+from typing import Any
+
+import bson
+from pymongo import monitoring
+
+QueryRecord = namedtuple(
+    "QueryRecord",
+    ["collection", "operation", "filter_shape", "duration_ms", "succeeded"],
+)
+
+# Filter documents of each command, as found in the command sent to MongoDB
+_FILTER_PATHS = {
+    "find": ("filter",),
+    "count": ("query",),
+    "distinct": ("query",),
+    "findAndModify": ("query",),
+    "update": ("updates", "q"),
+    "delete": ("deletes", "q"),
+    "aggregate": ("pipeline",),
+}
+
+
+def filter_shape(value: Any) -> Any:
+    """Reduce a MongoDB filter to its shape, replacing every value by the name of its type.
+
+    Parameters
+    ----------
+    value : Any
+        Filter (or any part of a filter)
+
+    Returns
+    -------
+    Any
+        The shape of the filter. e.g. {"_id": {"$in": ["ObjectId"]}}
+
+    """
+    if isinstance(value, dict):
+        return {key: filter_shape(item) for key, item in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        # Long $in lists would otherwise make the log unreadable
+        return sorted({str(filter_shape(item)) for item in value})
+
+    return type(value).__name__
+
+
+class CommandQueryLog:
+    """Collects the database operations made while a single bot command is running.
+
+    Attributes
+    ----------
+    command : Name of the bot command
+    records : Completed database operations
+    started_at : Time at which the command started (from time.perf_counter)
+    pending : Database operations that were sent but haven't completed, by request id
+    reply_bytes : Size of the replies received, only measured if a ReplySizeListener is registered
+
+    """
+
+    def __init__(self, command: str):
+        """Initialize an empty query log.
+
+        Parameters
+        ----------
+        command : str
+            Name of the bot command
+
+        """
+        self.command = command
+        self.records: list[QueryRecord] = []
+        self.started_at = time.perf_counter()
+        self.pending: dict[int, tuple[str, str, Any]] = {}
+        self.reply_bytes = 0
+
+    @property
+    def round_trips(self) -> int:
+        """Retrieve the number of database round trips made so far.
+
+        Returns
+        -------
+        int
+            Number of database round trips made so far.
+
+        """
+        return len(self.records)
+
+    @property
+    def elapsed_ms(self) -> float:
+        """Retrieve the time since the command started.
+
+        Returns
+        -------
+        float
+            Time since the command started, in milliseconds.
+
+        """
+        return (time.perf_counter() - self.started_at) * 1000
+
+    def to_record(self) -> dict:
+        """Create a structured, JSON serializable, summary of the log.
+
+        Returns
+        -------
+        dict
+            Summary of the database operations made by the command.
+
+        """
+        return {
+            "command": self.command,
+            "elapsed_ms": round(self.elapsed_ms, 3),
+            "round_trips": self.round_trips,
+            "database_ms": round(sum(record.duration_ms for record in self.records), 3),
+            "reply_bytes": self.reply_bytes,
+            "queries": [record._asdict() for record in self.records],
+        }
+
+
+current_query_log: ContextVar[CommandQueryLog | None] = ContextVar(
+    "current_query_log", default=None
+)
+
+
+class QueryLogListener(monitoring.CommandListener):
+    """PyMongo listener that records every database operation into the current command's query log."""
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        """Record that a database operation was sent.
+
+        Parameters
+        ----------
+        event : monitoring.CommandStartedEvent
+            PyMongo event
+
+        """
+        query_log = current_query_log.get()
+        if query_log is None:
+            return
+
+        command = event.command
+        collection = command.get(event.command_name)
+        shape = None
+        path = _FILTER_PATHS.get(event.command_name)
+        if path is not None:
+            value = command.get(path[0])
+            if len(path) == 2 and isinstance(value, list):
+                value = [statement.get(path[1]) for statement in value]
+            shape = filter_shape(value)
+
+        query_log.pending[event.request_id] = (
+            collection if isinstance(collection, str) else "",
+            event.command_name,
+            shape,
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        """Record that a database operation succeeded.
+
+        Parameters
+        ----------
+        event : monitoring.CommandSucceededEvent
+            PyMongo event
+
+        """
+        self._complete(event.request_id, event.duration_micros, True)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        """Record that a database operation failed.
+
+        Parameters
+        ----------
+        event : monitoring.CommandFailedEvent
+            PyMongo event
+
+        """
+        self._complete(event.request_id, event.duration_micros, False)
+
+    def _complete(self, request_id: int, duration_micros: int, succeeded: bool) -> None:
+        query_log = current_query_log.get()
+        if query_log is None or request_id not in query_log.pending:
+            return
+
+        collection, operation, shape = query_log.pending.pop(request_id)
+        query_log.records.append(
+            QueryRecord(
+                collection=collection,
+                operation=operation,
+                filter_shape=shape,
+                duration_ms=duration_micros / 1000,
+                succeeded=succeeded,
+            )
+        )
+
+
+class ReplySizeListener(monitoring.CommandListener):
+    """PyMongo listener that adds the size of every reply to the current command's query log.
+
+    Every reply is encoded again to measure it, so only register this for benchmarks.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        """Ignore sent database operations.
+
+        Parameters
+        ----------
+        event : monitoring.CommandStartedEvent
+            PyMongo event
+
+        """
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        """Measure the reply of a database operation.
+
+        Parameters
+        ----------
+        event : monitoring.CommandSucceededEvent
+            PyMongo event
+
+        """
+        query_log = current_query_log.get()
+        if query_log is not None:
+            query_log.reply_bytes += len(bson.encode(event.reply))
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        """Ignore failed database operations.
+
+        Parameters
+        ----------
+        event : monitoring.CommandFailedEvent
+            PyMongo event
+
+        """
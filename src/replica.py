@@ -0,0 +1,415 @@
+"""In-memory replica of the users, doujins and reservations collections, kept in sync by a MongoDB change stream."""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+
+from bson.objectid import ObjectId
+from pymongo.database import Database
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+# Collections that are replicated
+REPLICATED_COLLECTIONS = ("users", "doujins", "reservations")
+
+# Error codes of a resume token that can't be resumed from, the replica is then reloaded
+CHANGE_STREAM_HISTORY_LOST = 286
+INVALID_RESUME_TOKEN = 260
+
+# Number of documents per batch when loading the collections
+LOAD_BATCH_SIZE = 5000
+# Number of milliseconds the change stream waits for changes, which bounds how long stopping takes
+MAX_AWAIT_TIME_MS = 1000
+# Number of seconds before reconnecting after an error, doubled after every consecutive error
+BASE_RECONNECT_DELAY = 1
+MAX_RECONNECT_DELAY = 60
+
+
+class LiveReplica:
+    """In-memory copy of the users, doujins and reservations collections, following their change stream.
+
+    The change stream is opened before the collections are loaded, and followed from its initial resume token,
+    so no write is missed while loading. Each change replaces or deletes a whole document, so changes that were
+    already part of the loaded documents are applied again harmlessly.
+    After a connection error, the change stream is resumed from the last resume token without reloading, unless
+    the oplog no longer holds it.
+
+    Change streams need a replica set, a single node replica set is enough.
+
+    Attributes
+    ----------
+    db : Database the collections are in
+    projections : Fields kept of the documents of each collection
+    ready : Whether or not the collections are loaded, reads must go to MongoDB until they are
+    resume_token : Resume token of the last change applied
+    users : User documents, by Id
+    user_ids : Id of each user, by (guild id, Discord Id)
+    users_by_guild : Ids of the users of each guild
+    doujins : Doujin documents, by Id
+    doujin_ids : Id of each doujin, by URL
+    reservations : Reservation documents, by Id
+    reservations_by_guild : Ids of the reservations of each guild
+    reservations_by_user : Ids of the reservations of each user
+    reservations_by_doujin : Ids of the reservations of each doujin
+    lock : Lock held while the replica is read or updated
+    stopped : Event stopping the thread following the change stream
+    thread : Thread following the change stream
+
+    """
+
+    def __init__(self, db: Database, projections: dict[str, dict]):
+        """Initialize an empty replica.
+
+        Parameters
+        ----------
+        db : Database
+            Database the collections are in
+        projections : dict[str, dict]
+            Fields kept of the documents of each replicated collection, as a MongoDB inclusion projection
+
+        """
+        self.db = db
+        self.projections = {
+            collection: [field for field, included in projection.items() if included]
+            for collection, projection in projections.items()
+        }
+        self.ready = False
+        self.resume_token: dict | None = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread: threading.Thread | None = None
+        self._clear()
+
+    def start(self) -> None:
+        """Load the collections and follow their change stream, in a background thread."""
+        self.thread = threading.Thread(
+            target=self.run, name="live-replica", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self) -> None:
+        """Stop following the change stream, reads go back to MongoDB."""
+        self.ready = False
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self) -> None:
+        """Load the collections and follow their change stream until stopped, reconnecting after errors."""
+        delay = BASE_RECONNECT_DELAY
+        while not self.stopped.is_set():
+            try:
+                self._follow()
+            except OperationFailure as e:
+                if e.code in (CHANGE_STREAM_HISTORY_LOST, INVALID_RESUME_TOKEN):
+                    logger.warning(
+                        "Reloading the replica, its change stream can't be resumed: %s",
+                        e,
+                    )
+                    self.ready = False
+                    self.resume_token = None
+                    continue
+
+                logger.exception(
+                    "Replica change stream failed, retrying in %s seconds", delay
+                )
+            except PyMongoError:
+                logger.exception(
+                    "Replica change stream failed, retrying in %s seconds", delay
+                )
+            else:
+                delay = BASE_RECONNECT_DELAY
+                continue
+
+            self.stopped.wait(delay)
+            delay = min(MAX_RECONNECT_DELAY, delay * 2)
+
+    def load(self) -> int:
+        """Replace the replica with the current contents of the collections.
+
+        Returns
+        -------
+        int
+            Number of documents loaded.
+
+        """
+        documents = {
+            collection: list(
+                self.db.get_collection(collection).find(
+                    {}, self.projections[collection], batch_size=LOAD_BATCH_SIZE
+                )
+            )
+            for collection in REPLICATED_COLLECTIONS
+        }
+
+        with self.lock:
+            self._clear()
+            for collection, collection_documents in documents.items():
+                for document in collection_documents:
+                    self._put(collection, document)
+
+        return sum(
+            len(collection_documents) for collection_documents in documents.values()
+        )
+
+    def apply(self, change: dict) -> None:
+        """Apply a change stream event.
+
+        Parameters
+        ----------
+        change : dict
+            Change stream event of one of the replicated collections
+
+        """
+        collection = change.get("ns", {}).get("coll")
+        operation = change["operationType"]
+        if operation in ("drop", "rename", "dropDatabase", "invalidate"):
+            # Ends the change stream, which is then reopened and the collections reloaded
+            self.ready = False
+            self.resume_token = None
+            return
+
+        if collection not in REPLICATED_COLLECTIONS:
+            return
+
+        with self.lock:
+            self._remove(collection, change["documentKey"]["_id"])
+            # The full document is None if it was deleted by the time the update was looked up
+            document = change.get("fullDocument")
+            if operation != "delete" and document is not None:
+                self._put(
+                    collection,
+                    {
+                        field: document[field]
+                        for field in ("_id", *self.projections[collection])
+                        if field in document
+                    },
+                )
+
+    def find_user(self, guild_id: int, discord_id: int) -> dict | None:
+        """Find a user by Discord Id.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+        discord_id : int
+            Discord Id
+
+        Returns
+        -------
+        dict | None
+            User document, None if the user isn't replicated.
+
+        """
+        with self.lock:
+            return self.users.get(self.user_ids.get((guild_id, discord_id)))
+
+    def find_users(self, guild_id: int) -> list[dict]:
+        """Find the users of a Discord server.
+
+        Parameters
+        ----------
+        guild_id : int
+            Id of the Discord server
+
+        Returns
+        -------
+        list[dict]
+            User documents.
+
+        """
+        with self.lock:
+            return [
+                self.users[user_id] for user_id in self.users_by_guild.get(guild_id, ())
+            ]
+
+    def get_users(self, user_ids: list[ObjectId]) -> dict[ObjectId, dict]:
+        """Retrieve users by Id.
+
+        Parameters
+        ----------
+        user_ids : list[ObjectId]
+            Ids of the users
+
+        Returns
+        -------
+        dict[ObjectId, dict]
+            Documents of the users that are replicated, keyed by Id.
+
+        """
+        with self.lock:
+            return {
+                user_id: self.users[user_id]
+                for user_id in user_ids
+                if user_id in self.users
+            }
+
+    def get_doujins(self, doujin_ids: list[ObjectId]) -> dict[ObjectId, dict]:
+        """Retrieve doujin by Id.
+
+        Parameters
+        ----------
+        doujin_ids : list[ObjectId]
+            Ids of the doujin
+
+        Returns
+        -------
+        dict[ObjectId, dict]
+            Documents of the doujin that are replicated, keyed by Id.
+
+        """
+        with self.lock:
+            return {
+                doujin_id: self.doujins[doujin_id]
+                for doujin_id in doujin_ids
+                if doujin_id in self.doujins
+            }
+
+    def get_doujin_ids(self, urls: list[str]) -> dict[str, ObjectId]:
+        """Retrieve the Id of doujin by URL.
+
+        Parameters
+        ----------
+        urls : list[str]
+            Canonical URLs of the doujin
+
+        Returns
+        -------
+        dict[str, ObjectId]
+            Id of the doujin that are replicated, keyed by URL.
+
+        """
+        with self.lock:
+            return {url: self.doujin_ids[url] for url in urls if url in self.doujin_ids}
+
+    def find_reservations(
+        self,
+        guild_id: int | None,
+        user_ids: list[ObjectId] | None = None,
+        doujin_ids: list[ObjectId] | None = None,
+    ) -> list[dict]:
+        """Find the reservations of a Discord server, made by users or on doujin.
+
+        Parameters
+        ----------
+        guild_id : int | None
+            Id of the Discord server the reservations belong to, None for data predating servers
+        user_ids : list[ObjectId] | None
+            Only find the reservations made by these users
+        doujin_ids : list[ObjectId] | None
+            Only find the reservations made on these doujin
+
+        Returns
+        -------
+        list[dict]
+            Reservation documents.
+
+        """
+        with self.lock:
+            if user_ids is not None:
+                reservation_ids = [
+                    reservation_id
+                    for user_id in user_ids
+                    for reservation_id in self.reservations_by_user.get(user_id, ())
+                ]
+            elif doujin_ids is not None:
+                reservation_ids = [
+                    reservation_id
+                    for doujin_id in doujin_ids
+                    for reservation_id in self.reservations_by_doujin.get(doujin_id, ())
+                ]
+            else:
+                reservation_ids = list(self.reservations_by_guild.get(guild_id, ()))
+
+            reservations = [
+                self.reservations[reservation_id] for reservation_id in reservation_ids
+            ]
+
+        doujin_id_set = set(doujin_ids) if doujin_ids is not None else None
+        return [
+            reservation
+            for reservation in reservations
+            if reservation.get("guild_id") == guild_id
+            and (doujin_id_set is None or reservation["doujin_id"] in doujin_id_set)
+        ]
+
+    def _follow(self) -> None:
+        pipeline = [{"$match": {"ns.coll": {"$in": list(REPLICATED_COLLECTIONS)}}}]
+        with self.db.watch(
+            pipeline,
+            full_document="updateLookup",
+            resume_after=self.resume_token,
+            max_await_time_ms=MAX_AWAIT_TIME_MS,
+        ) as stream:
+            if not self.ready:
+                # Changes made while loading are read from the stream afterwards
+                self.resume_token = stream.resume_token
+                start = time.perf_counter()
+                loaded = self.load()
+                self.ready = True
+                logger.warning(
+                    "Loaded %d documents into the replica in %.3fs",
+                    loaded,
+                    time.perf_counter() - start,
+                )
+
+            while stream.alive and not self.stopped.is_set():
+                change = stream.try_next()
+                if change is not None:
+                    self.apply(change)
+                    if not self.ready:
+                        return
+                self.resume_token = stream.resume_token
+
+    def _clear(self) -> None:
+        self.users: dict[ObjectId, dict] = {}
+        self.user_ids: dict[tuple[int | None, int], ObjectId] = {}
+        self.users_by_guild: defaultdict[int | None, set[ObjectId]] = defaultdict(set)
+        self.doujins: dict[ObjectId, dict] = {}
+        self.doujin_ids: dict[str, ObjectId] = {}
+        self.reservations: dict[ObjectId, dict] = {}
+        self.reservations_by_guild: defaultdict[int | None, set[ObjectId]] = (
+            defaultdict(set)
+        )
+        self.reservations_by_user: defaultdict[ObjectId, set[ObjectId]] = defaultdict(
+            set
+        )
+        self.reservations_by_doujin: defaultdict[ObjectId, set[ObjectId]] = defaultdict(
+            set
+        )
+
+    def _put(self, collection: str, document: dict) -> None:
+        _id = document["_id"]
+        if collection == "users":
+            self.users[_id] = document
+            self.user_ids[(document.get("guild_id"), document["discord_id"])] = _id
+            self.users_by_guild[document.get("guild_id")].add(_id)
+        elif collection == "doujins":
+            self.doujins[_id] = document
+            self.doujin_ids[document["url"]] = _id
+        else:
+            self.reservations[_id] = document
+            self.reservations_by_guild[document.get("guild_id")].add(_id)
+            self.reservations_by_user[document["user_id"]].add(_id)
+            self.reservations_by_doujin[document["doujin_id"]].add(_id)
+
+    def _remove(self, collection: str, _id: ObjectId) -> None:
+        if collection == "users":
+            user = self.users.pop(_id, None)
+            if user is not None:
+                self.user_ids.pop((user.get("guild_id"), user["discord_id"]), None)
+                self.users_by_guild[user.get("guild_id")].discard(_id)
+        elif collection == "doujins":
+            doujin = self.doujins.pop(_id, None)
+            if doujin is not None:
+                self.doujin_ids.pop(doujin["url"], None)
+        else:
+            reservation = self.reservations.pop(_id, None)
+            if reservation is not None:
+                self.reservations_by_guild[reservation.get("guild_id")].discard(_id)
+                self.reservations_by_user[reservation["user_id"]].discard(_id)
+                self.reservations_by_doujin[reservation["doujin_id"]].discard(_id)
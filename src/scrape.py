@@ -1,14 +1,71 @@
 """Melonbooks scraper to get images and relevant information."""
 
+import os
+import threading
 from collections import namedtuple
+from concurrent.futures import Future
+from urllib.parse import parse_qs, urlencode, urlsplit, urlunsplit
 
-from bs4 import BeautifulSoup
-from bs4.element import Tag
 from requests import Session
 from requests.adapters import HTTPAdapter
 from urllib3 import PoolManager
 from urllib3.util import create_urllib3_context
 
+from src.cache import Cache, InMemoryCache
+from src.metrics import SCRAPE_COALESCED, SCRAPE_FETCH_LATENCY, SCRAPE_PARSE_LATENCY
+
+# Melonbooks URL, overridable to point the scraper and crawler at a mirror or a local fixture server
+MELONBOOKS_BASE_URL = os.getenv("MELONBOOKS_BASE_URL", "https://www.melonbooks.co.jp")
+
+# Host of Melonbooks, as stored in canonical URLs
+MELONBOOKS_HOST = "melonbooks.co.jp"
+
+# Number of seconds a scraped page is reused, so the same URL is fetched at most once per day by all processes
+SCRAPE_CACHE_TTL = 86400
+
+
+def canonicalize_url(url: str) -> str:
+    """Reduce a Melonbooks URL to the form doujin and scrape jobs are stored under.
+
+    The host is lowercased, a leading "www." dropped, and the fragment dropped. Melonbooks URLs always use https.
+    Product pages only keep their product_id, so that e.g. "http://melonbooks.co.jp/...detail.php?product_id=1"
+    and "https://www.melonbooks.co.jp/...detail.php?product_id=1&adult_view=1" refer to the same doujin.
+
+    Parameters
+    ----------
+    url : str
+        Melonbooks URL
+
+    Returns
+    -------
+    str
+        Canonical URL
+
+    """
+    if not isinstance(url, str):
+        raise TypeError("url must be a string")
+
+    parts = urlsplit(url.strip())
+    query = parse_qs(parts.query, keep_blank_values=True)
+    if "product_id" in query:
+        query = {"product_id": query["product_id"][:1]}
+
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower().removeprefix("www.")
+    # Mirrors and local fixture servers (see MELONBOOKS_BASE_URL) may only serve http
+    if netloc == MELONBOOKS_HOST:
+        scheme = "https"
+
+    return urlunsplit(
+        (
+            scheme,
+            netloc,
+            parts.path,
+            urlencode(sorted(query.items()), doseq=True),
+            "",
+        )
+    )
+
 
 class AddedCipherAdapter(HTTPAdapter):
     """Cipher manager needed to get BeautifulSoup to work with Melonbooks.
@@ -73,6 +130,9 @@ class DoujinScraper:
     GENRE_TAG_JAPANESE : Japanese characters indicating the genre tag
     EVENT_TAG_JAPANESE : Japanese characters indicating the event tag
     session : Requests library session
+    cache : Cache of scraped pages, shared with other processes
+    in_flight : Fetches in progress, keyed by canonical URL, so concurrent scrapes of a URL share a single fetch
+    in_flight_lock : Lock guarding in_flight, as pages are scraped from worker threads
 
     """
 
@@ -81,14 +141,29 @@ class DoujinScraper:
     GENRE_TAG_JAPANESE = "ジャンル"
     EVENT_TAG_JAPANESE = "イベント"
 
-    def __init__(self):
-        """Initialize the Melonbooks scraper."""
+    def __init__(self, cache: Cache | None = None):
+        """Initialize the Melonbooks scraper.
+
+        Parameters
+        ----------
+        cache : Cache | None
+            Cache of scraped pages, shared with other processes. If None, an in-memory cache is used.
+
+        """
         self.session = Session()
-        self.session.mount("https://www.melonbooks.co.jp", AddedCipherAdapter())
+        # Canonical URLs drop the "www." of MELONBOOKS_BASE_URL, both are fetched with the same ciphers
+        adapter = AddedCipherAdapter()
+        self.session.mount(f"https://{MELONBOOKS_HOST}/", adapter)
+        self.session.mount(MELONBOOKS_BASE_URL, adapter)
+        self.cache: Cache = cache if cache is not None else InMemoryCache()
+        self.in_flight: dict[str, Future] = {}
+        self.in_flight_lock = threading.Lock()
 
     def scrape_url(self, url: str) -> DoujinMetadata:
         """Scrapes a given URL for relevant information regarding a doujin.
 
+        Concurrent calls for the same canonical URL wait for a single fetch.
+
         Parameters
         ----------
         url : str
@@ -103,8 +178,48 @@ class DoujinScraper:
         if not isinstance(url, str):
             raise TypeError("url must be a string")
 
-        page = self.session.get(f"{url}&adult_view=1")
-        soup = BeautifulSoup(page.content, features="html.parser")
+        url = canonicalize_url(url)
+        cached = self.cache.get("scrape", url)
+        if cached is not None:
+            return DoujinMetadata(*cached)
+
+        with self.in_flight_lock:
+            in_flight = self.in_flight.get(url)
+            if in_flight is None:
+                self.in_flight[url] = future = Future()
+
+        if in_flight is not None:
+            SCRAPE_COALESCED.inc()
+            return in_flight.result()
+
+        try:
+            metadata = self._fetch(url)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(metadata)
+            return metadata
+        finally:
+            with self.in_flight_lock:
+                del self.in_flight[url]
+
+    def _fetch(self, url: str) -> DoujinMetadata:
+        with SCRAPE_FETCH_LATENCY.time():
+            page = self.session.get(f"{url}&adult_view=1")
+
+        with SCRAPE_PARSE_LATENCY.time():
+            metadata = self._parse_page(page.content)
+
+        self.cache.set("scrape", url, list(metadata), ttl=SCRAPE_CACHE_TTL)
+        return metadata
+
+    def _parse_page(self, content: bytes) -> DoujinMetadata:
+        # bs4 is slow to import and only needed once a page is scraped, so it isn't imported on startup
+        from bs4 import BeautifulSoup
+        from bs4.element import Tag
+
+        soup = BeautifulSoup(content, features="html.parser")
 
         title = soup.find("h1", {"class": "page-header"})
         if title is not None:
@@ -125,7 +240,7 @@ class DoujinScraper:
         image_element = soup.find("div", {"class": "item-img"})
         if image_element is not None and isinstance(image_element, Tag):
             image_preview_url = (
-                f'https:{image_element.findChildren("img")[0].attrs["src"]}'
+                f"https:{image_element.findChildren('img')[0].attrs['src']}"
             )
         else:
             raise ValueError("image_preview_url cannot be None")
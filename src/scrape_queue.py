@@ -0,0 +1,419 @@
+"""Durable queue of Melonbooks scrape jobs stored in MongoDB, and the workers processing it."""
+
+import asyncio
+import logging
+import random
+import uuid
+from collections.abc import Awaitable, Callable
+from datetime import UTC, datetime, timedelta
+
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.database import Database
+from pymongo.errors import DuplicateKeyError
+
+from src.dao import DAO
+from src.doujin_with_reservation import DoujinWithReservationData
+from src.metrics import SCRAPE_JOB_DURATION, SCRAPE_JOBS
+from src.scrape import DoujinScraper, canonicalize_url
+
+logger = logging.getLogger(__name__)
+
+JOB_PENDING = "pending"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+
+
+class ScrapeQueue:
+    """Durable queue of scrape jobs, one per URL, stored in the scrape_jobs collection.
+
+    available_at is both when a pending job may be retried and when the lease of a running job expires,
+    so a job whose worker died is picked up again once its visibility timeout has elapsed.
+
+    Attributes
+    ----------
+    jobs : scrape_jobs collection
+    max_attempts : Number of attempts before a job is marked as failed
+    visibility_timeout : Number of seconds a worker has to finish a job before another worker may claim it
+    base_backoff : Number of seconds before the first retry, doubled after every attempt
+    max_backoff : Maximum number of seconds between retries
+
+    """
+
+    def __init__(
+        self,
+        db: Database,
+        max_attempts: int = 5,
+        visibility_timeout: float = 120,
+        base_backoff: float = 5,
+        max_backoff: float = 600,
+    ):
+        """Initialize the queue.
+
+        Parameters
+        ----------
+        db : Database
+            Database holding the scrape_jobs collection
+        max_attempts : int
+            Number of attempts before a job is marked as failed
+        visibility_timeout : float
+            Number of seconds a worker has to finish a job before another worker may claim it
+        base_backoff : float
+            Number of seconds before the first retry, doubled after every attempt
+        max_backoff : float
+            Maximum number of seconds between retries
+
+        """
+        self.jobs = db.get_collection("scrape_jobs")
+        self.max_attempts = max_attempts
+        self.visibility_timeout = visibility_timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def create_indexes(self) -> None:
+        """Create the indexes used by the queue, if they don't exist yet."""
+        self.jobs.create_index([("url", ASCENDING)], unique=True)
+        self.jobs.create_index([("status", ASCENDING), ("available_at", ASCENDING)])
+
+    def submit(self, url: str, request: dict | None = None) -> dict:
+        """Submit a scrape job, or join the job already submitted for the same canonical URL.
+
+        Parameters
+        ----------
+        url : str
+            URL to scrape
+        request : dict | None
+            Who to notify once the job finishes, see the bot's scrape job handler
+
+        Returns
+        -------
+        dict
+            The job. If its status is done, the doujin was already added and request was not recorded.
+
+        """
+        if not isinstance(url, str):
+            raise TypeError("url must be a str")
+
+        url = canonicalize_url(url)
+        now = datetime.now(UTC)
+        update = {
+            "$setOnInsert": {
+                "status": JOB_PENDING,
+                "attempts": 0,
+                "available_at": now,
+                "submitted_at": now,
+            },
+        }
+        if request is not None:
+            update["$push"] = {"requests": request}
+
+        try:
+            job = self.jobs.find_one_and_update(
+                {"url": url, "status": {"$ne": JOB_DONE}},
+                update,
+                upsert=True,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # The URL was already scraped
+            return self.jobs.find_one({"url": url})
+
+        if job["status"] == JOB_FAILED:
+            # Resubmitting a failed URL retries it from scratch
+            job = self.jobs.find_one_and_update(
+                {"_id": job["_id"], "status": JOB_FAILED},
+                {
+                    "$set": {
+                        "status": JOB_PENDING,
+                        "attempts": 0,
+                        "available_at": now,
+                        "submitted_at": now,
+                    }
+                },
+                return_document=ReturnDocument.AFTER,
+            ) or self.jobs.find_one({"_id": job["_id"]})
+
+        return job
+
+    def get_jobs(self, urls: list[str]) -> dict[str, dict]:
+        """Retrieve the jobs of URLs.
+
+        Parameters
+        ----------
+        urls : list[str]
+            Canonical URLs
+
+        Returns
+        -------
+        dict[str, dict]
+            Job of each URL that was submitted, without its requests.
+
+        """
+        return {
+            job["url"]: job
+            for job in self.jobs.find({"url": {"$in": urls}}, {"requests": 0})
+        }
+
+    def claim(self, worker_id: str) -> dict | None:
+        """Claim the job that has been available the longest.
+
+        Parameters
+        ----------
+        worker_id : str
+            Id of the claiming worker
+
+        Returns
+        -------
+        dict | None
+            The claimed job, or None if no job is available.
+
+        """
+        now = datetime.now(UTC)
+        return self.jobs.find_one_and_update(
+            {
+                "status": {"$in": [JOB_PENDING, JOB_RUNNING]},
+                "available_at": {"$lte": now},
+            },
+            {
+                "$set": {
+                    "status": JOB_RUNNING,
+                    "worker": worker_id,
+                    "available_at": now + timedelta(seconds=self.visibility_timeout),
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("available_at", ASCENDING)],
+            return_document=ReturnDocument.AFTER,
+        )
+
+    def complete(self, job: dict, doujin_id) -> dict | None:
+        """Mark a claimed job as done.
+
+        Parameters
+        ----------
+        job : dict
+            Job returned by claim
+        doujin_id : ObjectId
+            Id of the doujin added from the scraped page
+
+        Returns
+        -------
+        dict | None
+            The job, including every request to notify. None if the lease expired and another worker claimed the job.
+
+        """
+        return self._finish(
+            job, {"status": JOB_DONE, "doujin_id": doujin_id, "error": None}
+        )
+
+    def fail(self, job: dict, error: str) -> dict | None:
+        """Record a failed attempt of a claimed job, scheduling a retry with exponential backoff and jitter.
+
+        Parameters
+        ----------
+        job : dict
+            Job returned by claim
+        error : str
+            Why the attempt failed
+
+        Returns
+        -------
+        dict | None
+            The job, including every request to notify if it won't be retried.
+            None if the job will be retried, or if the lease expired and another worker claimed the job.
+
+        """
+        if job["attempts"] >= self.max_attempts:
+            return self._finish(job, {"status": JOB_FAILED, "error": error})
+
+        backoff = min(self.max_backoff, self.base_backoff * 2 ** (job["attempts"] - 1))
+        self.jobs.update_one(
+            {"_id": job["_id"], "worker": job["worker"], "status": JOB_RUNNING},
+            {
+                "$set": {
+                    "status": JOB_PENDING,
+                    "error": error,
+                    "available_at": datetime.now(UTC)
+                    + timedelta(seconds=backoff * random.uniform(0.5, 1)),
+                }
+            },
+        )
+        return None
+
+    def release(self, job: dict) -> None:
+        """Give a claimed job back without counting the attempt, so that any worker may claim it right away.
+
+        Parameters
+        ----------
+        job : dict
+            Job returned by claim
+
+        """
+        self.jobs.update_one(
+            {"_id": job["_id"], "worker": job["worker"], "status": JOB_RUNNING},
+            {
+                "$set": {"status": JOB_PENDING, "available_at": datetime.now(UTC)},
+                "$inc": {"attempts": -1},
+            },
+        )
+
+    def _finish(self, job: dict, fields: dict) -> dict | None:
+        # Requests are taken along with the status change, so each of them is only ever handled once
+        fields["finished_at"] = datetime.now(UTC)
+        previous = self.jobs.find_one_and_update(
+            {"_id": job["_id"], "worker": job["worker"], "status": JOB_RUNNING},
+            {"$set": {**fields, "requests": []}},
+            return_document=ReturnDocument.BEFORE,
+        )
+        if previous is None:
+            return None
+
+        return {**previous, **fields}
+
+
+class ScrapeWorkerPool:
+    """Workers claiming scrape jobs, scraping them in threads and adding the scraped doujin.
+
+    Attributes
+    ----------
+    queue : Queue to claim jobs from
+    scraper : Melonbooks scraper
+    dao : DAO the scraped doujin are added with
+    on_finished : Coroutine called with each job that won't be retried, and the added doujin (None if it failed)
+    workers : Number of concurrent workers, which bounds the number of concurrent requests to Melonbooks
+    poll_interval : Number of seconds idle workers wait before looking for jobs again
+    worker_prefix : Prefix of the id of each worker, unique to this pool
+    tasks : Running workers
+    wake_up : Event waking idle workers up, set when a job is submitted
+
+    """
+
+    def __init__(
+        self,
+        queue: ScrapeQueue,
+        scraper: DoujinScraper,
+        dao: DAO,
+        on_finished: Callable[
+            [dict, DoujinWithReservationData | None], Awaitable[None]
+        ],
+        workers: int = 2,
+        poll_interval: float = 5,
+    ):
+        """Initialize the pool, without starting any worker.
+
+        Parameters
+        ----------
+        queue : ScrapeQueue
+            Queue to claim jobs from
+        scraper : DoujinScraper
+            Melonbooks scraper
+        dao : DAO
+            DAO the scraped doujin are added with
+        on_finished : Callable[[dict, DoujinWithReservationData | None], Awaitable[None]]
+            Coroutine called with each job that won't be retried, and the added doujin (None if it failed)
+        workers : int
+            Number of concurrent workers
+        poll_interval : float
+            Number of seconds idle workers wait before looking for jobs again
+
+        """
+        self.queue = queue
+        self.scraper = scraper
+        self.dao = dao
+        self.on_finished = on_finished
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.worker_prefix = uuid.uuid4().hex[:8]
+        self.tasks: list[asyncio.Task] = []
+        self.wake_up = asyncio.Event()
+
+    def start(self) -> None:
+        """Start the workers."""
+        for index in range(self.workers):
+            self.tasks.append(
+                asyncio.create_task(self._work(f"{self.worker_prefix}-{index}"))
+            )
+
+    async def stop(self) -> None:
+        """Stop the workers. Jobs being processed are released, so that another worker may claim them right away."""
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def wake(self) -> None:
+        """Wake idle workers up, so that a job that was just submitted is processed right away."""
+        self.wake_up.set()
+
+    async def _work(self, worker_id: str) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.queue.claim, worker_id)
+            except Exception:
+                logger.exception("Failed to claim a scrape job")
+                job = None
+
+            if job is None:
+                try:
+                    await asyncio.wait_for(self.wake_up.wait(), self.poll_interval)
+                except TimeoutError:
+                    pass
+                self.wake_up.clear()
+                continue
+
+            try:
+                await self._process(job)
+            except asyncio.CancelledError:
+                await asyncio.to_thread(self.queue.release, job)
+                raise
+
+    async def _process(self, job: dict) -> None:
+        try:
+            doujin = await asyncio.to_thread(self._add_doujin, job["url"])
+        except Exception as e:
+            logger.warning("Scrape job %s failed: %s", job["url"], e)
+            finished = await asyncio.to_thread(self.queue.fail, job, str(e))
+            SCRAPE_JOBS.labels(
+                outcome="failed" if finished is not None else "retried"
+            ).inc()
+            doujin = None
+        else:
+            finished = await asyncio.to_thread(self.queue.complete, job, doujin._id)
+            SCRAPE_JOBS.labels(outcome="done").inc()
+
+        if finished is None:
+            return
+
+        SCRAPE_JOB_DURATION.observe(
+            (
+                datetime.now(UTC) - finished["submitted_at"].replace(tzinfo=UTC)
+            ).total_seconds()
+        )
+        try:
+            await self.on_finished(finished, doujin)
+        except Exception:
+            logger.exception("Failed to handle finished scrape job %s", job["url"])
+
+    def _add_doujin(self, url: str) -> DoujinWithReservationData:
+        (
+            title,
+            price_in_yen,
+            circle_name,
+            author_names,
+            genres,
+            events,
+            is_r18,
+            image_preview_url,
+        ) = self.scraper.scrape_url(url)
+
+        return self.dao.add_doujin(
+            url,
+            title,
+            price_in_yen,
+            circle_name,
+            author_names,
+            genres,
+            events,
+            is_r18,
+            image_preview_url,
+        )
@@ -0,0 +1,68 @@
+"""Terms indexed by the doujin text index, so that Japanese titles can be searched for."""
+
+import re
+
+# Runs of kana, kanji and full-width characters, which aren't separated by spaces
+CJK_RUN = re.compile(
+    r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff01-\uffef]+"
+)
+
+# Weight of each field of the text index, a match in the title ranks higher than a match in the genres
+SEARCH_WEIGHTS = {
+    "title": 10,
+    "circle_name": 8,
+    "author_names": 8,
+    "search_ngrams": 4,
+    "events": 2,
+    "genres": 2,
+}
+
+
+def search_ngrams(*texts: str) -> list[str]:
+    """Split the Japanese text of a doujin into overlapping bigrams.
+
+    MongoDB's text index only splits words on spaces and punctuation, so a title such as "ブルアカ合同誌" is a single
+    term that a search for "ブルアカ" wouldn't match. Indexing the bigrams of such runs lets any substring of at
+    least two characters match.
+
+    Parameters
+    ----------
+    texts : tuple(str)
+        Title, circle name, author names...
+
+    Returns
+    -------
+    list[str]
+        Distinct bigrams, single characters are kept as is.
+
+    """
+    ngrams = {}
+    for text in texts:
+        for run in CJK_RUN.findall(text.lower()):
+            if len(run) == 1:
+                ngrams[run] = None
+            for start in range(len(run) - 1):
+                ngrams[run[start : start + 2]] = None
+
+    return list(ngrams)
+
+
+def search_string(query: str) -> str:
+    """Convert a query into the $search string of the doujin text index.
+
+    Every word of the query is searched for as is, and Japanese runs are also searched for by their bigrams.
+
+    Parameters
+    ----------
+    query : str
+        Query, as typed by the user
+
+    Returns
+    -------
+    str
+        Space separated terms, any of which matches.
+
+    """
+    # Quotes and leading dashes would turn terms into phrases and negations
+    terms = [term.lstrip("-") for term in query.replace('"', " ").split()]
+    return " ".join([term for term in terms if term] + search_ngrams(query))
@@ -10,5 +10,39 @@ db.createUser({
 
 db.createCollection("users");
 db.createCollection("doujins");
+db.createCollection("reservations");
+
+db.users.createIndex({ guild_id: 1, discord_id: 1 }, { unique: true });
+db.users.createIndex({ guild_id: 1, total_yen: -1 });
+db.reservations.createIndex(
+  { guild_id: 1, user_id: 1, doujin_id: 1 },
+  { unique: true },
+);
+db.reservations.createIndex({ guild_id: 1, doujin_id: 1, user_id: 1 });
+db.doujin_stats.createIndex({ guild_id: 1, doujin_id: 1 }, { unique: true });
+db.doujin_stats.createIndex({ guild_id: 1, reservation_count: -1 });
+db.doujins.createIndex({ url: 1 }, { unique: true });
+db.doujins.createIndex(
+  {
+    title: "text",
+    circle_name: "text",
+    author_names: "text",
+    search_ngrams: "text",
+    events: "text",
+    genres: "text",
+  },
+  {
+    name: "doujin_search",
+    default_language: "none",
+    weights: {
+      title: 10,
+      circle_name: 8,
+      author_names: 8,
+      search_ngrams: 4,
+      events: 2,
+      genres: 2,
+    },
+  },
+);
 
 console.log("SEEDING COMPLETE ########################");
@@ -0,0 +1,125 @@
+"""Configuration of gateway sharding, read from the environment."""
+
+import os
+
+
+def parse_shard_ids(spec: str) -> list[int]:
+    """Parse a list of shard ids and shard id ranges, such as "0-3,8".
+
+    Parameters
+    ----------
+    spec : str
+        Comma separated shard ids, or inclusive ranges of shard ids
+
+    Returns
+    -------
+    list[int]
+        Sorted shard ids, without duplicates.
+
+    """
+    shard_ids = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+
+        if "-" in part:
+            first, last = (int(bound) for bound in part.split("-", 1))
+            if first > last:
+                raise ValueError(f"Invalid shard range {part}")
+            shard_ids.update(range(first, last + 1))
+        else:
+            shard_ids.add(int(part))
+
+    if any(shard_id < 0 for shard_id in shard_ids):
+        raise ValueError("Shard ids cannot be negative")
+
+    return sorted(shard_ids)
+
+
+def format_shard_ids(shard_ids: list[int]) -> str:
+    """Format shard ids in the syntax accepted by parse_shard_ids, collapsing consecutive ids into ranges.
+
+    Parameters
+    ----------
+    shard_ids : list[int]
+        Shard ids
+
+    Returns
+    -------
+    str
+        Shard ids, e.g. "0-3,8"
+
+    """
+    ranges = []
+    for shard_id in sorted(set(shard_ids)):
+        if ranges and ranges[-1][1] == shard_id - 1:
+            ranges[-1][1] = shard_id
+        else:
+            ranges.append([shard_id, shard_id])
+
+    return ",".join(
+        str(first) if first == last else f"{first}-{last}" for first, last in ranges
+    )
+
+
+def split_shards(shard_ids: list[int], processes: int) -> list[list[int]]:
+    """Split shards into contiguous groups of (almost) equal size, one per process.
+
+    Parameters
+    ----------
+    shard_ids : list[int]
+        Shard ids to split
+    processes : int
+        Number of processes
+
+    Returns
+    -------
+    list[list[int]]
+        Shard ids of each process, processes without any shard are left out.
+
+    """
+    if processes < 1:
+        raise ValueError("processes must be at least 1")
+
+    groups = []
+    start = 0
+    for index in range(processes):
+        size = len(shard_ids) // processes + (index < len(shard_ids) % processes)
+        if size:
+            groups.append(shard_ids[start : start + size])
+        start += size
+
+    return groups
+
+
+def shard_options_from_env() -> dict | None:
+    """Read the sharding options of the bot from the environment.
+
+    SHARD_COUNT enables sharding. It is either the total number of shards, or "auto" to use the number recommended by
+    Discord. SHARD_IDS restricts the shards ran by this process, e.g. "0-3,8", and requires SHARD_COUNT to be a number.
+
+    Returns
+    -------
+    dict | None
+        Keyword arguments of commands.AutoShardedBot, or None if sharding is disabled.
+
+    """
+    shard_count = os.getenv("SHARD_COUNT")
+    if shard_count is None:
+        return None
+
+    options = {}
+    if shard_count != "auto":
+        options["shard_count"] = int(shard_count)
+
+    shard_ids = os.getenv("SHARD_IDS")
+    if shard_ids:
+        if "shard_count" not in options:
+            raise ValueError("SHARD_IDS requires SHARD_COUNT to be a number")
+
+        options["shard_ids"] = parse_shard_ids(shard_ids)
+        if options["shard_ids"][-1] >= options["shard_count"]:
+            raise ValueError("SHARD_IDS must be lower than SHARD_COUNT")
+
+    return options
@@ -15,6 +15,10 @@ class User:
     name : Global name of the discord user.
     If the global name is not available, the server name will be used instead.
     last_updated : last update to user
+    reservation_count : Number of doujin reserved by the user
+    total_yen : Total price of the doujin reserved by the user (in Japanese Yen)
+    total_usd : Total price of the doujin reserved by the user (in USD)
+    guild_id : Id of the Discord server the user's reservations belong to, None for data predating servers
 
     """
 
@@ -24,6 +28,10 @@ class User:
         discord_id: int,
         name: str,
         last_updated: datetime = datetime.now(UTC),
+        reservation_count: int = 0,
+        total_yen: int = 0,
+        total_usd: float = 0.0,
+        guild_id: int | None = None,
     ):
         """Initialize a user.
 
@@ -40,6 +48,14 @@ class User:
             list of doujin reservations
         last_updated : datetime
             last update to user
+        reservation_count : int
+            Number of doujin reserved by the user
+        total_yen : int
+            Total price of the doujin reserved by the user (in Japanese Yen)
+        total_usd : float
+            Total price of the doujin reserved by the user (in USD)
+        guild_id : int | None
+            Id of the Discord server the user's reservations belong to, None for data predating servers
 
         """
         if not isinstance(discord_id, int):
@@ -48,8 +64,20 @@ class User:
             raise TypeError("global_name must be an str")
         if not isinstance(last_updated, datetime):
             raise TypeError("last_updated must be a datetime")
+        if not isinstance(reservation_count, int):
+            raise TypeError("reservation_count must be an int")
+        if not isinstance(total_yen, int):
+            raise TypeError("total_yen must be an int")
+        if not isinstance(total_usd, (int, float)):
+            raise TypeError("total_usd must be a float")
+        if guild_id is not None and not isinstance(guild_id, int):
+            raise TypeError("guild_id must be an int or None")
 
         self._id = _id
         self.discord_id = discord_id
         self.name = name
         self.last_updated = last_updated
+        self.reservation_count = reservation_count
+        self.total_yen = total_yen
+        self.total_usd = float(total_usd)
+        self.guild_id = guild_id
@@ -77,6 +77,18 @@ class UserWithReservationData:
         """
         return self.user.name
 
+    @property
+    def guild_id(self) -> int | None:
+        """Retrieve the Id of the Discord server the user's reservations belong to.
+
+        Returns
+        -------
+        int | None
+            Id of the Discord server, None for data predating servers.
+
+        """
+        return self.user.guild_id
+
     @property
     def last_updated(self) -> datetime:
         """Retrieve the last updated timestamp of the user.
@@ -89,6 +101,42 @@ class UserWithReservationData:
         """
         return self.user.last_updated
 
+    @property
+    def reservation_count(self) -> int:
+        """Retrieve the number of doujin reserved by the user.
+
+        Returns
+        -------
+        int
+            Number of doujin reserved by the user.
+
+        """
+        return self.user.reservation_count
+
+    @property
+    def total_yen(self) -> int:
+        """Retrieve the total price of the doujin reserved by the user, in Japanese Yen.
+
+        Returns
+        -------
+        int
+            Total price of the doujin reserved by the user, in Japanese Yen.
+
+        """
+        return self.user.total_yen
+
+    @property
+    def total_usd(self) -> float:
+        """Retrieve the total price of the doujin reserved by the user, in USD.
+
+        Returns
+        -------
+        float
+            Total price of the doujin reserved by the user, in USD.
+
+        """
+        return self.user.total_usd
+
     def has_reserved(self, doujin_id: ObjectId) -> bool:
         """Check whether or not a doujin has already been reserved by the user.
 
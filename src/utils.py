@@ -10,20 +10,66 @@ from discord.ext.commands import Context
 
 from src.doujin_with_reservation import DoujinWithReservationData
 from src.reservation import DoujinReservation
-from src.user_with_reservation import UserWithReservationData
+from src.user import User
 
+# Discord API limits
+MAX_EMBEDS_PER_MESSAGE = 10
+MAX_MESSAGE_LENGTH = 2000
 
-async def generate_doujin_embed(
-    ctx: Context, message: str, doujin: DoujinWithReservationData
-):
+
+def split_message_content(lines: list[str]) -> list[str]:
+    """Split lines over as few messages as possible, without exceeding Discord's message length limit.
+
+    Parameters
+    ----------
+    lines : list[str]
+        Lines of the messages, a line longer than a message is truncated
+
+    Returns
+    -------
+    list[str]
+        Content of each message, at least one.
+
+    """
+    contents = [""]
+    for line in lines:
+        line = line[: MAX_MESSAGE_LENGTH - 1]
+        if len(contents[-1]) + len(line) + 1 > MAX_MESSAGE_LENGTH:
+            contents.append("")
+        contents[-1] += f"{line}\n"
+
+    return contents
+
+
+def fit_message_content(lines: list[str]) -> str:
+    """Fit lines in a single message, replacing the lines that don't fit with the number of them.
+
+    Parameters
+    ----------
+    lines : list[str]
+        Lines of the message
+
+    Returns
+    -------
+    str
+        Content of the message.
+
+    """
+    content = ""
+    for index, line in enumerate(lines):
+        # Leaves room for the number of lines that don't fit
+        if len(content) + len(line) + 1 > MAX_MESSAGE_LENGTH - 32:
+            return f"{content}... and {len(lines) - index} more\n"
+        content += f"{line}\n"
+
+    return content
+
+
+def generate_doujin_embed(doujin: DoujinWithReservationData) -> Embed:
     """Generate the embed that displays various doujin metadata.
 
     Parameters
     ----------
-    ctx: Context
-        Discord context
-    message: str
-        Message to include with the embed
     doujin : Doujin
         Doujin embed
 
@@ -48,13 +94,49 @@ async def generate_doujin_embed(
     embed.add_field(name="Genre", value=",".join(doujin.genres), inline=False)
     embed.add_field(name="Id", value=doujin._id, inline=False)
 
-    await ctx.reply(message, embed=embed)
+    return embed
+
+
+async def reply_with_doujin_embeds(
+    ctx: Context, messages: list[str], doujins: list[DoujinWithReservationData]
+):
+    """Reply with the embeds of multiple doujin, using as few messages as possible.
+
+    Discord allows at most 10 embeds per message, so the embeds are sent in chunks of 10.
+    The status message of each doujin is placed in the content of the message containing its embed, status messages
+    that don't fit are sent in follow-up messages.
+
+    Parameters
+    ----------
+    ctx : Context
+        Discord context
+    messages : list[str]
+        Status message for each doujin, empty messages are skipped
+    doujins : list[DoujinWithReservationData]
+        Doujin to generate embeds for
+
+    """
+    if len(messages) != len(doujins):
+        raise ValueError("messages and doujins must be the same length")
+
+    for start in range(0, len(doujins), MAX_EMBEDS_PER_MESSAGE):
+        end = start + MAX_EMBEDS_PER_MESSAGE
+        contents = split_message_content(
+            [message for message in messages[start:end] if message]
+        )
+        embeds = [generate_doujin_embed(doujin) for doujin in doujins[start:end]]
+
+        await ctx.reply(content=contents[0], embeds=embeds)
+        for content in contents[1:]:
+            await ctx.reply(content=content)
 
 
 async def list_doujins(
     message: str,
     ctx: Context,
     reservations: list[DoujinReservation],
+    total_yen: int,
+    total_usd: float,
 ) -> None:
     """Generate the embed that list the doujins a user has reserved.
 
@@ -66,6 +148,10 @@ async def list_doujins(
         Discord context
     reservations : list[Reservation]
         List of reservations
+    total_yen : int
+        Total cost of the reservations (in Japanese Yen)
+    total_usd : float
+        Total cost of the reservations (in USD)
 
     """
     embeds = []
@@ -73,8 +159,6 @@ async def list_doujins(
     page = 0
     cur_embed = Embed()
 
-    price_yen_total = 0
-    price_usd_total = 0
     for index, reservation in enumerate(reservations):
         doujin = reservation.doujin
         if len(list_string) > 600:
@@ -88,10 +172,8 @@ async def list_doujins(
 
         url = doujin.url
         title = doujin.title
-        line = f'{index + 1}. ¥{doujin.price_in_yen} (${'{:.2f}'.format(doujin.price_in_usd)}) - [{title[:10] + "..." if len(title) > 12 else title}]({url}) ({doujin._id})\n'
+        line = f"{index + 1}. ¥{doujin.price_in_yen} (${'{:.2f}'.format(doujin.price_in_usd)}) - [{title[:10] + '...' if len(title) > 12 else title}]({url}) ({doujin._id})\n"
 
-        price_yen_total += doujin.price_in_yen
-        price_usd_total += doujin.price_in_usd
         list_string += line
 
     cur_embed.add_field(name=f"Page: {page + 1}", value=list_string)
@@ -119,14 +201,128 @@ async def list_doujins(
             embeds=embeds[prev:],
         )
 
-    await ctx.reply(
-        content=f"Total cost: ¥{price_yen_total}, ${'{:.2f}'.format(price_usd_total)}"
+    await ctx.reply(content=f"Total cost: ¥{total_yen}, ${'{:.2f}'.format(total_usd)}")
+
+
+async def list_search_results(
+    ctx: Context, query: str, doujins: list[DoujinWithReservationData]
+) -> None:
+    """Reply with the results of a search, one line per doujin.
+
+    Parameters
+    ----------
+    ctx : Context
+        Discord context
+    query : str
+        Query that was searched for
+    doujins : list[DoujinWithReservationData]
+        Matching doujin, best match first
+
+    """
+    if not doujins:
+        await ctx.reply(content=f"No doujin found for {query}")
+        return
+
+    lines = [
+        f"{index + 1}. [{doujin.title}]({doujin.url}) - {doujin.circle_name} "
+        f"¥{doujin.price_in_yen}, reserved by {len(doujin.reservations)} ({doujin._id})"
+        for index, doujin in enumerate(doujins)
+    ]
+    embed = Embed(
+        title=f"Results for {query}"[:256], description="\n".join(lines)[:4096]
     )
+    await ctx.reply(embed=embed)
+
+
+async def list_top(ctx: Context, kind: str, ranking: list[dict]) -> None:
+    """Reply with the most reserved doujin, circles or events, one line each.
+
+    Parameters
+    ----------
+    ctx : Context
+        Discord context
+    kind : str
+        "doujin", "circle" or "event"
+    ranking : list[dict]
+        Reservation counts, as returned by DAO.retrieve_top_doujin or DAO.retrieve_top_groups
+
+    """
+    if not ranking:
+        await ctx.reply(content="Nothing has been reserved yet")
+        return
+
+    if kind == "doujin":
+        lines = [
+            f"{index + 1}. [{doujin['title']}]({doujin['url']}) - {doujin['circle_name']}, "
+            f"reserved by {doujin['reservation_count']} ({doujin['doujin_id']})"
+            for index, doujin in enumerate(ranking)
+        ]
+    else:
+        lines = [
+            f"{index + 1}. {group['_id'] or 'Unknown'}: {group['reservation_count']} reservation(s) "
+            f"of {group['doujin_count']} doujin"
+            for index, group in enumerate(ranking)
+        ]
+
+    title = "Most reserved doujin" if kind == "doujin" else f"Most reserved {kind}s"
+    embed = Embed(title=title, description="\n".join(lines)[:4096])
+    await ctx.reply(embed=embed)
+
+
+async def list_manifest(ctx: Context, event: str | None, manifest: list[dict]) -> None:
+    """Reply with what to buy at each event, circle by circle, splitting the list across messages as needed.
+
+    Parameters
+    ----------
+    ctx : Context
+        Discord context
+    event : str | None
+        Event the manifest was restricted to, None for every event
+    manifest : list[dict]
+        Circles to visit, as returned by DAO.retrieve_manifest
+
+    """
+    if not manifest:
+        await ctx.reply(content=f"Nothing to buy{f' at {event}' if event else ''}")
+        return
+
+    lines = []
+    current_event = ()
+    for circle in manifest:
+        if circle["event"] != current_event:
+            current_event = circle["event"]
+            event_circles = [
+                other for other in manifest if other["event"] == current_event
+            ]
+            lines.append(
+                f"__**{current_event or 'No event'}**__: "
+                f"{sum(other['quantity'] for other in event_circles)} item(s), "
+                f"¥{sum(other['total_yen'] for other in event_circles)} "
+                f"(${'{:.2f}'.format(sum(other['total_usd'] for other in event_circles))})"
+            )
+
+        lines.append(
+            f"**{circle['circle_name'] or 'Unknown circle'}**: ¥{circle['total_yen']} "
+            f"(${'{:.2f}'.format(circle['total_usd'])})"
+        )
+        lines.extend(
+            f"- {doujin['quantity']}x {doujin['title']} ¥{doujin['price_in_yen']} ({doujin['_id']})"
+            for doujin in circle["doujins"]
+        )
+
+    lines.append(
+        f"Total: {sum(circle['quantity'] for circle in manifest)} item(s), "
+        f"¥{sum(circle['total_yen'] for circle in manifest)} "
+        f"(${'{:.2f}'.format(sum(circle['total_usd'] for circle in manifest))})"
+    )
+
+    for content in split_message_content(lines):
+        await ctx.reply(content=content)
 
 
 async def export_doujin_data(
     ctx: Context,
-    all_user_data: list[UserWithReservationData],
+    all_users: list[User],
     all_doujin_data: list[DoujinWithReservationData],
 ):
     """Export Comiket Bot's data.
@@ -138,36 +334,15 @@ async def export_doujin_data(
     ----------
     ctx : Context
         Discord Context
-    all_user_data : list[UserWithReservationData]
-        The data of all users, including reservation data.
+    all_users : list[User]
+        All users, with their reservation count and totals.
     all_doujin_data : list[DoujinWithReservationData]
         The data of all doujin, including reservation data.
 
     """
-    # TODO: This should be it's own database query instead of fetching everything (but this might be a bit hard with MongoDB)
-    relevant_user_data = []
-    for user_data in all_user_data:
-        total_cost_in_yen = sum(
-            [reservation.doujin.price_in_yen for reservation in user_data.reservations]
-        )
-        total_cost_in_usd = sum(
-            [reservation.doujin.price_in_usd for reservation in user_data.reservations]
-        )
-        relevant_user_data.append(
-            {
-                "discord_id": user_data.discord_id,
-                "num_items": len(user_data.reservations),
-                "total_cost_in_yen": total_cost_in_yen,
-                "total_cost_in_usd": total_cost_in_usd,
-            }
-        )
-    relevant_user_data = sorted(
-        relevant_user_data, key=lambda x: x["total_cost_in_yen"]
-    )
-
     message = ""
-    for user_data in relevant_user_data:
-        message += f"<@{user_data['discord_id']}> purchased {user_data['num_items']} for a total of ¥{user_data['total_cost_in_yen']} (${'{:.2f}'.format(user_data['total_cost_in_usd'])})\n"
+    for user in sorted(all_users, key=lambda x: x.total_yen):
+        message += f"<@{user.discord_id}> purchased {user.reservation_count} for a total of ¥{user.total_yen} (${'{:.2f}'.format(user.total_usd)})\n"
 
     csv_file_path = generate_csv(all_doujin_data)
     await ctx.send(message, file=discord.File(csv_file_path))
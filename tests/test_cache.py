@@ -0,0 +1,118 @@
+"""Tests of the cache backends. RedisCache runs against fakeredis, an in-process Redis server, see requirements-dev.txt."""
+
+import time
+
+import fakeredis
+import pytest
+from bson.objectid import ObjectId
+
+from src import cache as cache_module
+from src.cache import InMemoryCache, RedisCache, cache_from_env
+
+
+@pytest.fixture
+def redis_server(monkeypatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        cache_module.redis.Redis,
+        "from_url",
+        lambda url: fakeredis.FakeRedis(server=server),
+    )
+    return server
+
+
+@pytest.fixture
+def redis_caches(redis_server):
+    caches = [RedisCache("redis://localhost:6379/0", version_ttl=60) for _ in range(2)]
+    yield caches
+    for redis_cache in caches:
+        redis_cache.close()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.01)
+
+
+def test_redis_get_set(redis_caches):
+    redis_cache, _ = redis_caches
+    doujin_id = ObjectId()
+    redis_cache.set("doujin", "a", {"_id": doujin_id, "events": ["C105"]})
+    redis_cache.set_many("doujin", {"b": 1, "c": "two"})
+
+    assert redis_cache.get("doujin", "a") == {"_id": doujin_id, "events": ["C105"]}
+    assert redis_cache.get_many("doujin", ["b", "c", "missing"]) == {"b": 1, "c": "two"}
+    assert redis_cache.get("other", "a") is None
+
+
+def test_redis_ttl_and_delete(redis_caches):
+    redis_cache, _ = redis_caches
+    redis_cache.set("page", "expiring", 1, ttl=0.05)
+    redis_cache.set("page", "deleted", 2)
+    redis_cache.delete("page", "deleted")
+    time.sleep(0.1)
+
+    assert redis_cache.get("page", "expiring") is None
+    assert redis_cache.get("page", "deleted") is None
+
+
+def test_redis_values_are_shared(redis_caches):
+    writer, reader = redis_caches
+    writer.set("doujin", "a", 1)
+
+    assert reader.get("doujin", "a") == 1
+
+
+def test_redis_invalidate_is_published(redis_caches):
+    writer, reader = redis_caches
+    writer.set("manifest:1", "*", [1])
+    assert reader.get("manifest:1", "*") == [1]
+
+    version = writer.invalidate("manifest:1")
+
+    assert writer.get("manifest:1", "*") is None
+    # The reader trusts its local version for 60 seconds, only the published message updates it
+    wait_for(lambda: reader._version("manifest:1") == version)
+    assert reader.get("manifest:1", "*") is None
+    assert reader.get("manifest:2", "*") is None
+
+
+def test_redis_late_invalidation_message_is_ignored(redis_caches):
+    redis_cache, _ = redis_caches
+    redis_cache.invalidate("doujin")
+    version = redis_cache.invalidate("doujin")
+
+    redis_cache._on_invalidation({"data": '{"namespace": "doujin", "version": 1}'})
+
+    assert redis_cache._version("doujin") == version
+
+
+def test_in_memory_invalidate():
+    memory_cache = InMemoryCache(max_entries=2)
+    memory_cache.set("manifest:1", "*", 1)
+    memory_cache.set("manifest:2", "*", 2)
+
+    assert memory_cache.invalidate("manifest:1") == 1
+    assert memory_cache.get("manifest:1", "*") is None
+    assert memory_cache.get("manifest:2", "*") == 2
+
+    memory_cache.set("manifest:1", "*", 3)
+    assert memory_cache.get("manifest:1", "*") == 3
+    assert len(memory_cache.entries) == 2
+
+
+def test_cache_from_env(monkeypatch, redis_server):
+    monkeypatch.delenv("CACHE_URL", raising=False)
+    assert isinstance(cache_from_env(), InMemoryCache)
+
+    monkeypatch.setenv("CACHE_URL", "memcached://localhost")
+    with pytest.raises(ValueError):
+        cache_from_env()
+
+    monkeypatch.setenv("CACHE_URL", "redis://localhost:6379/0")
+    redis_cache = cache_from_env()
+    assert isinstance(redis_cache, RedisCache)
+    redis_cache.close()
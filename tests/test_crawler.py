@@ -0,0 +1,98 @@
+"""Tests of the catalogue crawler, against the local fixture server."""
+
+import asyncio
+
+import pytest
+from bson.objectid import ObjectId
+
+from benchmarks.fixture_server import (
+    LISTING_PAGE_SIZE,
+    base_url,
+    product_url,
+    start_fixture_server,
+)
+from src.crawler import CatalogueCrawler
+from src.scrape import DoujinScraper, canonicalize_url
+
+EVENT = "コミックマーケット105"
+
+
+class FakeDAO:
+    """Records the doujin added by the crawler instead of writing them to MongoDB."""
+
+    def __init__(self, urls: list[str] = ()):
+        self.doujins = {url: ObjectId() for url in urls}
+
+    def get_doujin_ids_by_urls(self, urls):
+        return {url: self.doujins[url] for url in urls if url in self.doujins}
+
+    def add_doujins(self, all_doujin_metadata):
+        for url in all_doujin_metadata:
+            self.doujins.setdefault(url, ObjectId())
+        return self.get_doujin_ids_by_urls(list(all_doujin_metadata))
+
+
+@pytest.fixture
+def fixture_server():
+    server = start_fixture_server(catalogue=range(1, 2 * LISTING_PAGE_SIZE + 6))
+    yield server
+    server.shutdown()
+
+
+def create_crawler(fixture_server, dao):
+    return CatalogueCrawler(
+        dao,
+        DoujinScraper(),
+        base_url=base_url(fixture_server),
+        request_interval=0,
+        batch_size=20,
+    )
+
+
+def test_crawl_event(fixture_server):
+    existing = [
+        canonicalize_url(product_url(fixture_server, product_id))
+        for product_id in (1, 2)
+    ]
+    dao = FakeDAO(existing)
+
+    progress = asyncio.run(create_crawler(fixture_server, dao).crawl("event", EVENT))
+
+    catalogue_size = 2 * LISTING_PAGE_SIZE + 5
+    assert progress.pages == 3
+    assert progress.found == catalogue_size
+    assert progress.existing == 2
+    assert progress.added == catalogue_size - 2
+    assert not progress.failures
+    assert len(dao.doujins) == catalogue_size
+
+
+def test_crawl_unknown_circle(fixture_server):
+    dao = FakeDAO()
+
+    progress = asyncio.run(
+        create_crawler(fixture_server, dao).crawl("circle", "Unknown")
+    )
+
+    assert progress.pages == 0
+    assert progress.added == 0
+    assert not dao.doujins
+
+
+def test_crawl_adds_listed_doujin_when_a_listing_page_fails(fixture_server):
+    dao = FakeDAO()
+    crawler = create_crawler(fixture_server, dao)
+    fetch_listing = crawler._fetch_listing
+
+    async def fail_second_page(url):
+        if "pageno=2" in url:
+            raise ConnectionError("Listing page unavailable")
+        return await fetch_listing(url)
+
+    crawler._fetch_listing = fail_second_page
+    progress = asyncio.run(crawler.crawl("event", EVENT))
+
+    assert progress.pages == 1
+    assert progress.added == LISTING_PAGE_SIZE
+    assert len(dao.doujins) == LISTING_PAGE_SIZE
+    assert list(progress.failures.values()) == ["Listing page unavailable"]
@@ -0,0 +1,21 @@
+"""Tests of the Melonbooks scraper."""
+
+import pytest
+
+from src.scrape import AddedCipherAdapter, DoujinScraper, canonicalize_url
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://www.melonbooks.co.jp/detail/detail.php?product_id=1",
+        "http://melonbooks.co.jp/detail/detail.php?product_id=1&adult_view=1",
+        "https://www.melonbooks.co.jp/search/search.php?name=test",
+    ],
+)
+def test_canonical_url_fetched_with_cipher_adapter(url):
+    scraper = DoujinScraper()
+    canonical_url = canonicalize_url(url)
+
+    assert canonical_url.startswith("https://melonbooks.co.jp/")
+    assert isinstance(scraper.session.get_adapter(canonical_url), AddedCipherAdapter)